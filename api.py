@@ -1,11 +1,96 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Cookie, FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Optional
-from chat_response import generate_response, ConversationContext
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, AsyncIterator, Iterator, List, Dict, Literal, Optional
+import json
+import logging
+import os
+import signal
+import time
+import uuid
+from chat_response import (generate_response, iter_response, answer_batch_item, structured_filters,
+                           get_catalog, ConversationContext, DEFAULT_DATASET_PATH)
+from metrics import CONTENT_TYPE, REGISTRY, StageTimer
+from paper import MAX_TOTAL_MARKS, PaperSpec, assemble_paper
+from session_store import get_session_store
+from worker_pool import PoolSaturated, PoolTimeout, create_executor
+
+logger = logging.getLogger(__name__)
+
+DATASET_PATH = os.environ.get("CHAT_DATASET_PATH", DEFAULT_DATASET_PATH)
+# Largest number of entries accepted in one /api/chat/batch request
+MAX_BATCH_SIZE = int(os.environ.get("CHAT_MAX_BATCH", 1000))
+# Batch entries answered per trip to the worker pool
+BATCH_CHUNK_SIZE = 32
+# Cookie that carries a browser's session ID between chat requests
+SESSION_COOKIE = "chat_session"
+# Most questions a single chat message may ask for
+MAX_QUESTIONS_PER_MESSAGE = 20
+# Longest a /api/paper request may search for a better paper, in milliseconds
+MAX_PAPER_TIME_BUDGET_MS = 2000
 
 app = FastAPI()
 
+# Blocking work (file I/O, parsing, matching) runs here instead of on the event loop
+executor = create_executor()
+
+REQUEST_COUNT = REGISTRY.counter("http_requests_total", "HTTP requests by method, route and status",
+                                 ("method", "path", "status"))
+REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds",
+                                     "HTTP request latency, including streamed bodies", ("method", "path"))
+
+def loaded_shards():
+    snapshots = [store.current() for store in get_catalog(DATASET_PATH).stores()]
+    return [snapshot for snapshot in snapshots if snapshot is not None]
+
+def session_count() -> Optional[int]:
+    sessions = get_session_store()
+    return len(sessions) if hasattr(sessions, "__len__") else None
+
+REGISTRY.gauge("chat_dataset_records", "Records in the loaded question bank shards",
+               lambda: sum(snapshot.live_count for snapshot in loaded_shards()))
+REGISTRY.gauge("chat_dataset_shards", "Question bank shards loaded", lambda: len(loaded_shards()))
+REGISTRY.gauge("chat_dataset_version", "Sum of the loaded shard versions",
+               lambda: sum(snapshot.version for snapshot in loaded_shards()))
+REGISTRY.gauge("chat_dataset_reloads_total", "Times a question bank shard was loaded",
+               lambda: sum(store.reload_count for store in get_catalog(DATASET_PATH).stores()), type="counter")
+REGISTRY.gauge("chat_sessions", "Conversations held by the in-memory session store", session_count)
+REGISTRY.gauge("chat_pool_pending", "Requests running or waiting for a worker", lambda: executor.pending)
+
+class MetricsMiddleware:
+    """Count requests and time them until the last byte of the body is sent."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_label(self, path: str) -> str:
+        # Unknown paths share one label so scanners can't blow up the label set
+        if self._routes is None:
+            self._routes = {route.path for route in app.routes}
+        return path if path in self._routes else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            path = self.route_label(scope["path"])
+            REQUEST_COUNT.inc((scope["method"], path, str(status)))
+            REQUEST_SECONDS.observe(time.perf_counter() - start, (scope["method"], path))
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -13,23 +98,339 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Session-Id"],  # Lets browser clients read the session ID
 )
+app.add_middleware(MetricsMiddleware)
 
 class ChatRequest(BaseModel):
     message: str
     conversationHistory: Optional[List[Dict[str, str]]] = []
+    sessionId: Optional[str] = None
+    # Questions to show at once, and an opt-in streaming format
+    count: int = Field(1, ge=1, le=MAX_QUESTIONS_PER_MESSAGE)
+    stream: Optional[Literal["sse", "ndjson"]] = None
+    # Key of a subject to answer from (see /api/subjects); by default the message is routed
+    subject: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
-    
+    sessionId: str
+
+class QuestionQuery(BaseModel):
+    chapter: Optional[str] = None
+    year: Optional[str] = None
+    difficulty: Optional[str] = None
+    frequency: Optional[str] = None
+    marks: Optional[int] = None
+    count: int = Field(1, ge=1, le=MAX_QUESTIONS_PER_MESSAGE)
+
+class BatchItem(BaseModel):
+    # Exactly one of a chat message or a structured query
+    message: Optional[str] = None
+    query: Optional[QuestionQuery] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    stream: bool = False
+
+class BatchResult(BaseModel):
+    index: int
+    response: Optional[str] = None
+    questions: Optional[List[Dict[str, Any]]] = None
+    error: Optional[str] = None
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+    version: int
+
+class ReloadResponse(BaseModel):
+    records: int
+    version: int
+
+class SubjectInfo(BaseModel):
+    key: str
+    name: str
+    chapters: List[str]
+    shards: int
+
+class PaperRequest(BaseModel):
+    total_marks: int = Field(..., ge=1, le=MAX_TOTAL_MARKS)
+    # Chapters to draw from (all by default), and the questions each must contribute
+    chapters: Optional[List[str]] = None
+    min_per_chapter: int = Field(0, ge=0)
+    chapter_minimums: Optional[Dict[str, int]] = None
+    # Share of the marks at each complexity level, e.g. {"low": 0.3, "medium": 0.5, "high": 0.2}
+    complexity: Optional[Dict[str, float]] = None
+    year: Optional[str] = None
+    frequency: Optional[str] = None
+    subject: Optional[str] = None
+    seed: Optional[int] = None
+    time_budget_ms: int = Field(250, ge=10, le=MAX_PAPER_TIME_BUDGET_MS)
+
+class PaperResponse(BaseModel):
+    questions: List[Dict[str, Any]]
+    total_marks: int
+    target_marks: int
+    exact: bool
+    by_chapter: Dict[str, Dict[str, int]]
+    by_complexity: Dict[str, int]
+    notes: List[str]
+    seed: int
+    version: int
+    iterations: int
+    timed_out: bool
+    elapsed_ms: float
+
+async def run_blocking(func, *args):
+    """Run ``func`` on the worker pool, turning backpressure into 429/503 responses."""
+    try:
+        return await executor.run(func, *args)
+    except PoolSaturated:
+        raise HTTPException(status_code=429, detail="Too many requests, please retry shortly",
+                            headers={"Retry-After": "1"})
+    except PoolTimeout:
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly",
+                            headers={"Retry-After": "1"})
+
+@app.on_event("startup")
+async def load_question_bank():
+    # Parse the question bank once, before the first request arrives
+    try:
+        await run_blocking(get_catalog(DATASET_PATH).snapshot)
+    except OSError as e:
+        # Keep serving: requests retry the load and report the error until the file exists
+        logger.error("Could not load the question bank %s (%s); set CHAT_DATASET_PATH to a question bank file",
+                     DATASET_PATH, e)
+
+@app.on_event("shutdown")
+async def stop_executor():
+    executor.shutdown()
+
+@app.post("/api/reload")
+async def reload_endpoint(http_response: Response) -> ReloadResponse:
+    """Re-read the question bank now.
+
+    Under serve.py the parent reloads once and replaces every worker, so
+    this only signals it and answers 202 with the version still served.
+    """
+    master = os.environ.get("CHAT_PREFORK_MASTER")
+    try:
+        if master:
+            # Loading here too would give this worker a private copy it is about to drop
+            os.kill(int(master), signal.SIGHUP)
+            snapshot = await run_blocking(get_catalog(DATASET_PATH).snapshot)
+            http_response.status_code = 202
+            return ReloadResponse(records=snapshot.live_count, version=snapshot.version)
+        snapshot = await run_blocking(get_catalog(DATASET_PATH).reload)
+        return ReloadResponse(records=snapshot.live_count, version=snapshot.version)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Reloading %s failed", DATASET_PATH)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/subjects")
+async def subjects_endpoint() -> List[SubjectInfo]:
+    catalog = get_catalog(DATASET_PATH)
+    return [SubjectInfo(key=subject.key, name=subject.name, chapters=subject.chapters, shards=len(subject.shards))
+            for subject in catalog.subjects.values()]
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Request, stage, cache and dataset metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+def format_event(stream_format: str, payload: Dict, event: Optional[str] = None) -> str:
+    """Encode one streamed message as a server-sent event or an NDJSON line."""
+    data = json.dumps(payload, ensure_ascii=False)
+    if stream_format == "sse":
+        return (f"event: {event}\n" if event else "") + f"data: {data}\n\n"
+    if event:
+        payload = dict(payload, event=event)
+        data = json.dumps(payload, ensure_ascii=False)
+    return data + "\n"
+
+async def stream_response(chunks: Iterator[str], stream_format: str, session_id: str,
+                          timer: Optional[StageTimer] = None) -> AsyncIterator[str]:
+    """Relay response chunks to the client as the worker pool produces them.
+
+    With a ``timer``, the done event carries the per-stage timings in milliseconds.
+    """
+    try:
+        while True:
+            chunk = await run_blocking(next, chunks, None)
+            if chunk is None:
+                break
+            yield format_event(stream_format, {"delta": chunk})
+        done = {"sessionId": session_id}
+        if timer is not None:
+            done["timings"] = timer.milliseconds()
+        yield format_event(stream_format, done, event="done")
+    except HTTPException as e:
+        # The status line is already sent, so report a mid-stream failure in-band
+        yield format_event(stream_format, {"error": e.detail, "status": e.status_code}, event="error")
+    except Exception as e:
+        logger.exception("Streaming a chat response failed")
+        yield format_event(stream_format, {"error": str(e), "status": 500}, event="error")
+    finally:
+        # Saves the session even if the client went away mid-response
+        try:
+            chunks.close()
+        except ValueError:
+            # Still running on a worker after a disconnect; it saves the session when done
+            pass
+
+def remember_session(response: Response, session_id: str):
+    response.headers["X-Session-Id"] = session_id
+    # Browsers send the cookie back, so follow-ups work without echoing sessionId
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+
 @app.post("/api/chat")
-async def chat_endpoint(request: ChatRequest) -> ChatResponse:
+async def chat_endpoint(request: ChatRequest, http_response: Response, x_timing: bool = Header(False),
+                        x_session_id: Optional[str] = Header(None),
+                        chat_session: Optional[str] = Cookie(None)):
+    """Answer a chat message.
+
+    The conversation is picked by ``sessionId`` in the body, then the
+    ``X-Session-Id`` header, then the session cookie; without any of them
+    a new one starts.
+
+    Clients that send ``X-Timing: 1`` (or true/yes/on) get the time spent in
+    each stage back in a ``Server-Timing`` header (or, when streaming, in the
+    done event). ``X-Timing: 0`` (or false/no/off) turns it off again.
+    """
+    start = time.perf_counter()
+    timer = StageTimer() if x_timing else None
+    if request.subject and get_catalog(DATASET_PATH).subject(request.subject) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown subject '{request.subject}'")
     try:
+        # Each conversation keeps its own context; new clients get a fresh session
+        session_id = request.sessionId or x_session_id or chat_session or uuid.uuid4().hex
+        
+        if request.stream:
+            chunks = iter_response(request.message, DATASET_PATH, session_id, request.count, timer,
+                                   request.subject)
+            media_type = "text/event-stream" if request.stream == "sse" else "application/x-ndjson"
+            streaming = StreamingResponse(stream_response(chunks, request.stream, session_id, timer),
+                                          media_type=media_type, headers={"Cache-Control": "no-cache"})
+            remember_session(streaming, session_id)
+            return streaming
+        
         # Generate response using our chat logic
-        response = generate_response(request.message)
+        response = await run_blocking(generate_response, request.message, DATASET_PATH, session_id,
+                                      request.count, timer, request.subject)
+        
+        if timer is not None:
+            # "total" also covers the wait for a worker
+            total = (time.perf_counter() - start) * 1000
+            http_response.headers["Server-Timing"] = f"{timer.server_timing()}, total;dur={total:.3f}"
+        remember_session(http_response, session_id)
+        return ChatResponse(response=response, sessionId=session_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Chat request failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def answer_batch_chunk(snapshot, items: List[BatchItem], start: int) -> List[Dict]:
+    """Answer a slice of a batch; a failing entry reports its error instead of failing the batch."""
+    results = []
+    for index, item in enumerate(items, start):
+        try:
+            if (item.message is None) == (item.query is None):
+                raise ValueError("Each item needs exactly one of 'message' or 'query'")
+            if item.message is not None:
+                result = answer_batch_item(snapshot, message=item.message)
+            else:
+                query = item.query
+                filters = structured_filters(query.chapter, query.year, query.difficulty,
+                                             query.frequency, query.marks, get_catalog(DATASET_PATH).aliases)
+                result = answer_batch_item(snapshot, filters=filters, count=query.count)
+        except Exception as e:
+            result = {"error": str(e)}
+        result["index"] = index
+        results.append(result)
+    return results
+
+async def iter_batch_results(snapshot, items: List[BatchItem]) -> AsyncIterator[Dict]:
+    for start in range(0, len(items), BATCH_CHUNK_SIZE):
+        chunk = items[start:start + BATCH_CHUNK_SIZE]
+        for result in await run_blocking(answer_batch_chunk, snapshot, chunk, start):
+            yield result
+
+@app.post("/api/chat/batch")
+async def chat_batch_endpoint(request: BatchRequest):
+    """Answer many messages or structured queries against one dataset snapshot.
+
+    With ``stream`` set, results are sent as NDJSON lines as each chunk of
+    the batch is answered; otherwise they come back in a single response.
+    """
+    if len(request.items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {MAX_BATCH_SIZE} items")
+    try:
+        snapshot = await run_blocking(get_catalog(DATASET_PATH).snapshot)
+        
+        if request.stream:
+            async def ndjson_lines():
+                try:
+                    async for result in iter_batch_results(snapshot, request.items):
+                        yield json.dumps(result, ensure_ascii=False) + "\n"
+                except HTTPException as e:
+                    # The status line is already sent, so report a mid-stream failure in-band
+                    yield json.dumps({"error": e.detail, "status": e.status_code}) + "\n"
+            return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson",
+                                     headers={"X-Dataset-Version": str(snapshot.version)})
         
-        return ChatResponse(response=response)
+        results = [result async for result in iter_batch_results(snapshot, request.items)]
+        return BatchResponse(results=results, version=snapshot.version)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Batch request failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def build_paper(request: PaperRequest, subject) -> Dict:
+    catalog = get_catalog(DATASET_PATH)
+    aliases = subject.aliases if subject is not None else catalog.aliases
+    chapters = {chapter.lower(): chapter for chapter in (subject or catalog).chapters}
+    def resolve(chapter: str) -> str:
+        # Chapter names in any case, or aliases, as in chat messages
+        key = chapter.strip().lower()
+        resolved = chapters.get(key) or aliases.get(key)
+        if resolved is None:
+            raise ValueError(f"Unknown chapter '{chapter}'")
+        return resolved
+
+    spec = PaperSpec(request.total_marks,
+                     chapters=[resolve(chapter) for chapter in request.chapters or ()],
+                     min_per_chapter=request.min_per_chapter,
+                     chapter_minimums={resolve(chapter): minimum
+                                       for chapter, minimum in (request.chapter_minimums or {}).items()},
+                     complexity_mix=request.complexity)
+    filters = structured_filters(None, request.year, None, request.frequency, None, aliases)
+    return assemble_paper(catalog.snapshot(subject), spec, filters, request.seed,
+                          request.time_budget_ms / 1000)
+
+@app.post("/api/paper")
+async def paper_endpoint(request: PaperRequest) -> PaperResponse:
+    """Assemble a practice paper worth ``total_marks`` from the question bank.
+
+    Chapter minimums and the complexity mix are met as closely as the bank
+    allows; ``notes`` explains any shortfall. The same ``seed`` gives the
+    same paper until the dataset changes.
+    """
+    subject = get_catalog(DATASET_PATH).subject(request.subject)
+    if request.subject and subject is None:
+        raise HTTPException(status_code=404, detail=f"Unknown subject '{request.subject}'")
+    try:
+        paper = await run_blocking(build_paper, request, subject)
+        return PaperResponse(**paper)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
+        logger.exception("Paper request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 # For testing the API directly
@@ -0,0 +1,115 @@
+"""Compare FuzzyIndex against difflib.get_close_matches.
+
+Run from the repository root:
+
+    python -m benchmarks.fuzzy_match [--vocab-size 2000] [--messages 2000]
+
+Both matchers are run over the same misspelled messages, the results are
+checked to be identical, and the time per message is printed for the real
+chapter vocabulary and for a vocabulary padded out with words taken from
+questions.jsonl.
+"""
+import argparse
+import json
+import random
+import re
+import time
+from difflib import get_close_matches
+
+from chat_response import CHAPTER_ALIASES, VALID_CHAPTERS
+from fuzzy_index import FuzzyIndex
+from query_parser import FUZZY_CUTOFF, MIN_FUZZY_WORD_LENGTH
+
+
+def corpus_words(path):
+    words = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            words.update(re.findall(r'[a-z]{4,}', json.loads(line)['question'].lower()))
+    return sorted(words)
+
+
+def misspell(word, rng):
+    if len(word) < 5 or rng.random() < 0.5:
+        return word
+    position = rng.randrange(len(word))
+    edit = rng.choice(("drop", "swap", "replace"))
+    if edit == "drop":
+        return word[:position] + word[position + 1:]
+    if edit == "swap" and position < len(word) - 1:
+        return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    return word[:position] + rng.choice("abcdefghijklmnopqrstuvwxyz") + word[position + 1:]
+
+
+def make_messages(words, count, rng):
+    return [[misspell(rng.choice(words), rng) for _ in range(rng.randint(4, 12))] for _ in range(count)]
+
+
+def run_difflib(messages, terms):
+    results = []
+    for words in messages:
+        for word in words:
+            if len(word) < MIN_FUZZY_WORD_LENGTH:
+                continue
+            matches = get_close_matches(word, terms, n=1, cutoff=FUZZY_CUTOFF)
+            results.append(matches[0] if matches else None)
+    return results
+
+
+def run_index(messages, index):
+    results = []
+    for words in messages:
+        for word in words:
+            if len(word) < MIN_FUZZY_WORD_LENGTH:
+                continue
+            match = index.best_match(word)
+            results.append(match[0] if match else None)
+    return results
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def compare(label, terms, messages):
+    expected, difflib_time = timed(run_difflib, messages, terms)
+    cold_index = FuzzyIndex(terms, cutoff=FUZZY_CUTOFF, cache_size=0)
+    cold, cold_time = timed(run_index, messages, cold_index)
+    warm_index = FuzzyIndex(terms, cutoff=FUZZY_CUTOFF)
+    run_index(messages, warm_index)
+    warm, warm_time = timed(run_index, messages, warm_index)
+
+    if cold != expected or warm != expected:
+        raise SystemExit(f"{label}: FuzzyIndex results differ from difflib")
+
+    per_message = 1e6 / len(messages)
+    print(f"{label} ({len(terms)} terms, {len(messages)} messages, identical matches)")
+    print(f"  difflib.get_close_matches: {difflib_time * per_message:9.1f} us/message")
+    print(f"  FuzzyIndex (uncached):     {cold_time * per_message:9.1f} us/message "
+          f"({difflib_time / cold_time:.1f}x)")
+    print(f"  FuzzyIndex (cached):       {warm_time * per_message:9.1f} us/message "
+          f"({difflib_time / warm_time:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default="questions.jsonl")
+    parser.add_argument("--vocab-size", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chapter_terms = list(VALID_CHAPTERS) + list(CHAPTER_ALIASES)
+    words = corpus_words(args.questions)
+    messages = make_messages(words + list(CHAPTER_ALIASES), args.messages, rng)
+
+    compare("Chapter vocabulary", chapter_terms, messages)
+    extra = rng.sample(words, min(args.vocab_size, len(words)))
+    compare("Padded vocabulary", chapter_terms + extra, messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""Benchmark the chat and dataset paths on synthetic question banks.
+
+Run from the repository root:
+
+    python -m benchmarks.suite [--sizes 1000,100000,1000000] [--output results.json]
+
+Banks of each size are generated once (see benchmarks/synthetic.py) and
+kept in --workdir. For every size the suite times dataset loading, query
+parsing, matching, follow-ups and whole chat turns in-process, the three
+dataset conversions chunk by chunk, and a concurrent load test of the
+FastAPI app through an in-process ASGI client (skipped when FastAPI is not
+installed). Each stage reports throughput, latency percentiles and, from a
+second pass under tracemalloc, peak Python memory.
+
+Results are printed and, with --output, written as JSON. Passing an earlier
+results file as --baseline reports every stage that got slower by more
+than --tolerance and exits with status 1 if any did.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from benchmarks.synthetic import bank_path, generate_bank
+from chat_response import (CHAPTER_ALIASES, VALID_CHAPTERS, VALID_DIFFICULTIES, VALID_FREQUENCIES,
+                           ConversationContext, _generate_response, detect_chapter, detect_difficulty,
+                           detect_frequency, detect_marks, detect_year, find_relevant_responses,
+                           generate_response, handle_followup, parse_query, query_cache)
+from enhance_dataset import analyze_patterns
+from pipeline import iter_chunks, iter_records, run_pipeline, transform_chunk
+from question_store import QuestionStore, get_store, load_dataset
+
+DEFAULT_SIZES = "1000,100000,1000000"
+DEFAULT_REQUESTS = 2000
+DEFAULT_CONCURRENCY = 16
+CHUNK_SIZE = 1000
+# Records a stage whose cost grows with the bank may visit in total, so the
+# largest banks run fewer operations instead of taking hours
+RECORD_BUDGET = 2_000_000
+
+TOPICS = ["gray code", "k-map", "flip-flop", "multiplexer", "decoder", "counter", "parity",
+          "excess-3", "half adder", "shift register", "NAND gates", "two's complement"]
+
+
+class Measurement:
+    """Latencies of the timed operations of one stage run.
+
+    ``items`` is what throughput is counted in (records for whole-file
+    stages, requests otherwise) and ``seconds`` the wall time, when the
+    operations overlapped instead of running one after another.
+    """
+
+    def __init__(self, latencies: List[float], items: Optional[int] = None,
+                 seconds: Optional[float] = None, errors: int = 0):
+        self.latencies = latencies
+        self.items = items if items is not None else len(latencies)
+        self.seconds = seconds if seconds is not None else sum(latencies)
+        self.errors = errors
+
+
+def timed_ops(op: Callable, inputs) -> List[float]:
+    latencies = []
+    for value in inputs:
+        start = time.perf_counter()
+        op(value)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def make_messages(count: int, rng: random.Random) -> List[str]:
+    """Chat messages in the shapes users send: filters, aliases, years and free-text topics."""
+    chapters = sorted(VALID_CHAPTERS)
+    aliases = sorted(CHAPTER_ALIASES)
+    difficulties = sorted(VALID_DIFFICULTIES)
+    frequencies = sorted(VALID_FREQUENCIES)
+    shapes = [
+        lambda: f"Give me a {rng.choice(difficulties)} difficulty question from {rng.choice(chapters)}",
+        lambda: f"{rng.choice(aliases)} questions worth {rng.choice([4, 5, 7, 8, 10])} marks",
+        lambda: f"Show me a question from {rng.randint(2010, 2025)} on {rng.choice(chapters)}",
+        lambda: f"{rng.choice(frequencies)} questions from {rng.choice(aliases)}",
+        lambda: f"question about {rng.choice(TOPICS)}",
+        lambda: f"explain {rng.choice(TOPICS)} in {rng.choice(aliases)}",
+    ]
+    return [rng.choice(shapes)() for _ in range(count)]
+
+
+class Bank:
+    """The synthetic files and chat messages used for one bank size."""
+
+    def __init__(self, size: int, workdir: str, seed: int, requests: int):
+        self.size = size
+        self.seed = seed
+        self.requests = requests
+        self.instruction_path = generate_bank(bank_path(workdir, size, seed, "instruction"), size, seed, "instruction")
+        self.question_path = generate_bank(bank_path(workdir, size, seed, "question"), size, seed, "question")
+        self.conversation_path = bank_path(workdir, size, seed, "conversation")
+        self.messages = make_messages(requests, random.Random(seed))
+
+    def conversations(self) -> str:
+        if not os.path.exists(self.conversation_path):
+            run_pipeline(self.instruction_path, self.conversation_path, ["convert"])
+        return self.conversation_path
+
+    def scaled_requests(self) -> int:
+        return min(self.requests, max(20, RECORD_BUDGET // self.size))
+
+
+def bench_load_dataset(bank: Bank) -> Measurement:
+    return Measurement(timed_ops(load_dataset, [bank.instruction_path]), items=bank.size)
+
+
+def bench_snapshot_load(bank: Bank) -> Measurement:
+    # A fresh store parses the file and builds the facet and text indexes; the
+    # text index is built on first use, so it is touched here to be counted
+    store = QuestionStore(bank.instruction_path)
+    return Measurement(timed_ops(lambda _: store.reload().text_index, [None]), items=bank.size)
+
+
+def bench_parse_query(bank: Bank) -> Measurement:
+    return Measurement(timed_ops(parse_query, bank.messages))
+
+
+def bench_detect_fields(bank: Bank) -> Measurement:
+    def detect_all(message):
+        for detect in (detect_chapter, detect_difficulty, detect_frequency, detect_marks, detect_year):
+            detect(message)
+    return Measurement(timed_ops(detect_all, bank.messages))
+
+
+def bench_find_relevant_responses(bank: Bank) -> Measurement:
+    snapshot = get_store(bank.instruction_path).snapshot()
+    query_cache.clear()
+    random.seed(bank.seed)
+    messages = bank.messages[:bank.scaled_requests()]
+    return Measurement(timed_ops(lambda message: find_relevant_responses(snapshot, message), messages))
+
+
+def bench_handle_followup(bank: Bank) -> Measurement:
+    snapshot = get_store(bank.instruction_path).snapshot()
+    query_cache.clear()
+    random.seed(bank.seed)
+    context = ConversationContext()
+    _generate_response(f"Give me a question from {sorted(VALID_CHAPTERS)[0]}", bank.instruction_path,
+                       context, snapshot)
+    return Measurement(timed_ops(lambda _: handle_followup("yes", context, snapshot), range(bank.requests)))
+
+
+def bench_chat_turn(bank: Bank) -> Measurement:
+    # Whole chat turns with sessions, alternating new requests and follow-ups
+    get_store(bank.instruction_path).snapshot()
+    query_cache.clear()
+    random.seed(bank.seed)
+    turns = [(f"bench-{i // 2 % 64}", message if i % 2 == 0 else "yes") for i, message in enumerate(bank.messages)]
+    return Measurement(timed_ops(lambda turn: generate_response(turn[1], bank.instruction_path, turn[0]), turns))
+
+
+def bench_pipeline(stage_name: str, input_path: str, chapter_stats=None, seed: int = 0) -> Measurement:
+    # One operation per chunk, the unit of work a pipeline worker gets
+    latencies = []
+    records = 0
+    for chunk_index, lines in enumerate(iter_chunks(input_path, CHUNK_SIZE)):
+        start = time.perf_counter()
+        transform_chunk([stage_name], chapter_stats, seed, None, chunk_index, chunk_index * CHUNK_SIZE, lines)
+        latencies.append(time.perf_counter() - start)
+        records += len(lines)
+    return Measurement(latencies, items=records)
+
+
+def bench_convert(bank: Bank) -> Measurement:
+    return bench_pipeline("convert", bank.instruction_path)
+
+
+def bench_update_prompts(bank: Bank) -> Measurement:
+    return bench_pipeline("update-prompts", bank.conversations())
+
+
+def bench_enhance(bank: Bank) -> Measurement:
+    chapter_stats = analyze_patterns(iter_records(bank.question_path))
+    return bench_pipeline("enhance", bank.question_path, chapter_stats, bank.seed)
+
+
+async def asgi_request(app, method: str, path: str, body: Optional[Dict] = None):
+    """Send one HTTP request straight to an ASGI app; returns (status, body bytes)."""
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode("ascii"),
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode("ascii"))],
+    }
+    request_sent = False
+    status = 0
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        # The client never disconnects; wait until the app stops listening
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Run the app's startup and shutdown handlers around the block."""
+    to_app: asyncio.Queue = asyncio.Queue()
+    from_app: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, to_app.get, from_app.put))
+    await to_app.put({"type": "lifespan.startup"})
+    message = await from_app.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(message.get("message", "Application startup failed"))
+    try:
+        yield
+    finally:
+        await to_app.put({"type": "lifespan.shutdown"})
+        await from_app.get()
+        await task
+
+
+async def load_test(app, messages: List[str], concurrency: int) -> Measurement:
+    """Clients each hold a session and alternate new requests with follow-ups."""
+    requests = iter(range(len(messages)))
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        session_id = None
+        for i in requests:
+            message = messages[i] if i % 2 == 0 or session_id is None else "yes"
+            start = time.perf_counter()
+            status, body = await asgi_request(app, "POST", "/api/chat", {"message": message, "sessionId": session_id})
+            latencies.append(time.perf_counter() - start)
+            if status == 200:
+                session_id = json.loads(body)["sessionId"]
+            else:
+                errors += 1
+
+    async with lifespan(app):
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        seconds = time.perf_counter() - start
+    return Measurement(latencies, seconds=seconds, errors=errors)
+
+
+def bench_api_chat(bank: Bank, concurrency: int) -> Measurement:
+    import api
+    from worker_pool import create_executor
+
+    api.DATASET_PATH = bank.instruction_path
+    # Startup loads the bank and shutdown stops the pool, so every run gets its own
+    api.executor = create_executor()
+    query_cache.clear()
+    random.seed(bank.seed)
+    return asyncio.run(load_test(api.app, bank.messages, concurrency))
+
+
+STAGES = {
+    "load_dataset": bench_load_dataset,
+    "snapshot_load": bench_snapshot_load,
+    "parse_query": bench_parse_query,
+    "detect_fields": bench_detect_fields,
+    "find_relevant_responses": bench_find_relevant_responses,
+    "handle_followup": bench_handle_followup,
+    "chat_turn": bench_chat_turn,
+    "convert": bench_convert,
+    "update_prompts": bench_update_prompts,
+    "enhance": bench_enhance,
+    "api_chat": bench_api_chat,
+}
+
+
+def summarize(stage: str, size: int, measurement: Measurement, peak_bytes: Optional[int]) -> Dict:
+    latencies = sorted(measurement.latencies)
+    result = {
+        "stage": stage,
+        "size": size,
+        "ops": len(latencies),
+        "items": measurement.items,
+        "seconds": round(measurement.seconds, 6),
+        "throughput": round(measurement.items / measurement.seconds, 3) if measurement.seconds else None,
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 4) if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 0.50), 4),
+            "p90": round(1000 * percentile(latencies, 0.90), 4),
+            "p99": round(1000 * percentile(latencies, 0.99), 4),
+            "max": round(1000 * (latencies[-1] if latencies else 0.0), 4),
+        },
+        "peak_memory_mb": round(peak_bytes / 2 ** 20, 3) if peak_bytes is not None else None,
+    }
+    if measurement.errors:
+        result["errors"] = measurement.errors
+    return result
+
+
+def run_stage(name: str, func: Callable[[], Measurement], size: int, memory: bool) -> Dict:
+    try:
+        measurement = func()
+    except ImportError as e:
+        return {"stage": name, "size": size, "skipped": f"missing dependency: {e.name}"}
+    peak_bytes = None
+    if memory:
+        # A separate pass, since tracing allocations slows everything down
+        tracemalloc.start()
+        try:
+            func()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return summarize(name, size, measurement, peak_bytes)
+
+
+def print_result(result: Dict):
+    if "skipped" in result:
+        print(f"  {result['stage']:<24} skipped ({result['skipped']})")
+        return
+    latency = result["latency_ms"]
+    memory = f"{result['peak_memory_mb']:9.1f} MB" if result["peak_memory_mb"] is not None else ""
+    print(f"  {result['stage']:<24} {result['throughput'] or 0:12.1f}/s  p50 {latency['p50']:9.3f} ms  "
+          f"p90 {latency['p90']:9.3f} ms  p99 {latency['p99']:9.3f} ms  {memory}")
+
+
+def find_regressions(results: List[Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Stages slower than in ``baseline`` by more than ``tolerance`` (a fraction)."""
+    previous = {(result["stage"], result["size"]): result
+                for result in baseline["results"] if "skipped" not in result}
+    regressions = []
+    for result in results:
+        before = previous.get((result["stage"], result["size"]))
+        if before is None or "skipped" in result:
+            continue
+        label = f"{result['stage']} ({result['size']} records)"
+        if before["throughput"] and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {before['throughput']:.1f}/s -> {result['throughput']:.1f}/s")
+        before_p90, after_p90 = before["latency_ms"]["p90"], result["latency_ms"]["p90"]
+        if before_p90 and after_p90 > before_p90 * (1 + tolerance):
+            regressions.append(f"{label}: p90 latency {before_p90:.3f} ms -> {after_p90:.3f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated bank sizes")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma-separated stages to run ({', '.join(STAGES)})")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="chat messages per stage")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="concurrent clients in the API load test")
+    parser.add_argument("--workdir", default=os.path.join("benchmarks", "data"),
+                        help="where synthetic banks are generated and kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak-memory pass")
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    parser.add_argument("--baseline", default=None, help="earlier results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction a stage may slow down before it counts as a regression")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    stage_names = [name.strip() for name in args.stages.split(",") if name.strip()]
+    unknown = [name for name in stage_names if name not in STAGES]
+    if unknown:
+        parser.error(f"Unknown stage(s) {', '.join(unknown)}; choose from {', '.join(STAGES)}")
+
+    results = []
+    for size in sizes:
+        print(f"Generating a {size}-record bank in {args.workdir}...")
+        bank = Bank(size, args.workdir, args.seed, args.requests)
+        print(f"{size} records")
+        for name in stage_names:
+            if name == "api_chat":
+                func = lambda: bench_api_chat(bank, args.concurrency)
+            else:
+                func = lambda: STAGES[name](bank)
+            result = run_stage(name, func, size, not args.no_memory)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "seed": args.seed,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote the results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Generate synthetic question banks for benchmarking.
+
+    python -m benchmarks.synthetic 100000 benchmarks/data/bank_100000.jsonl
+
+Records follow the schema of questions.jsonl (or, with ``--schema
+instruction``, of updated_instruction_dataset.jsonl). Each one is a real
+question with its numbers changed and its year and metadata resampled, so
+text length, vocabulary and the metadata distribution stay realistic at
+any size. The output only depends on the size and the seed.
+"""
+import argparse
+import json
+import os
+import random
+import re
+from typing import Dict, Iterator, List
+
+SCHEMAS = ("question", "instruction")
+YEARS = [str(year) for year in range(2010, 2026)]
+_NUMBER_PATTERN = re.compile(r"\d+")
+# The two phrasings used by updated_instruction_dataset.jsonl
+INSTRUCTION_TEMPLATES = (
+    "Design a {complexity_level}-level {question_type} question from '{chapter}' chapter that carries {marks} marks.",
+    "Generate a {complexity_level} difficulty {question_type} question worth {marks} marks from the chapter '{chapter}'.",
+)
+
+
+def load_templates(path: str = "questions.jsonl") -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _vary_numbers(text: str, rng: random.Random) -> str:
+    def replace(match):
+        digits = match.group()
+        return "".join(rng.choice("0123456789") for _ in digits)
+    return _NUMBER_PATTERN.sub(replace, text)
+
+
+def iter_synthetic(templates: List[Dict], size: int, seed: int = 0, schema: str = "question") -> Iterator[Dict]:
+    rng = random.Random(seed)
+    frequencies = [template["metadata"]["pattern_frequency"] for template in templates]
+    complexities = [template["metadata"]["complexity_level"] for template in templates]
+    for _ in range(size):
+        template = rng.choice(templates)
+        metadata = dict(template["metadata"])
+        metadata["previous_years"] = rng.choice(YEARS)
+        metadata["pattern_frequency"] = rng.choice(frequencies)
+        metadata["complexity_level"] = rng.choice(complexities)
+        text = _vary_numbers(template["question"], rng)
+        if schema == "question":
+            yield {"question": text, "metadata": metadata}
+        else:
+            yield {
+                "instruction": rng.choice(INSTRUCTION_TEMPLATES).format(**metadata),
+                "input": "",
+                "output": text,
+                "metadata": metadata,
+            }
+
+
+def generate_bank(output_path: str, size: int, seed: int = 0, schema: str = "question",
+                  templates_path: str = "questions.jsonl") -> str:
+    """Write a synthetic bank to ``output_path`` unless it already exists."""
+    if os.path.exists(output_path):
+        return output_path
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    templates = load_templates(templates_path)
+    temp_path = output_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for record in iter_synthetic(templates, size, seed, schema):
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def bank_path(workdir: str, size: int, seed: int, schema: str) -> str:
+    return os.path.join(workdir, f"{schema}_{size}_{seed}.jsonl")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("size", type=int, help="number of records")
+    parser.add_argument("output", help="output JSONL file")
+    parser.add_argument("--schema", choices=SCHEMAS, default="question")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--templates", default="questions.jsonl", help="real questions to vary")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        os.remove(args.output)
+    generate_bank(args.output, args.size, args.seed, args.schema, args.templates)
+    print(f"Wrote {args.size} synthetic records to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Content-hash manifests for incremental pipeline builds.
+
+A manifest records, for every input record of the last build, a key and
+the byte range its output occupies in the output file. The key is a
+hash of the record's JSON line plus whatever shared state its output
+depends on, such as its chapter's statistics for ``enhance`` or its
+duplicate cluster for ``dedup``. On the next build, records whose key is
+unchanged are copied from the old output instead of being transformed
+again. Records no longer in the input are dropped.
+
+The manifest is a JSON header line followed by one ``key offset length``
+line per record (length 0 for records that produced no output).
+"""
+import hashlib
+import json
+import os
+from typing import BinaryIO, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+MANIFEST_FORMAT = 1
+MANIFEST_SUFFIX = ".manifest"
+
+
+def manifest_path_for(output_path: str) -> str:
+    return output_path + MANIFEST_SUFFIX
+
+
+def record_key(line: str, digests: Sequence[str] = ()) -> str:
+    """Key of one input line together with the shared state its output depends on."""
+    digest = hashlib.blake2b(line.strip().encode("utf-8"), digest_size=16)
+    for part in digests:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def state_digest(value) -> str:
+    """Digest of a JSON-serializable piece of shared state."""
+    data = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class BuildManifest:
+    def __init__(self, build: Dict, entries: Optional[List[Tuple[str, int, int]]] = None,
+                 output_size: int = 0, summary: Optional[Dict] = None):
+        self.build = build
+        self.entries = entries if entries is not None else []
+        self.output_size = output_size
+        self.summary = summary or {}
+        self._ranges: Optional[Dict[str, Tuple[int, int]]] = None
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BuildManifest"]:
+        """Read a manifest; None if it is missing or unreadable."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get("format") != MANIFEST_FORMAT:
+                    return None
+                entries = []
+                for line in f:
+                    key, offset, length = line.split()
+                    entries.append((key, int(offset), int(length)))
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(header["build"], entries, header["output_size"], header.get("summary"))
+
+    def save(self, path: str):
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            header = {"format": MANIFEST_FORMAT, "build": self.build, "output_size": self.output_size,
+                      "summary": self.summary}
+            f.write(json.dumps(header) + "\n")
+            f.writelines(f"{key} {offset} {length}\n" for key, offset, length in self.entries)
+        os.replace(temp_path, path)
+
+    def add(self, key: str, offset: int, length: int):
+        self.entries.append((key, offset, length))
+
+    def keys(self) -> FrozenSet[str]:
+        return frozenset(key for key, _, _ in self.entries)
+
+    def output_range(self, key: str) -> Tuple[int, int]:
+        if self._ranges is None:
+            self._ranges = {}
+            for key_, offset, length in self.entries:
+                self._ranges.setdefault(key_, (offset, length))
+        return self._ranges[key]
+
+    def matches(self, build: Dict, output_path: str) -> bool:
+        """Whether this manifest describes ``output_path`` as built with the same settings."""
+        try:
+            return self.build == build and os.path.getsize(output_path) == self.output_size
+        except OSError:
+            return False
+
+
+def read_range(f: BinaryIO, offset: int, length: int) -> bytes:
+    if not length:
+        return b""
+    f.seek(offset)
+    return f.read(length)
@@ -1,8 +1,29 @@
-import json
-import re
-from typing import List, Dict, Optional, Tuple
+from array import array
+from typing import Iterator, List, Dict, Optional, Sequence, Tuple
+import logging
+import os
 import random
-from difflib import get_close_matches
+import re
+from pattern_stats import DEFAULT_STATS_PATH, PatternStats, collect_stats, load_cached
+from query_parser import ParsedQuery, QueryParser
+from question_record import Question
+from query_cache import create_query_cache
+from question_store import DatasetSnapshot, load_dataset
+from result_cursor import ResultCursor, ShuffledCursor
+from text_index import STOPWORDS, tokenize
+from trends import TrendModel, describe_slope
+from session_store import get_session_store
+from subjects import Catalog, Subject, load_catalog
+from metrics import REGISTRY, StageTimer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATASET_PATH = "miscellaneous/updated_instruction_dataset.jsonl"
+# Prebuilt statistics artifact (see pattern_stats.py) used for trend answers
+STATS_PATH = os.environ.get("CHAT_STATS_PATH", DEFAULT_STATS_PATH)
+# Optional catalog of subjects and their shards (see subjects.py); without
+# one, the single bank at the requested dataset path is served
+SUBJECTS_PATH = os.environ.get("CHAT_SUBJECTS_PATH")
 
 # Define the valid categories
 VALID_CHAPTERS = {
@@ -32,180 +53,375 @@ CHAPTER_ALIASES = {
 VALID_DIFFICULTIES = {"low", "medium", "high"}
 VALID_FREQUENCIES = {"yearly", "frequent", "occasional"}
 
+# Common synonyms for the frequency patterns
+FREQUENCY_SYNONYMS = {
+    "regular": "frequent",
+    "annual": "yearly"
+}
+
+# Compiled once; parses every slot of a message in a single pass
+query_parser = QueryParser(VALID_CHAPTERS, CHAPTER_ALIASES, VALID_DIFFICULTIES,
+                           VALID_FREQUENCIES, FREQUENCY_SYNONYMS)
+
+# Words that only name a filter, so they never count as search terms
+SEARCH_STOPWORDS = STOPWORDS | set(tokenize(" ".join(
+    list(VALID_CHAPTERS) + list(CHAPTER_ALIASES) + list(VALID_DIFFICULTIES) + list(VALID_FREQUENCIES)
+    + list(FREQUENCY_SYNONYMS) + ["chapter", "difficulty", "level", "frequency", "frequently",
+                                 "year", "exam", "appeared", "easy", "hard", "random", "another",
+                                 # Question types and ways of asking for a different question
+                                 "numerical", "numeric", "theoretical", "theory", "conceptual", "type", "kind",
+                                 "different", "else", "instead", "again", "once", "similar", "same",
+                                 "easier", "harder", "tougher", "simpler", "just", "only"]
+)))
+
+# Most free-text matches kept per search; follow-ups page through these
+MAX_RANKED_RESULTS = 200
+
+# Match lists of recent filter queries, reused until the dataset reloads
+query_cache = create_query_cache()
+
+STAGE_SECONDS = REGISTRY.histogram("chat_stage_seconds", "Time spent in each stage of answering a chat message",
+                                   ("stage",))
+INDEX_LOOKUPS = REGISTRY.counter("chat_index_lookups_total",
+                                 "Facet and text index queries not answered from the query cache", ("index",))
+REGISTRY.gauge("chat_query_cache_entries", "Filter queries in the query cache", lambda: len(query_cache))
+REGISTRY.gauge("chat_query_cache_hits_total", "Query cache hits", lambda: query_cache.hits, type="counter")
+REGISTRY.gauge("chat_query_cache_misses_total", "Query cache misses", lambda: query_cache.misses, type="counter")
+
+# Session used when no session ID is supplied (e.g. the interactive CLI)
+DEFAULT_SESSION_ID = "default"
+
 # Conversation context
 class ConversationContext:
+    """What the previous answer matched, so follow-ups can continue from it.
+
+    Only the query (filters, plus search terms for text searches) and a
+    cursor position are kept; the matching IDs are looked up again from the
+    snapshot on each follow-up instead of being stored in the session.
+    Filter matches are walked in a seeded random order, search results in
+    rank order.
+    """
     def __init__(self):
         self.last_chapter = None
-        self.last_responses = []
+        self.filters = {}
+        self.search_terms = None
+        self.seed = None
         self.current_response_index = 0
+        self.dataset_version = None
+        self.subject = None
     
-    def update_context(self, chapter: str, responses: List[Dict]):
+    def update_context(self, chapter: str, filters: Dict, cursor: ResultCursor, dataset_version: int,
+                       search_terms: Optional[List[str]] = None):
         self.last_chapter = chapter
-        self.last_responses = responses
-        self.current_response_index = 1  # Start from 1 since we've shown the first response
+        self.filters = filters
+        self.search_terms = search_terms
+        self.seed = getattr(cursor, "seed", None)
+        self.current_response_index = cursor.offset  # Past the responses already shown
+        self.dataset_version = dataset_version
     
     def clear_context(self):
         self.last_chapter = None
-        self.last_responses = []
+        self.filters = {}
+        self.search_terms = None
+        self.seed = None
         self.current_response_index = 0
+        self.dataset_version = None
+    
+    def to_dict(self) -> Dict:
+        return {
+            "last_chapter": self.last_chapter,
+            "filters": self.filters,
+            "search_terms": self.search_terms,
+            "seed": self.seed,
+            "current_response_index": self.current_response_index,
+            "dataset_version": self.dataset_version,
+            "subject": self.subject,
+        }
+    
+    @classmethod
+    def from_dict(cls, state: Optional[Dict]) -> "ConversationContext":
+        context = cls()
+        if state and "filters" in state:
+            context.last_chapter = state["last_chapter"]
+            context.filters = state["filters"]
+            context.search_terms = state.get("search_terms")
+            context.seed = state["seed"]
+            context.current_response_index = state["current_response_index"]
+            context.dataset_version = state["dataset_version"]
+            context.subject = state.get("subject")
+        return context
+
+_catalogs: Dict[str, Catalog] = {}
 
-# Create a global context
-context = ConversationContext()
+def get_catalog(dataset_path: str = DEFAULT_DATASET_PATH) -> Catalog:
+    """The subjects configured by CHAT_SUBJECTS_PATH, or the single subject served from ``dataset_path``."""
+    key = SUBJECTS_PATH or dataset_path
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        if SUBJECTS_PATH:
+            catalog = load_catalog(SUBJECTS_PATH, VALID_DIFFICULTIES, VALID_FREQUENCIES, FREQUENCY_SYNONYMS)
+        else:
+            catalog = Catalog([Subject("default", "Digital Electronics", VALID_CHAPTERS, CHAPTER_ALIASES,
+                                       [dataset_path], VALID_DIFFICULTIES, VALID_FREQUENCIES,
+                                       FREQUENCY_SYNONYMS, stats_path=STATS_PATH, parser=query_parser)])
+        _catalogs[key] = catalog
+    return catalog
 
-def load_dataset(file_path: str) -> List[Dict]:
-    """Load and parse the JSONL dataset."""
-    dataset = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            dataset.append(json.loads(line.strip()))
-    return dataset
+def parse_query(user_input: str) -> ParsedQuery:
+    """Extract every filter from the user input in one pass."""
+    return query_parser.parse(user_input)
 
 def detect_chapter(user_input: str) -> Optional[str]:
     """Detect which chapter the user is asking about using flexible matching."""
-    user_input_lower = user_input.lower()
-    
-    # First try exact matches
-    for chapter in VALID_CHAPTERS:
-        if chapter.lower() in user_input_lower:
-            return chapter
-    
-    # Then try aliases
-    for alias, chapter in CHAPTER_ALIASES.items():
-        if alias in user_input_lower:
-            return chapter
-    
-    # If no exact match or alias found, try fuzzy matching
-    # Create a list of all possible matches (chapter names and aliases)
-    all_possible_matches = list(VALID_CHAPTERS) + list(CHAPTER_ALIASES.keys())
-    
-    # Get words from user input
-    user_words = user_input_lower.split()
-    
-    # Try to match each word from user input
-    for word in user_words:
-        if len(word) < 4:  # Skip very short words
-            continue
-        
-        # Get close matches for this word
-        matches = get_close_matches(word, all_possible_matches, n=1, cutoff=0.8)
-        if matches:
-            matched_term = matches[0]
-            # If matched an alias, return its chapter
-            if matched_term in CHAPTER_ALIASES:
-                return CHAPTER_ALIASES[matched_term]
-            # If matched a chapter name, return the exact chapter name from VALID_CHAPTERS
-            for chapter in VALID_CHAPTERS:
-                if chapter.lower() == matched_term.lower():
-                    return chapter
-    
-    return None
+    return parse_query(user_input).chapter
 
 def detect_difficulty(user_input: str) -> Optional[str]:
     """Detect difficulty level from user input."""
-    user_input_lower = user_input.lower()
-    for difficulty in VALID_DIFFICULTIES:
-        if difficulty in user_input_lower:
-            return difficulty
-    return None
+    return parse_query(user_input).difficulty
 
 def detect_frequency(user_input: str) -> Optional[str]:
     """Detect frequency pattern from user input."""
-    user_input_lower = user_input.lower()
-    for frequency in VALID_FREQUENCIES:
-        if frequency in user_input_lower:
-            return frequency
-    # Add common synonyms
-    if "regular" in user_input_lower:
-        return "frequent"
-    if "annual" in user_input_lower:
-        return "yearly"
-    return None
+    return parse_query(user_input).frequency
 
 def detect_marks(user_input: str) -> Optional[int]:
     """Detect marks from user input."""
-    marks_pattern = r'(\d+)\s*marks?'
-    match = re.search(marks_pattern, user_input.lower())
-    if match:
-        return int(match.group(1))
-    return None
+    return parse_query(user_input).marks
 
 def detect_year(user_input: str) -> Optional[str]:
     """Detect year mentioned in the user input."""
-    # Match both 4-digit years and 2-digit years
-    year_patterns = [
-        r'\b20[0-2]\d\b',  # Matches years 2000-2029
-        r"'?\b\d{2}\b"     # Matches two-digit years with optional apostrophe
-    ]
-    
-    for pattern in year_patterns:
-        match = re.search(pattern, user_input)
-        if match:
-            year = match.group()
-            # Convert 2-digit year to 4-digit year
-            if len(year) == 2 or (len(year) == 3 and year[0] == "'"):  # Handle '23 format
-                year = year.strip("'")
-                return f"20{year}"
-            return year
-    return None
+    return parse_query(user_input).year
+
+def query_filters(query: ParsedQuery) -> Dict:
+    """Facet filters for a parsed query; unspecified filters (and 0 marks, as before) are left out."""
+    filters = {
+        "chapter": query.chapter,
+        "previous_years": query.year,
+        "complexity_level": query.difficulty,
+        "pattern_frequency": query.frequency,
+        "marks": query.marks,
+    }
+    return {facet: value for facet, value in filters.items() if value}
+
+def find_matching_ids(snapshot: DatasetSnapshot, filters: Dict) -> Sequence[int]:
+    """Sorted IDs of the records matching every filter, from the snapshot's facet index.
+
+    Results are cached per normalized filter set; entries from an older
+    version of the dataset are never returned.
+    """
+    key = (snapshot.path, tuple(sorted(filters.items())))
+    def lookup():
+        INDEX_LOOKUPS.inc(("facet",))
+        return snapshot.index.lookup(**filters)
+    
+    return query_cache.get_or_compute(key, snapshot.version, lookup)
+
+def search_terms(query: ParsedQuery, snapshot: DatasetSnapshot) -> List[str]:
+    """Content words of the message that occur in the question text.
+
+    Filter vocabulary (chapter names, difficulty, marks, years...) and
+    common chat words are left out, so a plain filter request has none.
+    """
+    terms = [term for term in tokenize(query.lowered) if term not in SEARCH_STOPWORDS and not term.isdigit()]
+    if not terms:
+        # Don't build the text index for plain filter requests
+        return []
+    return snapshot.text_index.known_terms(terms)
 
-def find_relevant_responses(dataset: List[Dict], chapter: str, user_input: str) -> List[Dict]:
+def find_ranked_ids(snapshot: DatasetSnapshot, terms: List[str], filters: Dict) -> Sequence[int]:
+    """IDs of records matching ``filters``, ranked by BM25 relevance to ``terms``."""
+    def search():
+        allowed = find_matching_ids(snapshot, filters) if filters else None
+        INDEX_LOOKUPS.inc(("text",))
+        return array('I', (record_id for record_id, _ in
+                           snapshot.text_index.search(terms, allowed, MAX_RANKED_RESULTS)))
+    
+    key = (snapshot.path, tuple(sorted(filters.items())), tuple(terms))
+    return query_cache.get_or_compute(key, snapshot.version, search)
+
+def new_cursor(record_ids: Sequence[int]) -> ShuffledCursor:
+    """Cursor over the matches in a fresh random order, without shuffling them."""
+    return ShuffledCursor(record_ids, seed=random.getrandbits(32))
+
+def find_relevant_ids(snapshot: DatasetSnapshot, query: ParsedQuery) -> List[int]:
+    """Find the IDs of relevant records in the snapshot, in random order."""
+    cursor = new_cursor(find_matching_ids(snapshot, query_filters(query)))
+    return [cursor.next() for _ in range(len(cursor))]
+
+def find_relevant_responses(snapshot: DatasetSnapshot, user_input: str) -> List[Question]:
     """Find relevant responses from the dataset based on various filters."""
-    difficulty = detect_difficulty(user_input)
-    frequency = detect_frequency(user_input)
-    marks = detect_marks(user_input)
-    year = detect_year(user_input)
-    
-    relevant_responses = []
+    query = parse_query(user_input)
+    return [snapshot.records[record_id] for record_id in find_relevant_ids(snapshot, query)]
+
+TREND_KEYWORDS = ("trend", "statistic", "stats", "average marks", "how often")
+PREDICTION_KEYWORDS = ("predict", "likely", "forecast", "expect", "upcoming")
+
+def _keyword_pattern(keywords: Sequence[str]) -> re.Pattern:
+    # Keywords must start a word ("unlikely" is no prediction) but may be inflected ("trends", "predicted")
+    return re.compile(r"\b(?:" + "|".join(re.escape(keyword) for keyword in keywords) + ")")
+
+TREND_PATTERN = _keyword_pattern(TREND_KEYWORDS)
+PREDICTION_PATTERN = _keyword_pattern(PREDICTION_KEYWORDS)
+
+# Statistics derived from loaded datasets when no up-to-date artifact is available
+_snapshot_stats: Dict[Tuple[str, int], PatternStats] = {}
+
+def load_artifact(snapshot: DatasetSnapshot, stats_path: Optional[str]) -> Optional[PatternStats]:
+    """The statistics artifact, if it was built from the snapshot's file as loaded.
+
+    A sharded snapshot spans several files, so no single artifact matches it.
+    """
+    if not stats_path or getattr(snapshot, "shards", None) is not None:
+        return None
+    try:
+        stats = load_cached(stats_path)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring unreadable statistics artifact %s: %s", stats_path, e)
+        return None
+    if stats is None or not stats.built_from(snapshot.path, snapshot.signature):
+        return None
+    return stats
+
+def get_pattern_stats(snapshot: DatasetSnapshot, stats_path: Optional[str] = STATS_PATH) -> PatternStats:
+    """Return the prebuilt statistics artifact, or statistics of the loaded snapshot
+    when the artifact is missing, unreadable or built from another version of the bank."""
+    stats = load_artifact(snapshot, stats_path)
+    if stats is not None:
+        return stats
+    key = (snapshot.path, snapshot.version)
+    stats = _snapshot_stats.get(key)
+    if stats is None:
+        stats = collect_stats(snapshot.records)
+        # One entry per bank; older versions are dropped
+        for old_key in [old_key for old_key in _snapshot_stats if old_key[0] == snapshot.path]:
+            del _snapshot_stats[old_key]
+        _snapshot_stats[key] = stats
+    return stats
+
+# Trend models of loaded datasets, one per bank
+_snapshot_trends: Dict[Tuple[str, int], TrendModel] = {}
+
+def get_trends(snapshot: DatasetSnapshot) -> TrendModel:
+    """Return the trend model of the snapshot, built once per dataset version."""
+    key = (snapshot.path, snapshot.version)
+    trends = _snapshot_trends.get(key)
+    if trends is None:
+        trends = TrendModel.from_index(snapshot.index)
+        for old_key in [old_key for old_key in _snapshot_trends if old_key[0] == snapshot.path]:
+            del _snapshot_trends[old_key]
+        _snapshot_trends[key] = trends
+    return trends
+
+def get_prediction_response(query: ParsedQuery, snapshot: DatasetSnapshot) -> Optional[str]:
+    """Answer questions like "what's likely from Sequential Logic this year?" from the trend model."""
+    if not PREDICTION_PATTERN.search(query.lowered):
+        return None
     
-    for item in dataset:
-        metadata = item["metadata"]
-        
-        # Always check chapter match if specified
-        if chapter and metadata["chapter"] != chapter:
-            continue
-            
-        # Check year if specified
-        if year and metadata["previous_years"] != year:
-            continue
-            
-        # Only check other filters if they were specified in the query
-        if difficulty and metadata["complexity_level"].lower() != difficulty:
-            continue
-            
-        if frequency and metadata["pattern_frequency"].lower() != frequency:
-            continue
-            
-        if marks and int(metadata["marks"]) != marks:
-            continue
-            
-        relevant_responses.append(item)
+    trends = get_trends(snapshot)
+    if not query.chapter:
+        ranking = trends.ranking()
+        if not ranking:
+            return "I don't have enough past exams to predict from yet."
+        top = ", ".join(f"{forecast['chapter']} ({forecast['likelihood']:.0%}, about "
+                        f"{forecast['expected_questions']:.1f} questions)" for forecast in ranking[:5])
+        rising = [forecast["chapter"] for forecast in sorted(ranking, key=lambda forecast: -forecast["slope"])
+                  if describe_slope(forecast["slope"]).startswith("rising")][:3]
+        response = f"Based on {len(trends.years)} past exams, the chapters most likely to appear next are: {top}."
+        if rising:
+            response += f" Growing fastest: {', '.join(rising)}."
+        return response + " Ask about a chapter for more detail."
+    
+    forecast = trends.forecast(query.chapter)
+    if forecast is None:
+        return f"I haven't seen {query.chapter} in any past exam yet, so I can't predict it. Would you like to try a different chapter?"
+    
+    years = f"{forecast['first_year']} to {forecast['last_year']}" \
+        if forecast["last_year"] != forecast["first_year"] else str(forecast["first_year"])
+    response = f"Here's what to expect from {forecast['chapter']} in the next exam:\n\n"
+    response += (f"- Chance of appearing: {forecast['likelihood']:.0%} (it was in {forecast['exams_with_chapter']} "
+                 f"of {forecast['exams']} past exams, {years})\n")
+    response += f"- Expected questions: about {forecast['expected_questions']:.1f}\n"
+    response += f"- Trend: {describe_slope(forecast['slope'])}\n"
+    if forecast["question_types"]:
+        response += "- Likely question types: " + ", ".join(
+            f"{label} ({share:.0%})" for label, share in forecast["question_types"]) + "\n"
+    if forecast["marks"]:
+        response += "- Likely marks: " + ", ".join(
+            f"{label} ({share:.0%})" for label, share in forecast["marks"]) + "\n"
+    if forecast["related_chapters"]:
+        response += "- Often asked alongside: " + ", ".join(
+            f"{chapter} ({share:.0%} of its exams)" for chapter, share in forecast["related_chapters"]) + "\n"
+    response += "\nWould you like to practice a question from here?"
+    return response
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.1f}"
+
+def get_trend_response(query: ParsedQuery, snapshot: DatasetSnapshot,
+                       stats_path: Optional[str] = STATS_PATH) -> Optional[str]:
+    """Answer questions about exam patterns for a chapter, a year or the whole bank."""
+    prediction = get_prediction_response(query, snapshot)
+    if prediction is not None:
+        return prediction
+    if not TREND_PATTERN.search(query.lowered):
+        return None
     
-    # Shuffle the responses to get random ones each time
-    random.shuffle(relevant_responses)
-    return relevant_responses
+    stats = get_pattern_stats(snapshot, stats_path)
+    if query.chapter:
+        group, label = stats.get("chapter", query.chapter), query.chapter
+        heading = f"Here's how {query.chapter} has appeared in past exams:"
+    elif query.year:
+        group, label = stats.get("year", query.year), f"the {query.year} exam"
+        heading = f"Here's what the {query.year} exam looked like:"
+    else:
+        chapters = sorted(stats.groups["chapter"].items(), key=lambda item: item[1].count, reverse=True)
+        top = ", ".join(f"{chapter} ({group.count})" for chapter, group in chapters[:5])
+        return f"Across {stats.total_questions} past questions, the chapters that appear most are: {top}. Ask about a chapter or a year for more detail."
+    
+    if group is None:
+        return f"I don't have any statistics for {label} yet. Would you like to try a different chapter or year?"
+    
+    response = heading + "\n\n"
+    response += f"- Questions on record: {group.count}\n"
+    marks = group.marks
+    if marks.count:
+        response += (f"- Marks: {_format_number(marks.min)} to {_format_number(marks.max)}, "
+                     f"averaging {_format_number(marks.mean)} (median {_format_number(marks.quantile(0.5))})\n")
+    response += f"- Question types: {', '.join(sorted(group.question_types))}\n"
+    response += f"- Frequency patterns: {', '.join(sorted(group.frequency_patterns))}\n\n"
+    response += "Would you like to practice a question from here?"
+    return response
 
 def is_affirmative(user_input: str) -> bool:
     """Check if the user's response is affirmative."""
     affirmative_responses = {'yes', 'yeah', 'sure', 'okay', 'ok', 'y', 'yep', 'show', 'next'}
     return user_input.lower() in affirmative_responses
 
-def handle_followup(user_input: str) -> Optional[str]:
-    """Handle follow-up responses like 'yes', 'show me more', etc."""
-    if not context.last_chapter or not context.last_responses:
+def iter_followup(user_input: str, context: ConversationContext, snapshot: DatasetSnapshot,
+                  count: int = 1) -> Optional[Iterator[str]]:
+    """Return the chunks answering a follow-up like 'yes' or 'next', or None if it isn't one."""
+    if not context.last_chapter:
+        return None
+    
+    # Record IDs are only meaningful for the snapshot they were taken from
+    if context.dataset_version != snapshot.version:
         return None
         
     if not is_affirmative(user_input):
         return None
     
-    if context.current_response_index >= len(context.last_responses):
-        return f"I've shown you all the questions I have from {context.last_chapter}. Would you like to try questions from a different chapter?"
-    
-    # Get the next response
-    metadata = context.last_responses[context.current_response_index]["metadata"]
-    question = context.last_responses[context.current_response_index]["output"]
-    
-    # Increment the index for next time
-    context.current_response_index += 1
+    if context.search_terms:
+        ranked_ids = find_ranked_ids(snapshot, context.search_terms, context.filters)
+        cursor = ResultCursor(ranked_ids, context.current_response_index)
+    else:
+        cursor = ShuffledCursor(find_matching_ids(snapshot, context.filters), context.seed,
+                                context.current_response_index)
+    return _followup_chunks(context, snapshot, cursor, count)
+
+def _followup_chunks(context: ConversationContext, snapshot: DatasetSnapshot,
+                     cursor: ResultCursor, count: int) -> Iterator[str]:
+    if not cursor.has_next():
+        yield f"I've shown you all the questions I have from {context.last_chapter}. Would you like to try questions from a different chapter?"
+        return
     
     # Choose a template for showing another question
     templates = [
@@ -214,81 +430,173 @@ def handle_followup(user_input: str) -> Optional[str]:
         f"Here's one more question for you:",
         f"I've got another question from {context.last_chapter}:"
     ]
+    opening = random.choice(templates) + "\n\n"
     
-    response = random.choice(templates) + f"\n\n{question} [{metadata['marks']} marks]\n\n"
+    # Show the next questions, advancing the cursor for next time
+    for _ in range(count):
+        if not cursor.has_next():
+            break
+        record = snapshot.records[cursor.next()]
+        context.current_response_index = cursor.offset
+        yield opening + f"{record.text} [{record.marks_label} marks]\n\n"
+        opening = ""
     
     # Add follow-up prompt if there are more questions
-    if context.current_response_index < len(context.last_responses):
+    if cursor.has_next():
         followup_templates = [
             "Would you like to see another one?",
             "Should I show you another question?",
             "Would you like to continue with more questions?",
             "Shall I show you another question from this chapter?"
         ]
-        response += random.choice(followup_templates)
+        yield random.choice(followup_templates)
     else:
-        response += "That's all the questions I have from this chapter. Would you like to try questions from a different chapter?"
-    
-    return response
+        yield "That's all the questions I have from this chapter. Would you like to try questions from a different chapter?"
+
+def handle_followup(user_input: str, context: ConversationContext, snapshot: DatasetSnapshot) -> Optional[str]:
+    """Handle follow-up responses like 'yes', 'show me more', etc."""
+    chunks = iter_followup(user_input, context, snapshot)
+    return "".join(chunks) if chunks is not None else None
+
+# Introductory replies never change, so they are built once at import time
+GREETINGS = {'hello', 'hi', 'hey', 'greetings', 'hola'}
+GREETING_TEMPLATES = [
+    "Hello! I'm your Digital Electronics study assistant. I can help you practice questions from various chapters. What would you like to study?",
+    "Hi there! I'm here to help you with Digital Electronics questions. Which chapter would you like to practice?",
+    "Hello! I can provide you with practice questions from Digital Electronics. Would you like to see the available chapters?"
+]
+IDENTITY_RESPONSES = {
+    'what are you': "I'm a Digital Electronics study assistant designed to help you practice questions from various chapters. I can provide questions based on difficulty level, marks, and frequency of appearance.",
+    'who are you': "I'm your Digital Electronics practice companion. I can help you with questions from different chapters, with various difficulty levels and marks.",
+    'what can you do': f"I can help you practice Digital Electronics by providing questions from these chapters:\n\n{', '.join(VALID_CHAPTERS)}\n\nYou can specify:\n- Difficulty level (low/medium/high)\n- Marks (e.g., '5 marks')\n- Frequency (yearly/frequent/occasional)",
+    'what model': "I'm a specialized Digital Electronics practice assistant, designed to help you study with questions from previous years and various topics.",
+    'help': f"I can help you practice Digital Electronics questions. You can:\n1. Ask for questions from specific chapters\n2. Specify difficulty (low/medium/high)\n3. Request questions with specific marks\n4. Ask for frequently appearing questions\n\nFor example, try: 'Give me a medium difficulty question from Binary System'"
+}
 
 def get_introduction_response(user_input: str) -> Optional[str]:
     """Handle introductory and informational prompts."""
     user_input_lower = user_input.lower().strip('?!. ')
     
     # Greetings
-    greetings = {'hello', 'hi', 'hey', 'greetings', 'hola'}
-    if user_input_lower in greetings:
-        greeting_templates = [
-            "Hello! I'm your Digital Electronics study assistant. I can help you practice questions from various chapters. What would you like to study?",
-            "Hi there! I'm here to help you with Digital Electronics questions. Which chapter would you like to practice?",
-            "Hello! I can provide you with practice questions from Digital Electronics. Would you like to see the available chapters?"
-        ]
-        return random.choice(greeting_templates)
+    if user_input_lower in GREETINGS:
+        return random.choice(GREETING_TEMPLATES)
     
     # Identity/capability questions
-    identity_patterns = {
-        'what are you': "I'm a Digital Electronics study assistant designed to help you practice questions from various chapters. I can provide questions based on difficulty level, marks, and frequency of appearance.",
-        'who are you': "I'm your Digital Electronics practice companion. I can help you with questions from different chapters, with various difficulty levels and marks.",
-        'what can you do': f"I can help you practice Digital Electronics by providing questions from these chapters:\n\n{', '.join(VALID_CHAPTERS)}\n\nYou can specify:\n- Difficulty level (low/medium/high)\n- Marks (e.g., '5 marks')\n- Frequency (yearly/frequent/occasional)",
-        'what model': "I'm a specialized Digital Electronics practice assistant, designed to help you study with questions from previous years and various topics.",
-        'help': f"I can help you practice Digital Electronics questions. You can:\n1. Ask for questions from specific chapters\n2. Specify difficulty (low/medium/high)\n3. Request questions with specific marks\n4. Ask for frequently appearing questions\n\nFor example, try: 'Give me a medium difficulty question from Binary System'"
-    }
-    
-    for pattern, response in identity_patterns.items():
+    for pattern, response in IDENTITY_RESPONSES.items():
         if pattern in user_input_lower:
             return response
             
     return None
 
-def generate_response(user_input: str, dataset_path: str = "updated_instruction_dataset.jsonl") -> str:
+def generate_response(user_input: str, dataset_path: str = DEFAULT_DATASET_PATH,
+                      session_id: str = DEFAULT_SESSION_ID, count: int = 1,
+                      timer: Optional[StageTimer] = None, subject: Optional[str] = None) -> str:
     """Generate a response based on user input."""
+    return "".join(iter_response(user_input, dataset_path, session_id, count, timer, subject))
+
+def iter_response(user_input: str, dataset_path: str = DEFAULT_DATASET_PATH,
+                  session_id: str = DEFAULT_SESSION_ID, count: int = 1,
+                  timer: Optional[StageTimer] = None, subject: Optional[str] = None) -> Iterator[str]:
+    """Generate a response as a sequence of chunks, each yielded as soon as it is ready.
+
+    The opening and first question come first, then any further questions
+    (up to ``count``) and the follow-up prompt. The session is saved once
+    the response is complete, or abandoned. Time spent in each stage is
+    recorded in ``timer`` (if given) and in the stage metrics.
+
+    ``subject`` picks one subject of the catalog; otherwise the message is
+    routed by the chapters and subject names it mentions.
+    """
+    timer = timer if timer is not None else StageTimer()
+    with timer.stage("session"):
+        sessions = get_session_store()
+        context = ConversationContext.from_dict(sessions.get(session_id))
+    try:
+        yield from timer.timed_chunks(_iter_response(user_input, dataset_path, context, count=count, timer=timer,
+                                                     subject=subject), "format")
+    finally:
+        with timer.stage("session"):
+            sessions.set(session_id, context.to_dict())
+        timer.observe(STAGE_SECONDS)
+
+def _generate_response(user_input: str, dataset_path: str, context: ConversationContext,
+                       snapshot: Optional[DatasetSnapshot] = None, count: int = 1) -> str:
+    return "".join(_iter_response(user_input, dataset_path, context, snapshot, count))
+
+def _iter_response(user_input: str, dataset_path: str, context: ConversationContext,
+                   snapshot: Optional[DatasetSnapshot] = None, count: int = 1,
+                   timer: Optional[StageTimer] = None, subject: Optional[str] = None) -> Iterator[str]:
+    timer = timer if timer is not None else StageTimer()
+    
     # First check for introductory/informational prompts
     intro_response = get_introduction_response(user_input)
     if intro_response:
-        return intro_response
+        yield intro_response
+        return
+    
+    catalog = get_catalog(dataset_path)
+    requested = catalog.subject(subject)
+    routed_snapshot = snapshot
+    if snapshot is None:
+        with timer.stage("load"):
+            # Follow-ups continue in the subject of the previous answer
+            snapshot = catalog.snapshot(catalog.subject(context.subject))
         
     # Then check if this is a follow-up response
-    followup_response = handle_followup(user_input)
-    if followup_response:
-        return followup_response
+    with timer.stage("followup"):
+        followup_chunks = iter_followup(user_input, context, snapshot, count)
+    if followup_chunks is not None:
+        yield from followup_chunks
+        return
         
     # If not a follow-up, clear the context and process as new query
     context.clear_context()
     
-    dataset = load_dataset(dataset_path)
+    with timer.stage("parse"):
+        query = (requested.parser if requested else catalog.parser).parse(user_input)
+    
+    # Answer from the subject the message is about, or from all of them
+    routed = requested or catalog.route(query)
+    context.subject = routed.key if routed else None
+    if routed_snapshot is None:
+        with timer.stage("load"):
+            snapshot = catalog.snapshot(routed)
+    chapters = routed.chapters if routed else catalog.chapters
+    stats_path = routed.stats_path if routed else None
+    
+    # Questions about exam patterns are answered from the statistics
+    with timer.stage("trend"):
+        trend_response = get_trend_response(query, snapshot, stats_path)
+    if trend_response:
+        yield trend_response
+        return
+    
+    # Free-text topics ("a question about Gray code") are ranked by relevance
+    with timer.stage("search"):
+        terms = search_terms(query, snapshot)
+        search_chunks = iter_search_response(query, terms, context, snapshot, count) if terms else None
+    if search_chunks is not None:
+        yield from search_chunks
+        return
     
     # Check if this is a year-based query without specific chapter
-    year = detect_year(user_input)
-    chapter = detect_chapter(user_input)
+    year = query.year
+    chapter = query.chapter
     
     if year and not chapter:
         # Find questions from any chapter for that year
-        relevant_responses = find_relevant_responses(dataset, None, user_input)
-        if not relevant_responses:
-            return f"I couldn't find any questions from the {year} exam. Would you like to try a different year or specify a chapter?"
+        filters = query_filters(query)
+        with timer.stage("filter"):
+            relevant_ids = find_matching_ids(snapshot, filters)
+        if not relevant_ids:
+            yield f"I couldn't find any questions from the {year} exam. Would you like to try a different year or specify a chapter?"
+            return
+        
+        cursor = new_cursor(relevant_ids)
+        record = snapshot.records[cursor.next()]
             
         # Update conversation context
-        context.update_context("all chapters", relevant_responses)
+        context.update_context("all chapters", filters, cursor, snapshot.version)
         
         # Create year-specific response
         opening_templates = [
@@ -298,35 +606,43 @@ def generate_response(user_input: str, dataset_path: str = "updated_instruction_
         ]
         
         response = random.choice(opening_templates) + "\n\n"
-        metadata = relevant_responses[0]["metadata"]
-        question = relevant_responses[0]["output"]
         
         # Include chapter information since it's a year-based query
-        response += f"Chapter: {metadata['chapter']}\n"
-        response += f"Question: {question} [{metadata['marks']} marks]\n\n"
+        for shown in range(count):
+            if shown:
+                if not cursor.has_next():
+                    break
+                record = snapshot.records[cursor.next()]
+                context.current_response_index = cursor.offset
+            response += f"Chapter: {record.chapter}\n"
+            response += f"Question: {record.text} [{record.marks_label} marks]\n\n"
+            yield response
+            response = ""
         
-        if len(relevant_responses) > 1:
+        if cursor.has_next():
             followup_templates = [
                 f"Would you like to see another question from {year}?",
                 f"I have more questions from the {year} exam. Would you like to see them?",
                 f"Should I show you another question from {year}?"
             ]
-            response += random.choice(followup_templates)
-        
-        return response
+            yield random.choice(followup_templates)
+        return
     
     # Process normal chapter-based query
     if not chapter:
-        return "I'd be happy to help you with a question. Which chapter would you like to practice? You can choose from: " + ", ".join(VALID_CHAPTERS)
+        yield "I'd be happy to help you with a question. Which chapter would you like to practice? You can choose from: " + ", ".join(chapters)
+        return
     
     # Find relevant responses
-    relevant_responses = find_relevant_responses(dataset, chapter, user_input)
+    filters = query_filters(query)
+    with timer.stage("filter"):
+        relevant_ids = find_matching_ids(snapshot, filters)
     
-    if not relevant_responses:
+    if not relevant_ids:
         response_parts = []
-        difficulty = detect_difficulty(user_input)
-        frequency = detect_frequency(user_input)
-        marks = detect_marks(user_input)
+        difficulty = query.difficulty
+        frequency = query.frequency
+        marks = query.marks
         
         if difficulty:
             response_parts.append(f"difficulty level '{difficulty}'")
@@ -339,11 +655,15 @@ def generate_response(user_input: str, dataset_path: str = "updated_instruction_
             
         if response_parts:
             filters_str = ", ".join(response_parts)
-            return f"I couldn't find any questions from {chapter} matching {filters_str}. Would you like me to show you other questions from this chapter?"
-        return f"I don't have any questions from {chapter} at the moment. Would you like to try a different chapter?"
+            yield f"I couldn't find any questions from {chapter} matching {filters_str}. Would you like me to show you other questions from this chapter?"
+            return
+        yield f"I don't have any questions from {chapter} at the moment. Would you like to try a different chapter?"
+        return
 
-    # Update conversation context
-    context.update_context(chapter, relevant_responses)
+    # Take the first relevant response and update conversation context
+    cursor = new_cursor(relevant_ids)
+    record = snapshot.records[cursor.next()]
+    context.update_context(chapter, filters, cursor, snapshot.version)
     
     # Choose a random template for the initial response
     opening_templates = [
@@ -355,27 +675,118 @@ def generate_response(user_input: str, dataset_path: str = "updated_instruction_
     
     response = random.choice(opening_templates) + "\n\n"
     
-    # Add the first relevant response
-    metadata = relevant_responses[0]["metadata"]
-    question = relevant_responses[0]["output"]
-    
-    # Format the question with marks and year
-    response += f"{question} [{metadata['marks']} marks"
-    if year or "year" in user_input.lower():
-        response += f", appeared in {metadata['previous_years']}"
-    response += "]\n\n"
+    for shown in range(count):
+        if shown:
+            if not cursor.has_next():
+                break
+            record = snapshot.records[cursor.next()]
+            context.current_response_index = cursor.offset
+        # Format the question with marks and year
+        response += f"{record.text} [{record.marks_label} marks"
+        if year or "year" in query.lowered:
+            response += f", appeared in {record.previous_years}"
+        response += "]\n\n"
+        yield response
+        response = ""
     
     # Add follow-up prompt if there are more questions
-    if len(relevant_responses) > 1:
+    if cursor.has_next():
         followup_templates = [
             "Would you like to see another question?",
             "Should I show you another question?",
             "Would you like to try another question?",
             "Shall I show you more questions from this chapter?"
         ]
-        response += random.choice(followup_templates)
+        yield random.choice(followup_templates)
+
+def iter_search_response(query: ParsedQuery, terms: List[str], context: ConversationContext,
+                         snapshot: DatasetSnapshot, count: int = 1) -> Optional[Iterator[str]]:
+    """Return the chunks answering a free-text request, or None if nothing matches it."""
+    filters = query_filters(query)
+    ranked_ids = find_ranked_ids(snapshot, terms, filters)
+    if not ranked_ids:
+        return None
     
-    return response
+    cursor = ResultCursor(ranked_ids)
+    context.update_context(query.chapter or "all chapters", filters, cursor, snapshot.version,
+                           search_terms=terms)
+    return _search_chunks(query, terms, context, snapshot, cursor, count)
+
+def _search_chunks(query: ParsedQuery, terms: List[str], context: ConversationContext,
+                   snapshot: DatasetSnapshot, cursor: ResultCursor, count: int) -> Iterator[str]:
+    # Name the topic in the user's own words
+    topic = " ".join(word.strip("?!.,'\"") for word in query.words
+                     if any(term in terms for term in tokenize(word)))
+    
+    opening_templates = [
+        f"Here's the best match I found for \"{topic}\":",
+        f"This question is the closest match for \"{topic}\":",
+    ]
+    response = random.choice(opening_templates) + "\n\n"
+    
+    for _ in range(count):
+        if not cursor.has_next():
+            break
+        record = snapshot.records[cursor.next()]
+        context.current_response_index = cursor.offset
+        # Include chapter information unless the user picked the chapter
+        if not query.chapter:
+            response += f"Chapter: {record.chapter}\nQuestion: "
+        response += f"{record.text} [{record.marks_label} marks"
+        if query.year or "year" in query.lowered:
+            response += f", appeared in {record.previous_years}"
+        response += "]\n\n"
+        yield response
+        response = ""
+    
+    if cursor.has_next():
+        followup_templates = [
+            f"Would you like to see another question about \"{topic}\"?",
+            "I have more questions like this one. Would you like to see the next one?",
+        ]
+        yield random.choice(followup_templates)
+
+def structured_filters(chapter: Optional[str] = None, year: Optional[str] = None,
+                       difficulty: Optional[str] = None, frequency: Optional[str] = None,
+                       marks: Optional[int] = None, aliases: Optional[Dict[str, str]] = None) -> Dict:
+    """Facet filters for a structured query, accepting the same names and aliases as chat messages."""
+    if chapter:
+        aliases = CHAPTER_ALIASES if aliases is None else aliases
+        chapter = aliases.get(chapter.strip().lower(), chapter.strip())
+    if frequency:
+        frequency = FREQUENCY_SYNONYMS.get(frequency.strip().lower(), frequency)
+    filters = {
+        "chapter": chapter,
+        "previous_years": year,
+        "complexity_level": difficulty,
+        "pattern_frequency": frequency,
+        "marks": marks,
+    }
+    return {facet: value for facet, value in filters.items() if value}
+
+def question_payload(record: Question) -> Dict:
+    """A question and its metadata as returned by the batch API."""
+    payload = {"id": record.id, "question": record.text}
+    payload.update(record.metadata)
+    return payload
+
+def find_questions(snapshot: DatasetSnapshot, filters: Dict, count: int = 1) -> List[Question]:
+    """Pick up to ``count`` random questions matching ``filters``."""
+    cursor = new_cursor(find_matching_ids(snapshot, filters))
+    return [snapshot.records[cursor.next()] for _ in range(min(count, len(cursor)))]
+
+def answer_batch_item(snapshot: DatasetSnapshot, message: Optional[str] = None,
+                      filters: Optional[Dict] = None, count: int = 1) -> Dict:
+    """Answer one entry of a batch against a shared snapshot.
+
+    A chat message gets a standalone text response (batch entries have no
+    conversation to follow up on); a structured query gets the matching
+    questions themselves.
+    """
+    if message is not None:
+        return {"response": _generate_response(message, snapshot.path, ConversationContext(), snapshot)}
+    questions = find_questions(snapshot, filters or {}, count)
+    return {"questions": [question_payload(record) for record in questions]}
 
 def main():
     """Main function to test the chat response system."""
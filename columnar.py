@@ -0,0 +1,350 @@
+"""Compact, memory-mapped columnar cache of a JSONL question bank.
+
+    python columnar.py miscellaneous/updated_instruction_dataset.jsonl
+
+writes ``updated_instruction_dataset.qbc`` next to the input. The question
+store opens that file instead of parsing the JSONL whenever it was built
+from the current version of the source, and can also be pointed at a
+``.qbc`` file directly.
+
+Layout: an 8-byte preamble (magic + header length), a JSON header, then
+8-byte aligned sections. Each metadata field is a dictionary-encoded array
+of integer codes; each top-level text field is a single UTF-8 blob plus an
+array of record offsets; the facet index posting lists are stored as one
+array of record IDs. Every section is used in place through memoryviews on
+an ``mmap``, so opening the file costs the same whatever its size, and
+worker processes share the pages through the OS page cache.
+"""
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from facet_index import FACETS, FacetIndex, facet_values
+from question_record import Question
+
+MAGIC = b"QBC1"
+FORMAT_VERSION = 1
+CACHE_SUFFIX = ".qbc"
+ALIGNMENT = 8
+
+
+def cache_path_for(source_path: str) -> str:
+    """Return the conventional cache location for a JSONL file."""
+    return os.path.splitext(source_path)[0] + CACHE_SUFFIX
+
+
+def _source_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _padding(offset: int) -> int:
+    return -offset % ALIGNMENT
+
+
+def build_cache(source_path: str, output_path: Optional[str] = None) -> str:
+    """Compile a JSONL question bank into the columnar format.
+
+    Text fields are streamed to temporary files, so only the integer
+    columns are held in memory while building.
+    """
+    output_path = output_path or cache_path_for(source_path)
+    signature = _source_signature(source_path)
+
+    count = 0
+    dictionaries: Dict[str, Dict[str, int]] = {}
+    codes: Dict[str, array] = {}
+    text_offsets: Dict[str, array] = {}
+    text_files = {}
+    try:
+        with open(source_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                metadata = record.get("metadata", {})
+                for field, value in metadata.items():
+                    if field not in codes:
+                        # Records seen before this field appeared get the missing code
+                        dictionaries[field] = {}
+                        codes[field] = array('I', [0xFFFFFFFF] * count)
+                    key = json.dumps(value)
+                    code = dictionaries[field].setdefault(key, len(dictionaries[field]))
+                    codes[field].append(code)
+                for field in codes:
+                    if field not in metadata:
+                        codes[field].append(0xFFFFFFFF)
+
+                for field, value in record.items():
+                    if field == "metadata" or not isinstance(value, str):
+                        continue
+                    if field not in text_offsets:
+                        text_offsets[field] = array('Q', [0] * (count + 1))
+                        text_files[field] = tempfile.TemporaryFile()
+                    data = value.encode('utf-8')
+                    text_files[field].write(data)
+                    text_offsets[field].append(text_offsets[field][-1] + len(data))
+                for field, offsets in text_offsets.items():
+                    if len(offsets) == count + 1:
+                        offsets.append(offsets[-1])
+                count += 1
+
+        # Posting lists for the facet index, keyed by normalized value
+        postings: Dict[str, Dict[object, array]] = {}
+        for facet in FACETS:
+            if facet not in codes:
+                continue
+            normalized = [facet_values(facet, json.loads(key)) for key in dictionaries[facet]]
+            facet_postings: Dict[object, array] = {}
+            for record_id, code in enumerate(codes[facet]):
+                if code == 0xFFFFFFFF:
+                    continue
+                for value in normalized[code]:
+                    ids = facet_postings.get(value)
+                    if ids is None:
+                        ids = facet_postings[value] = array('I')
+                    ids.append(record_id)
+            postings[facet] = facet_postings
+
+        # Lay out the sections and describe them in the header
+        sections: List[Tuple[str, object]] = []
+        header = {
+            "format_version": FORMAT_VERSION,
+            "byteorder": sys.byteorder,
+            "count": count,
+            "source": signature,
+            "columns": {},
+            "texts": {},
+            "postings": {},
+        }
+        offset = 0
+
+        def add_section(kind, payload, length):
+            nonlocal offset
+            start = offset
+            sections.append((kind, payload))
+            offset += length + _padding(length)
+            return start
+
+        for field, field_codes in codes.items():
+            values = [json.loads(key) for key in dictionaries[field]]
+            header["columns"][field] = {
+                "values": values,
+                "offset": add_section("array", field_codes, len(field_codes) * field_codes.itemsize),
+            }
+        for field, offsets in text_offsets.items():
+            header["texts"][field] = {
+                "offsets": add_section("array", offsets, len(offsets) * offsets.itemsize),
+                "blob": add_section("file", text_files[field], offsets[-1]),
+                "length": offsets[-1],
+            }
+        for facet, facet_postings in postings.items():
+            ids = array('I')
+            entries = []
+            for value, value_ids in facet_postings.items():
+                entries.append([value, len(ids), len(value_ids)])
+                ids.extend(value_ids)
+            header["postings"][facet] = {
+                "entries": entries,
+                "offset": add_section("array", ids, len(ids) * ids.itemsize),
+            }
+
+        header_bytes = json.dumps(header).encode('utf-8')
+        temp_path = output_path + ".tmp"
+        with open(temp_path, 'wb') as out:
+            out.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+            out.write(b"\0" * _padding(8 + len(header_bytes)))
+            for kind, payload in sections:
+                if kind == "array":
+                    data = payload.tobytes()
+                    out.write(data)
+                    written = len(data)
+                else:
+                    payload.seek(0)
+                    shutil.copyfileobj(payload, out)
+                    written = payload.tell()
+                out.write(b"\0" * _padding(written))
+        os.replace(temp_path, output_path)
+    finally:
+        for text_file in text_files.values():
+            text_file.close()
+    return output_path
+
+
+class ColumnarBank:
+    """Read-only view of a compiled question bank backed by ``mmap``."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = self._view = memoryview(self._mmap)
+        if bytes(view[:4]) != MAGIC:
+            raise ValueError(f"{path} is not a question bank cache")
+        header_length = struct.unpack('<I', view[4:8])[0]
+        header = json.loads(bytes(view[8:8 + header_length]).decode('utf-8'))
+        if header["format_version"] != FORMAT_VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built by an incompatible version or platform")
+        self.header = header
+        self.count = header["count"]
+        self.source = header["source"]
+        base = 8 + header_length + _padding(8 + header_length)
+        self._data = view[base:]
+
+        self._codes = {}
+        self._values = {}
+        for field, column in header["columns"].items():
+            start = column["offset"]
+            self._codes[field] = self._data[start:start + 4 * self.count].cast('I')
+            self._values[field] = column["values"]
+
+        self._texts = {}
+        for field, text in header["texts"].items():
+            start = text["offsets"]
+            offsets = self._data[start:start + 8 * (self.count + 1)].cast('Q')
+            blob = self._data[text["blob"]:text["blob"] + text["length"]]
+            self._texts[field] = (offsets, blob)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def metadata_value(self, field: str, record_id: int):
+        code = self._codes[field][record_id]
+        if code == 0xFFFFFFFF:
+            return None
+        return self._values[field][code]
+
+    def text(self, field: str, record_id: int) -> str:
+        offsets, blob = self._texts[field]
+        return bytes(blob[offsets[record_id]:offsets[record_id + 1]]).decode('utf-8')
+
+    def record(self, record_id: int) -> Dict:
+        """Rebuild the original record as a dict."""
+        record = {field: self.text(field, record_id) for field in self._texts}
+        metadata = {}
+        for field in self._codes:
+            value = self.metadata_value(field, record_id)
+            if value is not None:
+                metadata[field] = value
+        record["metadata"] = metadata
+        return record
+
+    def question(self, record_id: int) -> Question:
+        """Build a compact Question record straight from the columns."""
+        def label(field, default=""):
+            value = self.metadata_value(field, record_id) if field in self._codes else None
+            return default if value is None else str(value)
+
+        text_field = "output" if "output" in self._texts else "question"
+        return Question(
+            id=record_id,
+            text=self.text(text_field, record_id),
+            chapter=label("chapter"),
+            marks_label=label("marks", "N/A"),
+            question_type=label("question_type"),
+            pattern_frequency=label("pattern_frequency"),
+            complexity_level=label("complexity_level"),
+            previous_years=label("previous_years"),
+            instruction=self.text("instruction", record_id) if "instruction" in self._texts else None,
+            input=self.text("input", record_id) if "input" in self._texts else "",
+        )
+
+    def facet_index(self) -> FacetIndex:
+        """Facet index whose posting lists point straight into the mapped file."""
+        postings = {facet: {} for facet in FACETS}
+        for facet, stored in self.header["postings"].items():
+            base = stored["offset"]
+            for value, start, length in stored["entries"]:
+                begin = base + 4 * start
+                postings[facet][value] = self._data[begin:begin + 4 * length].cast('I')
+        return FacetIndex(postings, self.count)
+
+    def close(self):
+        """Release the bank's views and unmap the file.
+
+        Posting lists handed out by ``facet_index`` point into the mapping
+        too; while any of them is in use the mapping stays open, and it is
+        unmapped once they and the bank are garbage collected.
+        """
+        views = list(self._codes.values())
+        for offsets, blob in self._texts.values():
+            views += [offsets, blob]
+        for view in views + [self._data, self._view]:
+            view.release()
+        self._codes = self._texts = {}
+        self._data = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+
+class ColumnarRecords:
+    """Sequence of Question records materialized on access from a ColumnarBank."""
+
+    def __init__(self, bank: ColumnarBank):
+        self.bank = bank
+
+    def __len__(self) -> int:
+        return len(self.bank)
+
+    def __getitem__(self, record_id: int) -> Question:
+        if record_id < 0:
+            record_id += len(self.bank)
+        if not 0 <= record_id < len(self.bank):
+            raise IndexError(record_id)
+        return self.bank.question(record_id)
+
+    def __iter__(self) -> Iterator[Question]:
+        for record_id in range(len(self.bank)):
+            yield self.bank.question(record_id)
+
+
+def open_fresh_cache(source_path: str, cache_path: Optional[str] = None) -> Optional[ColumnarBank]:
+    """Open the cache for ``source_path`` if it was built from the current file."""
+    cache_path = cache_path or cache_path_for(source_path)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        bank = ColumnarBank(cache_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if bank.source != _source_signature(source_path):
+        bank.close()
+        return None
+    return bank
+
+
+def iter_records(path: str) -> Iterator[Dict]:
+    """Iterate a question bank from its cache when fresh, else from the JSONL."""
+    bank = ColumnarBank(path) if path.endswith(CACHE_SUFFIX) else open_fresh_cache(path)
+    if bank is not None:
+        for record_id in range(len(bank)):
+            yield bank.record(record_id)
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="question bank JSONL file")
+    parser.add_argument("output", nargs="?", help=f"cache file (default: source with {CACHE_SUFFIX})")
+    args = parser.parse_args()
+
+    output_path = build_cache(args.source, args.output)
+    bank = ColumnarBank(output_path)
+    print(f"Compiled {len(bank)} records into {output_path} ({os.path.getsize(output_path)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Near-duplicate detection for question banks (MinHash + LSH).
+
+Each record's question text is reduced to a MinHash signature of its
+character shingles. Signatures are split into bands, and records sharing
+any band land in the same bucket; only those candidate pairs are compared,
+so clustering takes roughly linear time instead of comparing every pair.
+A record joins a candidate's cluster only if its estimated Jaccard
+similarity to every member reaches the threshold (complete linkage) and
+it mentions the same numbers and acronyms. Clusters never grow by chaining
+one similar pair to the next, so "up counter" and "up/down counter"
+questions that both resemble a generic "counter" question stay apart.
+
+The ``dedup`` stage of pipeline.py keeps the first record of every cluster
+with the cluster's ``previous_years`` merged into it ("2017, 2019") and
+drops the rest. A report of the clusters can be written alongside:
+
+    python pipeline.py questions.jsonl questions_dedup.jsonl --stages dedup
+"""
+import json
+import random
+import re
+import zlib
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from question_record import parse_years
+
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16  # 4 rows per band: pairs above ~0.5 similarity become candidates
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.7
+# Bucket members compared with each new record, to keep huge buckets linear
+MAX_BUCKET_COMPARISONS = 50
+
+_PRIME = (1 << 31) - 1
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+_NORMALIZE_PATTERN = re.compile(r"[^a-z0-9]+")
+# Numbers and acronyms ("RS", "JK", "BCD", "421") tell otherwise similar questions apart
+_KEY_TOKEN_PATTERN = re.compile(r"\d+|\b[A-Z](?:-?[A-Z])+\b")
+_QUESTION_PATTERN = re.compile(r"^Question:[ \t]*\n?(.+?)(?:\n\n|\Z)", re.MULTILINE | re.DOTALL)
+_YEARS_PATTERN = re.compile(r"^(Previous Years?:[ \t]*)(.*)$", re.MULTILINE)
+
+
+def _assistant_message(record: Dict) -> Optional[Dict]:
+    for message in record.get("messages", []):
+        if message.get("role") == "assistant":
+            return message
+    return None
+
+
+def _metadata(record: Dict) -> Optional[Dict]:
+    """The metadata holding a record's ``previous_years``; enhanced records keep it with the original question."""
+    if "original_question" in record:
+        return record["original_question"].get("metadata")
+    return record.get("metadata")
+
+
+def record_text(record: Dict) -> str:
+    """The question text of a question, instruction, enhanced or conversation record."""
+    if "question" in record:
+        return record["question"]
+    if "original_question" in record:
+        return record["original_question"].get("question", "")
+    if "output" in record:
+        return record["output"]
+    message = _assistant_message(record)
+    if message is None:
+        return ""
+    match = _QUESTION_PATTERN.search(message["content"])
+    return match.group(1) if match else message["content"]
+
+
+def record_years(record: Dict) -> str:
+    """The ``previous_years`` label of a record, in any of the supported schemas."""
+    metadata = _metadata(record)
+    if metadata is not None:
+        return str(metadata.get("previous_years", ""))
+    message = _assistant_message(record)
+    if message is not None:
+        match = _YEARS_PATTERN.search(message["content"])
+        if match:
+            return match.group(2).strip()
+    return ""
+
+
+def set_record_years(record: Dict, years: str):
+    metadata = _metadata(record)
+    if metadata is not None:
+        metadata["previous_years"] = years
+        return
+    message = _assistant_message(record)
+    if message is not None:
+        message["content"] = _YEARS_PATTERN.sub(lambda match: match.group(1) + years, message["content"], count=1)
+
+
+def merge_years(labels: Iterable[str]) -> str:
+    """Combine year labels into one sorted, comma-separated label."""
+    years = set()
+    others = []
+    for label in labels:
+        parsed = parse_years(label)
+        years.update(parsed)
+        if not parsed and label and label not in others:
+            others.append(label)
+    return ", ".join([str(year) for year in sorted(years)] + others)
+
+
+def shingles(text: str) -> Set[int]:
+    """Hashed character shingles of the normalized text."""
+    normalized = _NORMALIZE_PATTERN.sub(" ", text.lower()).strip()
+    if len(normalized) <= SHINGLE_SIZE:
+        return {zlib.crc32(normalized.encode("utf-8"))}
+    return {zlib.crc32(normalized[i:i + SHINGLE_SIZE].encode("utf-8"))
+            for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def key_tokens(text: str) -> int:
+    """Fingerprint of the numbers and acronyms in ``text``.
+
+    Near-duplicates must agree on these exactly, so "RS flip-flop" and
+    "JK flip-flop" questions stay apart however similar the rest is.
+    """
+    tokens = sorted({token.replace("-", "") for token in _KEY_TOKEN_PATTERN.findall(text)})
+    return zlib.crc32(" ".join(tokens).encode("utf-8"))
+
+
+def minhash(text: str) -> array:
+    """MinHash signature of ``text``; the same text always gets the same signature."""
+    hashes = shingles(text)
+    return array('I', [min((a * value + b) % _PRIME for value in hashes) for a, b in _PERMUTATIONS])
+
+
+def similarity(left: array, right: array) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+
+def signature_chunk(lines: List[str]) -> List[Optional[Tuple[array, str, str]]]:
+    """(signature, years, text) for each JSONL line; None for invalid lines,
+    and no signature for records without question text."""
+    results = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            results.append(None)
+            continue
+        text = record_text(record)
+        # Empty texts would all be "identical" and collapse into one cluster
+        results.append((minhash(text) if text.strip() else None, record_years(record), text))
+    return results
+
+
+class DedupPlan:
+    """Which records to drop, and the merged years of each cluster's canonical record."""
+
+    def __init__(self, dropped: Set[int], merged_years: Dict[int, str]):
+        self.dropped = dropped
+        self.merged_years = merged_years
+
+
+class NearDuplicateIndex:
+    """Incremental LSH clustering of MinHash signatures.
+
+    Records are added in order; the first record of a cluster is its
+    canonical record. Each record joins at most one existing cluster, the
+    one whose least similar member is most similar to it.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, bands: int = NUM_BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self._rows = NUM_PERMUTATIONS // bands
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._signatures = array('I')
+        self._keys = array('I')
+        # Canonical record of each record's cluster, and the members of every cluster
+        self._canonical: List[int] = []
+        self._members: Dict[int, List[int]] = {}
+        # One member per distinct signature of each cluster; exact copies need no extra comparisons
+        self._variants: Dict[int, Dict[bytes, int]] = {}
+        self._years: List[str] = []
+        self._previews: List[str] = []
+
+    def _signature(self, record_id: int) -> array:
+        start = record_id * NUM_PERMUTATIONS
+        return self._signatures[start:start + NUM_PERMUTATIONS]
+
+    def _linkage(self, signature: array, canonical: int) -> float:
+        """Similarity of ``signature`` to the least similar member of a cluster;
+        stops early once it is below the threshold."""
+        lowest = 1.0
+        variants = self._variants.get(canonical)
+        for member in variants.values() if variants else (canonical,):
+            lowest = min(lowest, similarity(signature, self._signature(member)))
+            if lowest < self.threshold:
+                break
+        return lowest
+
+    def add(self, signature: Optional[array], years: str = "", text: str = "") -> int:
+        """Add the next record (None for an unreadable or empty one) and return its ID."""
+        record_id = len(self._canonical)
+        self._canonical.append(record_id)
+        self._years.append(years)
+        fingerprint = key_tokens(text)
+        self._keys.append(fingerprint)
+        self._previews.append(text[:120])
+        if signature is None:
+            self._signatures.extend([0] * NUM_PERMUTATIONS)
+            return record_id
+        self._signatures.extend(signature)
+
+        # Bucket neighbours only nominate clusters; the record is compared with all of their members
+        best, best_similarity = None, self.threshold
+        compared = set()
+        for band in range(self.bands):
+            key = (band, signature[band * self._rows:(band + 1) * self._rows].tobytes())
+            members = self._buckets.get(key)
+            if members is None:
+                self._buckets[key] = [record_id]
+                continue
+            for other in members[:MAX_BUCKET_COMPARISONS]:
+                canonical = self._canonical[other]
+                if canonical in compared:
+                    continue
+                compared.add(canonical)
+                if self._keys[canonical] != fingerprint:
+                    continue
+                score = self._linkage(signature, canonical)
+                if score > best_similarity or (score == best_similarity and (best is None or canonical < best)):
+                    best, best_similarity = canonical, score
+            members.append(record_id)
+        if best is not None:
+            self._canonical[record_id] = best
+            self._members.setdefault(best, [best]).append(record_id)
+            variants = self._variants.setdefault(best, {self._signature(best).tobytes(): best})
+            variants.setdefault(signature.tobytes(), record_id)
+        return record_id
+
+    def clusters(self) -> List[List[int]]:
+        """Record IDs of every cluster with more than one member, canonical first."""
+        return [list(members) for _, members in sorted(self._members.items())]
+
+    def plan(self) -> DedupPlan:
+        dropped: Set[int] = set()
+        merged_years: Dict[int, str] = {}
+        for members in self.clusters():
+            dropped.update(members[1:])
+            merged_years[members[0]] = merge_years(self._years[record_id] for record_id in members)
+        return DedupPlan(dropped, merged_years)
+
+    def report(self) -> Dict:
+        clusters = sorted(self.clusters(), key=len, reverse=True)
+        duplicates = sum(len(members) - 1 for members in clusters)
+        return {
+            "records": len(self._canonical),
+            "unique_records": len(self._canonical) - duplicates,
+            "duplicates_removed": duplicates,
+            "threshold": self.threshold,
+            "clusters": [
+                {
+                    "canonical": members[0],
+                    "members": members,
+                    "previous_years": merge_years(self._years[record_id] for record_id in members),
+                    "texts": [self._previews[record_id] for record_id in members],
+                }
+                for members in clusters
+            ],
+        }
+
+
+def dedup_digest(record: Dict, context) -> str:
+    """What dedup_record's output depends on besides the record itself."""
+    plan: DedupPlan = context.dedup_plan
+    if context.record_index in plan.dropped:
+        return "dropped"
+    return plan.merged_years.get(context.record_index, "")
+
+
+def dedup_record(record: Dict, context) -> Optional[Dict]:
+    """Pipeline transform: drop duplicates and merge years into canonical records."""
+    plan: DedupPlan = context.dedup_plan
+    if context.record_index in plan.dropped:
+        return None
+    years = plan.merged_years.get(context.record_index)
+    if years is not None:
+        set_record_years(record, years)
+    return record
@@ -1,31 +1,19 @@
 import json
 import random
-from collections import defaultdict
+from pattern_stats import collect_stats, load_or_build_stats
 
-def read_questions(file_path):
-    questions = []
+def iter_questions(file_path):
     with open(file_path, 'r', encoding='utf-8') as f:
         for line in f:
-            questions.append(json.loads(line))
-    return questions
+            if line.strip():
+                yield json.loads(line)
+
+def read_questions(file_path):
+    return list(iter_questions(file_path))
 
 def analyze_patterns(questions):
-    chapter_stats = defaultdict(lambda: {'count': 0, 'marks': [], 'types': set(), 'frequency': set()})
-    
-    for q in questions:
-        meta = q['metadata']
-        chapter = meta['chapter']
-        chapter_stats[chapter]['count'] += 1
-        try:
-            marks = int(meta['marks'])
-            chapter_stats[chapter]['marks'].append(marks)
-        except (ValueError, KeyError):
-            # Skip marks that are 'N/A' or missing
-            pass
-        chapter_stats[chapter]['types'].add(meta['question_type'])
-        chapter_stats[chapter]['frequency'].add(meta['pattern_frequency'])
-    
-    return chapter_stats
+    """Aggregate chapter, question type and year statistics in one streaming pass."""
+    return collect_stats(questions)
 
 def generate_system_message():
     return {
@@ -33,10 +21,9 @@ def generate_system_message():
         "content": "You are an expert Digital Logic and Computer Design AI that can both generate questions and predict examination trends. You analyze patterns in past questions to predict future trends and generate high-quality questions."
     }
 
-def generate_interactive_prompt(question, chapter_stats):
+def generate_interactive_prompt(question, chapter_stats, rng=random):
     meta = question['metadata']
     chapter = meta['chapter']
-    stats = chapter_stats[chapter]
     
     # Create context-aware prompts
     prompts = [
@@ -55,7 +42,7 @@ def generate_interactive_prompt(question, chapter_stats):
             generate_system_message(),
             {
                 "role": "user",
-                "content": random.choice(prompts)
+                "content": rng.choice(prompts)
             }
         ],
         "original_question": question,
@@ -65,36 +52,27 @@ def generate_interactive_prompt(question, chapter_stats):
             "marks": meta.get('marks', 'N/A'),
             "pattern_frequency": meta['pattern_frequency'],
             "complexity_level": meta['complexity_level'],
-            "chapter_statistics": {
-                "total_questions": stats['count'],
-                "average_marks": sum(stats['marks']) / len(stats['marks']) if stats['marks'] else 'N/A',
-                "question_types": list(stats['types']),
-                "frequency_patterns": list(stats['frequency'])
-            }
+            "chapter_statistics": chapter_stats.chapter_statistics(chapter)
         }
     }
     
     return enhanced_question
 
 def main():
-    # Read original questions
-    questions = read_questions('questions.jsonl')
-    
-    # Analyze patterns
-    chapter_stats = analyze_patterns(questions)
-    
-    # Generate enhanced dataset
-    enhanced_questions = []
-    for question in questions:
-        enhanced_question = generate_interactive_prompt(question, chapter_stats)
-        enhanced_questions.append(enhanced_question)
+    # Reuse the stats artifact, rebuilding it only if questions.jsonl changed
+    chapter_stats, rebuilt = load_or_build_stats('questions.jsonl')
+    if rebuilt:
+        print("Rebuilt pattern statistics from questions.jsonl")
     
-    # Save enhanced dataset
+    # Generate and save the enhanced dataset in a second, streaming pass
+    count = 0
     with open('enhanced_questions.jsonl', 'w', encoding='utf-8') as f:
-        for q in enhanced_questions:
-            f.write(json.dumps(q, ensure_ascii=False) + '\n')
+        for question in iter_questions('questions.jsonl'):
+            enhanced_question = generate_interactive_prompt(question, chapter_stats)
+            f.write(json.dumps(enhanced_question, ensure_ascii=False) + '\n')
+            count += 1
     
-    print(f"Enhanced {len(enhanced_questions)} questions with interactive prompts")
+    print(f"Enhanced {count} questions with interactive prompts")
     print("Dataset saved to enhanced_questions.jsonl")
 
 if __name__ == "__main__":
@@ -0,0 +1,217 @@
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from question_record import split_years
+
+# Metadata fields that can be used as query filters
+FACETS = (
+    "chapter",
+    "previous_years",
+    "complexity_level",
+    "pattern_frequency",
+    "question_type",
+    "marks",
+)
+
+# Question attributes holding each facet's original label, where the name differs
+FACET_ATTRIBUTES = {"marks": "marks_label"}
+
+# Lists up to this many times longer than the current result are merged rather than galloped through
+GALLOP_RATIO = 8
+
+
+def normalize_facet(facet: str, value) -> Optional[object]:
+    """Normalize a raw metadata value the same way queries are normalized.
+
+    Returns None for values that can never match a filter (e.g. 'N/A' marks).
+    """
+    if value is None:
+        return None
+    if facet == "marks":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    value = str(value).strip()
+    if facet in ("complexity_level", "pattern_frequency", "question_type"):
+        return value.lower()
+    return value
+
+
+def facet_values(facet: str, label) -> Tuple:
+    """Every normalized value a record's label is indexed under.
+
+    A multi-year ``previous_years`` label ('2017, 2019', as merged by the
+    dedup stage) is indexed under each year; other labels under one value.
+    """
+    if facet == "previous_years":
+        return split_years(label)
+    value = normalize_facet(facet, label)
+    return () if value is None else (value,)
+
+
+def record_labels(record) -> List:
+    """The raw label of every facet for a Question record or plain dict."""
+    if isinstance(record, dict):
+        metadata = record.get("metadata", {})
+        return [metadata.get(facet) for facet in FACETS]
+    return [getattr(record, FACET_ATTRIBUTES.get(facet, facet)) for facet in FACETS]
+
+
+def _merge(left: Sequence[int], right: Sequence[int]) -> array:
+    """Common IDs of two sorted lists of similar length, in one linear pass."""
+    matched = array('I')
+    i = j = 0
+    left_end, right_end = len(left), len(right)
+    while i < left_end and j < right_end:
+        a, b = left[i], right[j]
+        if a == b:
+            matched.append(a)
+            i += 1
+            j += 1
+        elif a < b:
+            i += 1
+        else:
+            j += 1
+    return matched
+
+
+def _gallop(short: Sequence[int], long: Sequence[int]) -> array:
+    """Common IDs of a short sorted list and a much longer one.
+
+    Each ID is found by doubling steps from where the previous one was
+    found and a binary search within the last step, so the cost grows
+    with the short list and the gaps between matches, not the long list.
+    Steps start at the average gap, where the next ID usually is.
+    """
+    matched = array('I')
+    lo, hi = 0, len(long)
+    stride = max(1, hi // len(short))
+    for record_id in short:
+        step = stride
+        while lo + step < hi and long[lo + step] < record_id:
+            step *= 2
+        lo = bisect_left(long, record_id, lo + step // 2 if step > stride else lo, min(lo + step + 1, hi))
+        if lo == hi:
+            break
+        if long[lo] == record_id:
+            matched.append(record_id)
+    return matched
+
+
+def intersect(postings: Sequence[Sequence[int]]) -> Sequence[int]:
+    """Intersect sorted record-ID lists.
+
+    Starts from the shortest list and narrows it with each longer one:
+    by a linear merge when they are of similar length, otherwise by
+    galloping through the longer list, so the cost is bounded by the
+    smallest list rather than the size of the corpus.
+    """
+    if not postings:
+        return array('I')
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        if not result:
+            break
+        if len(other) <= GALLOP_RATIO * len(result):
+            result = _merge(result, other)
+        else:
+            result = _gallop(result, other)
+    return result
+
+
+class FacetIndex:
+    """Inverted index from normalized metadata values to record IDs.
+
+    Record IDs are positions in the snapshot's record list, and each
+    posting list is a sorted ``array('I')`` (4 bytes per ID). ``live``
+    lists the IDs that are still in use when some have been removed by
+    ``with_changes``; otherwise every ID below ``size`` is.
+    """
+
+    def __init__(self, postings: Dict[str, Dict[object, array]], size: int, live: Optional[array] = None):
+        self.postings = postings
+        self.size = size
+        self.live = live
+
+    @classmethod
+    def build(cls, records: Iterable) -> "FacetIndex":
+        """Index Question records (or plain dicts with a ``metadata`` field)."""
+        postings: Dict[str, Dict[object, array]] = {facet: {} for facet in FACETS}
+        # Labels repeat across records, so each distinct one is normalized once
+        normalized: Dict[str, Dict[object, Tuple]] = {facet: {} for facet in FACETS}
+        size = 0
+        for record_id, record in enumerate(records):
+            size += 1
+            for facet, label in zip(FACETS, record_labels(record)):
+                try:
+                    values = normalized[facet][label]
+                except KeyError:
+                    values = normalized[facet][label] = facet_values(facet, label)
+                except TypeError:
+                    values = facet_values(facet, label)
+                for value in values:
+                    ids = postings[facet].get(value)
+                    if ids is None:
+                        ids = postings[facet][value] = array('I')
+                    ids.append(record_id)
+        return cls(postings, size)
+
+    def with_changes(self, removed: Dict[int, object], added: Dict[int, object]) -> "FacetIndex":
+        """A copy with ``removed`` records (ID -> record) taken out and ``added``
+        ones indexed; new IDs must come after every existing one.
+
+        Only the posting lists the changes touch are copied; the rest are
+        shared with this index, which is left unchanged.
+        """
+        postings = {facet: dict(values) for facet, values in self.postings.items()}
+        changes: Dict[Tuple[str, object], Tuple[set, List[int]]] = {}
+        for records, position in ((removed, 0), (added, 1)):
+            for record_id, record in records.items():
+                for facet, label in zip(FACETS, record_labels(record)):
+                    for value in facet_values(facet, label):
+                        change = changes.setdefault((facet, value), (set(), []))
+                        if position:
+                            change[1].append(record_id)
+                        else:
+                            change[0].add(record_id)
+        for (facet, value), (removed_ids, added_ids) in changes.items():
+            ids = postings[facet].get(value, ())
+            ids = array('I', (record_id for record_id in ids if record_id not in removed_ids)) \
+                if removed_ids else array('I', ids)
+            ids.extend(sorted(added_ids))
+            if ids:
+                postings[facet][value] = ids
+            else:
+                postings[facet].pop(value, None)
+
+        size = max([self.size - 1, *added]) + 1
+        live = self.live
+        if removed or live is not None:
+            if live is None:
+                live = array('I', range(self.size))
+            live = array('I', (record_id for record_id in live if record_id not in removed))
+            live.extend(sorted(added))
+        return FacetIndex(postings, size, live)
+
+    def values(self, facet: str) -> List[object]:
+        """Return the distinct normalized values seen for ``facet``."""
+        return list(self.postings[facet])
+
+    def get(self, facet: str, value) -> Sequence[int]:
+        """Return the posting list for a single facet value."""
+        value = normalize_facet(facet, value)
+        return self.postings[facet].get(value, array('I'))
+
+    def lookup(self, **filters) -> Sequence[int]:
+        """Return the sorted IDs of records matching every given filter.
+
+        Filters whose value is None are ignored; with no filters at all every
+        record matches.
+        """
+        postings = [self.get(facet, value) for facet, value in filters.items() if value is not None]
+        if not postings:
+            return self.live if self.live is not None else range(self.size)
+        return intersect(postings)
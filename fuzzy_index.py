@@ -0,0 +1,109 @@
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_CACHE_SIZE = 65536
+
+
+class FuzzyIndex:
+    """Best-match lookup over a fixed vocabulary, scored like difflib.
+
+    ``best_match(word)`` returns the same term that
+    ``difflib.get_close_matches(word, terms, n=1, cutoff)`` would, but
+    avoids most of its work:
+
+    * terms are bucketed by length, and only buckets that can reach the
+      cutoff (``2 * min(len) / total len``) are considered;
+    * a bitmask of each term's distinct characters rejects, with a single
+      integer operation, terms that lack too many of the word's characters;
+    * each term's character counts are precomputed, giving the same upper
+      bound as ``SequenceMatcher.quick_ratio`` without rebuilding it;
+    * candidates are scored in descending order of that bound, and the
+      search stops as soon as no remaining candidate can beat the best
+      ratio found so far;
+    * complete results are memoized per word, since the same words recur
+      across messages.
+
+    The full ``SequenceMatcher.ratio`` only runs on the few candidates
+    that survive, and an optional ``time_budget`` caps the search.
+    """
+
+    def __init__(self, terms: Iterable[str], cutoff: float = 0.8, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.cutoff = cutoff
+        self.cache_size = cache_size
+        terms = list(dict.fromkeys(terms))
+        self._char_bits = {char: 1 << bit for bit, char in enumerate(sorted(set(''.join(terms))))}
+        self._buckets: Dict[int, List[Tuple[str, int, Counter]]] = {}
+        for term in terms:
+            self._buckets.setdefault(len(term), []).append((term, self._mask(term), Counter(term)))
+        self._cache: Dict[str, Optional[Tuple[str, float]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def _mask(self, text: str) -> int:
+        mask = 0
+        for char in text:
+            mask |= self._char_bits.get(char, 0)
+        return mask
+
+    def _candidates(self, word: str, cutoff: float) -> List[Tuple[float, str]]:
+        word_length = len(word)
+        word_counts = Counter(word)
+        word_mask = self._mask(word)
+        # Characters that no term contains are missing from every candidate
+        always_missing = sum(1 for char in word_counts if char not in self._char_bits)
+        candidates = []
+        for length, bucket in self._buckets.items():
+            total = word_length + length
+            if not total or 2.0 * min(word_length, length) / total < cutoff:
+                continue
+            # Each distinct character of the word that a term lacks costs at
+            # least one shared character; the slack keeps this a safe prefilter
+            max_missing = word_length - cutoff * total / 2.0 + 1e-9 - always_missing
+            if max_missing < 0:
+                continue
+            for term, term_mask, term_counts in bucket:
+                if (word_mask & ~term_mask).bit_count() > max_missing:
+                    continue
+                shared = sum(min(count, term_counts[char]) for char, count in word_counts.items())
+                bound = 2.0 * shared / total
+                if bound >= cutoff:
+                    candidates.append((bound, term))
+        # Highest bound first; ties go to the larger term, as in get_close_matches
+        candidates.sort(reverse=True)
+        return candidates
+
+    def best_match(self, word: str, time_budget: Optional[float] = None) -> Optional[Tuple[str, float]]:
+        """Return ``(term, ratio)`` for the closest term at or above the cutoff.
+
+        With ``time_budget`` (seconds), the search returns the best match
+        found so far once the budget is spent; such partial results are not
+        cached.
+        """
+        if word in self._cache:
+            return self._cache[word]
+
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        matcher = SequenceMatcher()
+        matcher.set_seq2(word)
+        best: Optional[Tuple[float, str]] = None
+        complete = True
+        for bound, term in self._candidates(word, self.cutoff):
+            if best is not None and (bound, term) < best:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                complete = False
+                break
+            matcher.set_seq1(term)
+            score = matcher.ratio()
+            if score >= self.cutoff and (best is None or (score, term) > best):
+                best = (score, term)
+
+        result = (best[1], best[0]) if best is not None else None
+        if complete:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[word] = result
+        return result
@@ -0,0 +1,241 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Counters and histograms are plain Python objects updated under a short
+per-metric lock, cheap enough to leave on for every request. Values that
+already live elsewhere (dataset size, cache statistics) are read from
+callbacks only when the metrics are scraped, so they cost nothing between
+scrapes.
+
+Every process has its own registry. Processes serving the same app (see
+serve.py) tell their samples apart with a constant label set through
+``Registry.set_constant_labels``.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Responses add "; charset=utf-8" to text/* media types themselves
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Latency buckets (seconds) from sub-millisecond lookups to slow reloads
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """A named metric; subclasses produce its samples as (suffix, label names, label values, value)."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def samples(self) -> Iterator[Tuple[str, Sequence[str], Sequence[str], float]]:
+        raise NotImplementedError
+
+    def render(self, constant_names: Labels = (), constant_values: Labels = ()) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self.samples():
+            labels = _format_labels(constant_names + tuple(names), constant_values + tuple(values))
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield "", self.labelnames, labels, value
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram of observed values (usually seconds)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (last one is +Inf), sum]
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: Labels = ()):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][bucket] += 1
+            entry[1][0] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        names = self.labelnames + ("le",)
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", names, labels + (_format_value(bound),), cumulative
+            yield "_sum", self.labelnames, labels, total
+            yield "_count", self.labelnames, labels, cumulative
+
+
+class CallbackMetric(Metric):
+    """A gauge or counter whose values are read from ``callback`` at scrape time.
+
+    The callback returns a number, None (no sample), or a dict mapping
+    label-value tuples to numbers.
+    """
+
+    def __init__(self, name: str, help: str, callback: Callable, labelnames: Sequence[str] = (),
+                 type: str = "gauge"):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+        self.type = type
+
+    def samples(self):
+        value = self.callback()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, sample in value.items():
+            if sample is not None:
+                yield "", self.labelnames, labels, sample
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+        self._constant_labels: Tuple[Labels, Labels] = ((), ())
+
+    def set_constant_labels(self, **labels: str):
+        """Add these labels to every sample rendered from now on."""
+        self._constant_labels = (tuple(labels), tuple(labels.values()))
+
+    def register(self, metric: Metric) -> Metric:
+        """Add ``metric``, or return the one already registered under its name."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, callback: Callable, labelnames: Sequence[str] = (),
+              type: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, callback, labelnames, type))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render(*self._constant_labels))
+            except Exception:
+                # A failing callback must not take down the whole scrape
+                continue
+        return "\n".join(lines) + "\n"
+
+
+# The process-wide registry served by the API's /metrics endpoint
+REGISTRY = Registry()
+
+
+class StageTimer:
+    """Per-request breakdown of where the time went, in seconds per stage."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def total(self) -> float:
+        return sum(self.stages.values())
+
+    def timed_chunks(self, chunks: Iterator[str], rest: str) -> Iterator[str]:
+        """Yield from ``chunks``, charging time spent producing them that no
+        stage claimed to ``rest``. Time the consumer spends between chunks is
+        not counted."""
+        claimed = self.total()
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield chunk
+        finally:
+            chunks.close()
+            self.add(rest, max(0.0, elapsed - (self.total() - claimed)))
+
+    def milliseconds(self) -> Dict[str, float]:
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+
+    def server_timing(self) -> str:
+        """The breakdown as a ``Server-Timing`` header value."""
+        return ", ".join(f"{stage};dur={seconds * 1000:.3f}" for stage, seconds in self.stages.items())
+
+    def observe(self, histogram: Histogram):
+        for stage, seconds in self.stages.items():
+            histogram.observe(seconds, (stage,))
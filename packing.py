@@ -0,0 +1,359 @@
+"""Length-aware export of fine-tuning conversations.
+
+Counts the tokens of every conversation in a JSONL file (as written by
+the convert and update-prompts stages), then writes the examples grouped
+by length, optionally packed several to a row, so training batches carry
+little padding:
+
+    python packing.py updated_fine_tuning_dataset.jsonl train.jsonl --max-tokens 4096
+
+    python packing.py updated_fine_tuning_dataset.jsonl train_packed.jsonl \\
+        --max-tokens 4096 --pack --tokenizer tiktoken:cl100k_base
+
+Token counts come from a pluggable tokenizer: ``estimate`` (the default,
+an offline approximation of English BPE), ``tiktoken[:ENCODING]`` or
+``hf:MODEL`` (a Hugging Face tokenizer name or local path); the latter two
+need the ``tiktoken`` or ``transformers`` package. A length report with a
+histogram and the padding per epoch before and after is written to
+``OUTPUT.lengths.json``.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pipeline import DEFAULT_CHUNK_SIZE, map_chunks
+
+DEFAULT_TOKENIZER = "estimate"
+DEFAULT_MAX_TOKENS = 4096
+DEFAULT_BATCH_SIZE = 16
+
+# Chat-template tokens around each message (role and separators) and before the reply
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+
+# Upper bounds of the report's histogram bins; longer examples go in a last, open bin
+HISTOGRAM_BOUNDS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+ORDERS = ("bucketed", "sorted", "input")
+
+_ESTIMATE_PATTERN = re.compile(r"[A-Za-z0-9]+|\S")
+
+
+class EstimateTokenizer:
+    """Offline token estimate: about four characters per token for runs of
+    letters and digits, and one per other character, which is close to
+    common BPE vocabularies on English text."""
+
+    name = "estimate"
+
+    def count(self, text: str) -> int:
+        return sum((len(token) + 3) // 4 for token in _ESTIMATE_PATTERN.findall(text))
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: str = "cl100k_base"):
+        import tiktoken
+        self.name = f"tiktoken:{encoding}"
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+class HuggingFaceTokenizer:
+    def __init__(self, model: str):
+        from transformers import AutoTokenizer
+        self.name = f"hf:{model}"
+        self._tokenizer = AutoTokenizer.from_pretrained(model)
+
+    def count(self, text: str) -> int:
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+
+def get_tokenizer(spec: str = DEFAULT_TOKENIZER):
+    """Create the tokenizer named by ``spec`` (see the module docstring)."""
+    kind, _, argument = spec.partition(":")
+    try:
+        if kind == "estimate":
+            return EstimateTokenizer()
+        if kind == "tiktoken":
+            return TiktokenTokenizer(argument or "cl100k_base")
+        if kind == "hf" and argument:
+            return HuggingFaceTokenizer(argument)
+    except ImportError as e:
+        raise ValueError(f"Tokenizer '{spec}' needs the '{e.name}' package") from e
+    raise ValueError(f"Unknown tokenizer '{spec}'; use estimate, tiktoken[:ENCODING] or hf:MODEL")
+
+
+def conversation_tokens(record: Dict, tokenizer) -> int:
+    """Tokens of a ``{"messages": [...]}`` record in a chat template."""
+    return REPLY_OVERHEAD + sum(MESSAGE_OVERHEAD + tokenizer.count(message.get("content") or "")
+                                for message in record["messages"])
+
+
+_worker_tokenizer = None
+
+
+def _init_worker(spec: str):
+    global _worker_tokenizer
+    _worker_tokenizer = get_tokenizer(spec)
+
+
+def count_chunk(lines: List[bytes]) -> List[Optional[int]]:
+    """Token count of every line of a chunk; None for lines that are not conversations."""
+    counts = []
+    for line in lines:
+        try:
+            counts.append(conversation_tokens(json.loads(line), _worker_tokenizer))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            counts.append(None)
+    return counts
+
+
+def iter_line_chunks(path: str, chunk_size: int) -> Iterator[Tuple[List[Tuple[int, int]], List[bytes]]]:
+    """Chunks of non-blank lines, with the (offset, length) of each line in the file."""
+    ranges, lines = [], []
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                ranges.append((offset, len(line)))
+                lines.append(line)
+                if len(lines) >= chunk_size:
+                    yield ranges, lines
+                    ranges, lines = [], []
+            offset += len(line)
+    if lines:
+        yield ranges, lines
+
+
+class LengthTable:
+    """Token count and input position of every valid example, 16 bytes each."""
+
+    def __init__(self):
+        self.tokens = array('I')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+
+def count_tokens(input_path: str, tokenizer_spec: str = DEFAULT_TOKENIZER, workers: int = 1,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> LengthTable:
+    """Count the tokens of every conversation in ``input_path`` on a process pool."""
+    get_tokenizer(tokenizer_spec)  # fail early, in this process, on a bad spec
+    table = LengthTable()
+    chunk_ranges: List[List[Tuple[int, int]]] = []
+
+    def chunks():
+        for ranges, lines in iter_line_chunks(input_path, chunk_size):
+            chunk_ranges.append(ranges)
+            yield (lines,)
+
+    for counts in map_chunks(count_chunk, chunks(), workers, _init_worker, (tokenizer_spec,)):
+        # Results arrive in input order, so the oldest pending ranges are this chunk's
+        for (offset, length), count in zip(chunk_ranges.pop(0), counts):
+            if count is None:
+                table.skipped += 1
+                continue
+            table.tokens.append(count)
+            table.offsets.append(offset)
+            table.lengths.append(length)
+    return table
+
+
+def order_examples(tokens: Sequence[int], order: str, batch_size: int, rng: random.Random) -> List[int]:
+    """Example positions in output order.
+
+    ``sorted`` is shortest first; ``bucketed`` cuts the sorted examples into
+    batches of similar length and shuffles the batches, so each batch pads
+    little but training does not see lengths in a rising curve.
+    """
+    positions = list(range(len(tokens)))
+    if order == "input":
+        return positions
+    positions.sort(key=tokens.__getitem__)
+    if order == "sorted":
+        return positions
+    batches = [positions[start:start + batch_size] for start in range(0, len(positions), batch_size)]
+    rng.shuffle(batches)
+    return [position for batch in batches for position in batch]
+
+
+def pack_examples(tokens: Sequence[int], max_tokens: int) -> List[List[int]]:
+    """Group examples into rows of at most ``max_tokens`` (best fit decreasing).
+
+    Examples longer than ``max_tokens`` get a row of their own.
+    """
+    rows: List[List[int]] = []
+    # (free tokens, row) of the rows that still have room, kept sorted
+    free: List[Tuple[int, int]] = []
+    for position in sorted(range(len(tokens)), key=tokens.__getitem__, reverse=True):
+        size = tokens[position]
+        slot = bisect_left(free, (size, -1))
+        if slot < len(free):
+            room, row = free.pop(slot)
+            rows[row].append(position)
+            if room - size:
+                insort(free, (room - size, row))
+            continue
+        rows.append([position])
+        if size < max_tokens:
+            insort(free, (max_tokens - size, len(rows) - 1))
+    return rows
+
+
+def padded_tokens(row_tokens: Sequence[int], batch_size: int) -> int:
+    """Padding tokens when rows are batched in order and padded to each batch's longest."""
+    padding = 0
+    for start in range(0, len(row_tokens), batch_size):
+        batch = row_tokens[start:start + batch_size]
+        padding += max(batch) * len(batch) - sum(batch)
+    return padding
+
+
+def _percentile(sorted_values: Sequence[int], fraction: float) -> int:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0
+    return sorted_values[max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))]
+
+
+def length_report(table: LengthTable, tokenizer_name: str, max_tokens: int, batch_size: int,
+                  row_tokens: Sequence[int]) -> Dict:
+    """Summary of the example lengths and of the padding before and after the export."""
+    values = sorted(table.tokens)
+    counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for value in values:
+        counts[bisect_left(HISTOGRAM_BOUNDS, value)] += 1
+    histogram = [{"max_tokens": bound, "records": count}
+                 for bound, count in zip(HISTOGRAM_BOUNDS + (None,), counts)]
+    while len(histogram) > 1 and not histogram[-1]["records"]:
+        histogram.pop()
+
+    total = sum(values)
+    before = padded_tokens(table.tokens, batch_size)
+    after = padded_tokens(row_tokens, batch_size)
+    return {
+        "tokenizer": tokenizer_name,
+        "records": len(values),
+        "skipped": table.skipped,
+        "rows": len(row_tokens),
+        "total_tokens": total,
+        "min": values[0] if values else 0,
+        "max": values[-1] if values else 0,
+        "mean": round(total / len(values), 1) if values else 0.0,
+        "p50": _percentile(values, 0.5),
+        "p90": _percentile(values, 0.9),
+        "p99": _percentile(values, 0.99),
+        "max_tokens": max_tokens,
+        "over_max_tokens": sum(1 for value in values if value > max_tokens),
+        "histogram": histogram,
+        "padding": {
+            "batch_size": batch_size,
+            "input_order": before,
+            "output": after,
+            "saved": round(1 - after / before, 4) if before else 0.0,
+        },
+    }
+
+
+def export(input_path: str, output_path: str, tokenizer_spec: str = DEFAULT_TOKENIZER,
+           max_tokens: int = DEFAULT_MAX_TOKENS, pack: bool = False, order: str = "bucketed",
+           batch_size: int = DEFAULT_BATCH_SIZE, seed: Optional[int] = None, workers: int = 1,
+           chunk_size: int = DEFAULT_CHUNK_SIZE, report_path: Optional[str] = None) -> Dict:
+    """Write the conversations of ``input_path`` to ``output_path`` by length.
+
+    Each output line is the input record with a ``num_tokens`` field, or
+    with ``pack``, ``{"conversations": [...], "num_tokens": n}`` holding
+    several records that together fit in ``max_tokens``. Rows are written
+    in ``order`` of their token counts. Only token counts
+    and file offsets are kept in memory; records are read back from the
+    input in output order. Returns the length report, also written to
+    ``report_path`` if given.
+    """
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order '{order}'; choose from {', '.join(ORDERS)}")
+    table = count_tokens(input_path, tokenizer_spec, workers, chunk_size)
+    if pack:
+        rows = pack_examples(table.tokens, max_tokens)
+    else:
+        rows = [[position] for position in range(len(table))]
+    totals = [sum(table.tokens[position] for position in row) for row in rows]
+    ordered = order_examples(totals, order, batch_size, random.Random(seed))
+    rows = [rows[row] for row in ordered]
+    row_tokens = [totals[row] for row in ordered]
+
+    temp_path = output_path + ".tmp"
+    with open(input_path, 'rb') as source, open(temp_path, 'w', encoding='utf-8') as out:
+        for row, num_tokens in zip(rows, row_tokens):
+            records = []
+            for position in row:
+                source.seek(table.offsets[position])
+                records.append(json.loads(source.read(table.lengths[position])))
+            if pack:
+                output = {"conversations": records, "num_tokens": num_tokens}
+            else:
+                output = dict(records[0], num_tokens=num_tokens)
+            out.write(json.dumps(output) + '\n')
+    os.replace(temp_path, output_path)
+
+    report = length_report(table, get_tokenizer(tokenizer_spec).name, max_tokens, batch_size, row_tokens)
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="conversation JSONL file")
+    parser.add_argument("output", help="output JSONL file")
+    parser.add_argument("--tokenizer", default=DEFAULT_TOKENIZER,
+                        help="estimate, tiktoken[:ENCODING] or hf:MODEL (default: estimate)")
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS,
+                        help="training context length; packed rows stay within it")
+    parser.add_argument("--pack", action="store_true", help="pack several conversations per row")
+    parser.add_argument("--order", choices=ORDERS, default="bucketed",
+                        help="output order of rows by length (default: bucketed)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="training batch size, for bucketing and the padding estimate")
+    parser.add_argument("--seed", type=int, default=None, help="seed for the batch and row order")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes for token counting (1 runs in-process)")
+    parser.add_argument("--report", default=None,
+                        help="where to write the length report (default: OUTPUT.lengths.json)")
+    args = parser.parse_args()
+
+    report_path = args.report or os.path.splitext(args.output)[0] + ".lengths.json"
+    try:
+        report = export(args.input, args.output, args.tokenizer, args.max_tokens, args.pack, args.order,
+                        args.batch_size, args.seed, args.workers, report_path=report_path)
+    except ValueError as e:
+        parser.error(str(e))
+
+    padding = report["padding"]
+    print(f"Wrote {report['records']} conversations in {report['rows']} rows to {args.output}")
+    print(f"Tokens: {report['total_tokens']} total, p50 {report['p50']}, p99 {report['p99']}, "
+          f"max {report['max']} ({report['tokenizer']})")
+    print(f"Padding per epoch at batch size {padding['batch_size']}: "
+          f"{padding['input_order']} -> {padding['output']} tokens")
+    print(f"Wrote the length report to {report_path}")
+    if report["over_max_tokens"]:
+        print(f"{report['over_max_tokens']} conversations are longer than {args.max_tokens} tokens",
+              file=sys.stderr)
+    if report["skipped"]:
+        print(f"Skipped {report['skipped']} lines that are not conversations", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Practice-paper assembly under a marks budget.
+
+A paper request names a total number of marks, optional per-chapter
+minimum question counts, and an optional complexity mix (the share of the
+marks at each complexity level). Candidate questions are grouped by
+(chapter, complexity, marks) from the facet index. Questions in one group
+are interchangeable as far as the constraints go, so the solver works on
+group counts and its cost does not grow with the size of the bank:
+
+1. Repair: take the questions each chapter still needs, then fill the
+   remaining marks exactly with a min-cost bounded subset-sum DP whose
+   item costs favour the complexity levels furthest below their target.
+2. Improve: remove a few random questions and repair again (a large
+   neighbourhood search), keeping the result whenever it is no worse.
+   This stops when the paper matches the mix exactly, or the iteration
+   limit or time budget is reached.
+
+The concrete questions are drawn from each group at the end. Every random
+choice comes from one seeded generator, so a seed reproduces the same
+paper from the same dataset version, unless the time budget cut the
+search short (``timed_out``).
+"""
+import random
+import time
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from chat_response import find_matching_ids, query_cache, question_payload
+from facet_index import normalize_facet
+from result_cursor import ShuffledCursor
+
+# Largest paper the DP is sized for
+MAX_TOTAL_MARKS = 1000
+# Improvement rounds after the first paper; bounded so seeded papers repeat
+MAX_ITERATIONS = 400
+# Questions removed per improvement round, at most
+MAX_REMOVED = 4
+# Random jitter added to item costs so equally good papers vary with the seed
+COST_NOISE = 0.05
+
+Group = Tuple[str, str, int]
+
+
+def build_groups(snapshot, filters: Dict) -> Dict[Group, array]:
+    """IDs of the questions matching ``filters``, by (chapter, complexity, marks).
+
+    Questions without numeric marks can't count towards a budget and are
+    left out. Cached with the facet lookups, per dataset version.
+    """
+    def compute():
+        groups: Dict[Group, array] = {}
+        records = snapshot.records
+        for record_id in find_matching_ids(snapshot, filters):
+            record = records[record_id]
+            if not record.marks or record.marks <= 0:
+                continue
+            key = (normalize_facet("chapter", record.chapter),
+                   normalize_facet("complexity_level", record.complexity_level), record.marks)
+            ids = groups.get(key)
+            if ids is None:
+                ids = groups[key] = array('I')
+            ids.append(record_id)
+        return groups
+
+    key = (snapshot.path, "paper-groups", tuple(sorted(filters.items())))
+    return query_cache.get_or_compute(key, snapshot.version, compute)
+
+
+class PaperSpec:
+    """What a paper must look like.
+
+    ``chapters`` limits the paper to those chapters. Every chapter of the
+    paper (the listed ones, or all with matching questions) needs at least
+    ``min_per_chapter`` questions, or its entry in ``chapter_minimums``.
+    ``complexity_mix`` maps complexity levels to their share of the marks
+    (normalized to sum to 1).
+    """
+
+    def __init__(self, total_marks: int, chapters: Optional[Sequence[str]] = None, min_per_chapter: int = 0,
+                 chapter_minimums: Optional[Dict[str, int]] = None,
+                 complexity_mix: Optional[Dict[str, float]] = None):
+        if not 0 < total_marks <= MAX_TOTAL_MARKS:
+            raise ValueError(f"total_marks must be between 1 and {MAX_TOTAL_MARKS}")
+        if min_per_chapter < 0 or any(minimum < 0 for minimum in (chapter_minimums or {}).values()):
+            raise ValueError("chapter minimums must not be negative")
+        self.total_marks = total_marks
+        self.chapters = list(chapters) if chapters else None
+        self.min_per_chapter = min_per_chapter
+        self.chapter_minimums = dict(chapter_minimums or {})
+        self.complexity_targets: Dict[str, float] = {}
+        if complexity_mix:
+            if any(share < 0 for share in complexity_mix.values()) or not sum(complexity_mix.values()):
+                raise ValueError("complexity shares must be non-negative and not all zero")
+            scale = sum(complexity_mix.values())
+            self.complexity_targets = {level.strip().lower(): total_marks * share / scale
+                                       for level, share in complexity_mix.items()}
+
+
+class PaperSolver:
+    """Chooses how many questions to take from each group (see the module docstring)."""
+
+    def __init__(self, groups: Dict[Group, Sequence[int]], spec: PaperSpec, rng: random.Random):
+        self.spec = spec
+        self.rng = rng
+        self.available = {group: len(ids) for group, ids in groups.items()
+                          if spec.chapters is None or group[0] in spec.chapters}
+        chapters = spec.chapters if spec.chapters is not None else \
+            list(dict.fromkeys(group[0] for group in self.available))
+        minimums = {chapter: spec.min_per_chapter for chapter in chapters}
+        for chapter, minimum in spec.chapter_minimums.items():
+            minimums[chapter] = max(minimum, minimums.get(chapter, 0))
+        self.minimums = {chapter: minimum for chapter, minimum in minimums.items() if minimum > 0}
+        self.iterations = 0
+        self.timed_out = False
+
+    # Scoring
+
+    def _complexity_marks(self, counts: Dict[Group, int]) -> Dict[str, int]:
+        marks: Dict[str, int] = {}
+        for (_, level, group_marks), count in counts.items():
+            marks[level] = marks.get(level, 0) + group_marks * count
+        return marks
+
+    def objective(self, counts: Dict[Group, int]) -> float:
+        """Lower is better: missing marks first, then distance from the complexity mix."""
+        total = sum(group[2] * count for group, count in counts.items())
+        mix_error = 0.0
+        if self.spec.complexity_targets:
+            marks = self._complexity_marks(counts)
+            mix_error = sum(abs(marks.get(level, 0) - target)
+                            for level, target in self.spec.complexity_targets.items())
+            mix_error += sum(value for level, value in marks.items() if level not in self.spec.complexity_targets)
+        return abs(self.spec.total_marks - total) * (self.spec.total_marks + 1) + mix_error
+
+    def _deficits(self, counts: Dict[Group, int]) -> Dict[str, float]:
+        marks = self._complexity_marks(counts)
+        return {level: target - marks.get(level, 0) for level, target in self.spec.complexity_targets.items()}
+
+    # Repair
+
+    def _take(self, counts: Dict[Group, int], group: Group, amount: int = 1):
+        counts[group] = counts.get(group, 0) + amount
+
+    def _free(self, counts: Dict[Group, int], group: Group) -> int:
+        return self.available[group] - counts.get(group, 0)
+
+    def _add_chapter_minimums(self, counts: Dict[Group, int]):
+        chapter_counts: Dict[str, int] = {}
+        for (chapter, _, _), count in counts.items():
+            chapter_counts[chapter] = chapter_counts.get(chapter, 0) + count
+        needed = {chapter: minimum - chapter_counts.get(chapter, 0) for chapter, minimum in self.minimums.items()}
+        still_needed = sum(count for count in needed.values() if count > 0)
+        for chapter, count in needed.items():
+            for _ in range(count):
+                options = [group for group in self.available if group[0] == chapter and self._free(counts, group)]
+                if not options:
+                    break
+                remaining = self.spec.total_marks - sum(group[2] * count for group, count in counts.items())
+                # Required questions share the marks left, so they don't crowd each other out
+                share = remaining / still_needed
+                still_needed -= 1
+                deficits = self._deficits(counts)
+                # Prefer questions within the share, then the level furthest below its target
+                self.rng.shuffle(options)
+                options.sort(key=lambda group: (group[2] > share, group[2] if group[2] > share else 0,
+                                                -deficits.get(group[1], 0.0) if deficits else 0.0))
+                self._take(counts, options[0])
+
+    def required_marks(self) -> int:
+        """The fewest marks the chapter minimums can be met with."""
+        total = 0
+        for chapter, minimum in self.minimums.items():
+            marks = sorted(group[2] for group, count in self.available.items()
+                           if group[0] == chapter for _ in range(count))
+            total += sum(marks[:minimum])
+        return total
+
+    def _fill(self, counts: Dict[Group, int], budget: int):
+        """Add questions worth exactly ``budget`` marks, or as close below as possible."""
+        if budget <= 0:
+            return
+        deficits = self._deficits(counts)
+        scale = max(budget, 1)
+        # Chapters don't matter here, so the DP runs over (complexity, marks) pools
+        pools: Dict[Tuple[str, int], List[Group]] = {}
+        for group in self.available:
+            if group[2] <= budget and self._free(counts, group):
+                pools.setdefault((group[1], group[2]), []).append(group)
+        bundles = []
+        for (level, marks), pool_groups in pools.items():
+            free = min(sum(self._free(counts, group) for group in pool_groups), budget // marks)
+            unit_cost = -marks * deficits.get(level, 0.0) / scale if deficits else 0.0
+            unit_cost += marks * self.rng.random() * COST_NOISE
+            # Binary splitting turns the bounded pool into 0/1 items
+            size = 1
+            while free > 0:
+                amount = min(size, free)
+                bundles.append((level, marks, amount, unit_cost * amount))
+                free -= amount
+                size *= 2
+
+        infinity = float("inf")
+        cost = [0.0] + [infinity] * budget
+        keep = []
+        for _, marks, amount, bundle_cost in bundles:
+            weight = marks * amount
+            kept = bytearray(budget + 1)
+            for total in range(budget, weight - 1, -1):
+                candidate = cost[total - weight] + bundle_cost
+                if candidate < cost[total]:
+                    cost[total] = candidate
+                    kept[total] = 1
+            keep.append(kept)
+
+        total = budget
+        while cost[total] == infinity:
+            total -= 1
+        for index in range(len(bundles) - 1, -1, -1):
+            if total and keep[index][total]:
+                level, marks, amount, _ = bundles[index]
+                self._take_from_pool(counts, pools[(level, marks)], amount)
+                total -= marks * amount
+
+    def _take_from_pool(self, counts: Dict[Group, int], pool_groups: List[Group], amount: int):
+        # Spread over chapters in proportion to what each still has
+        for _ in range(amount):
+            weights = [self._free(counts, group) for group in pool_groups]
+            self._take(counts, self.rng.choices(pool_groups, weights)[0])
+
+    def repair(self, counts: Dict[Group, int]) -> Dict[Group, int]:
+        self._add_chapter_minimums(counts)
+        self._fill(counts, self.spec.total_marks - sum(group[2] * count for group, count in counts.items()))
+        return counts
+
+    # Search
+
+    def solve(self, deadline: float) -> Dict[Group, int]:
+        best = self.repair({})
+        if not best:
+            # No question matches or fits the marks; removing and repairing can't change that
+            return best
+        best_score = self.objective(best)
+        while best_score > 0 and self.iterations < MAX_ITERATIONS:
+            if time.perf_counter() >= deadline:
+                self.timed_out = True
+                break
+            self.iterations += 1
+            candidate = dict(best)
+            taken = [group for group, count in candidate.items() for _ in range(count)]
+            for group in self.rng.sample(taken, min(len(taken), self.rng.randint(1, MAX_REMOVED))):
+                candidate[group] -= 1
+                if not candidate[group]:
+                    del candidate[group]
+            self.repair(candidate)
+            score = self.objective(candidate)
+            if score <= best_score:
+                best, best_score = candidate, score
+        return best
+
+
+def assemble_paper(snapshot, spec: PaperSpec, filters: Optional[Dict] = None, seed: Optional[int] = None,
+                   time_budget: float = 0.25) -> Dict:
+    """Assemble a paper from ``snapshot`` within ``time_budget`` seconds.
+
+    ``filters`` restricts the candidates (year, frequency...) as in a
+    structured query. Returns the questions with their metadata, grouped
+    by chapter, with a summary of how the paper meets the spec.
+    """
+    start = time.perf_counter()
+    if seed is None:
+        seed = random.getrandbits(32)
+    rng = random.Random(seed)
+    groups = build_groups(snapshot, filters or {})
+    solver = PaperSolver(groups, spec, rng)
+    counts = solver.solve(start + time_budget)
+
+    record_ids = []
+    for group in sorted(counts):
+        cursor = ShuffledCursor(groups[group], seed=rng.getrandbits(32))
+        record_ids.extend(cursor.next() for _ in range(counts[group]))
+    questions = [snapshot.records[record_id] for record_id in record_ids]
+    order = {chapter: position for position, chapter in enumerate(spec.chapters or ())}
+    questions.sort(key=lambda record: (order.get(record.chapter, len(order)), record.chapter,
+                                       record.marks, record.id))
+
+    by_chapter: Dict[str, Dict[str, int]] = {}
+    by_complexity: Dict[str, int] = {}
+    for record in questions:
+        chapter = by_chapter.setdefault(record.chapter, {"questions": 0, "marks": 0})
+        chapter["questions"] += 1
+        chapter["marks"] += record.marks
+        level = normalize_facet("complexity_level", record.complexity_level)
+        by_complexity[level] = by_complexity.get(level, 0) + record.marks
+    total = sum(record.marks for record in questions)
+
+    notes = []
+    required = solver.required_marks()
+    if not solver.available:
+        notes.append("No questions match the filters")
+    elif required > spec.total_marks:
+        notes.append(f"The required questions alone are worth at least {required} marks")
+    elif total != spec.total_marks:
+        notes.append(f"No combination of the matching questions adds up to exactly {spec.total_marks} marks")
+    for chapter, minimum in solver.minimums.items():
+        found = by_chapter.get(chapter, {}).get("questions", 0)
+        if found < minimum:
+            notes.append(f"Only {found} of the {minimum} questions required from {chapter} are available")
+
+    return {
+        "questions": [question_payload(record) for record in questions],
+        "total_marks": total,
+        "target_marks": spec.total_marks,
+        "exact": total == spec.total_marks,
+        "by_chapter": by_chapter,
+        "by_complexity": by_complexity,
+        "notes": notes,
+        "seed": seed,
+        "version": snapshot.version,
+        "iterations": solver.iterations,
+        "timed_out": solver.timed_out,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
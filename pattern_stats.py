@@ -0,0 +1,305 @@
+"""Streaming exam-pattern statistics for the question bank.
+
+Builds per-chapter, per-question-type and per-year aggregates in a single
+pass and saves them as a JSON artifact that the dataset build and the API
+read instead of rescanning the questions:
+
+    python pattern_stats.py questions.jsonl pattern_stats.json
+"""
+import argparse
+import json
+import os
+from bisect import insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from question_record import split_years
+
+STATS_FORMAT_VERSION = 1
+DEFAULT_STATS_PATH = "pattern_stats.json"
+
+# Metadata fields the statistics are grouped by
+GROUP_FIELDS = {
+    "chapter": "chapter",
+    "question_type": "question_type",
+    "year": "previous_years",
+}
+
+
+class StreamingHistogram:
+    """Fixed-size histogram for approximate quantiles (Ben-Haim & Tom-Tov).
+
+    Holds at most ``max_bins`` (centroid, count) pairs; when a new value
+    would exceed that, the two closest bins are merged. With fewer distinct
+    values than bins (as with exam marks) the quantiles are exact.
+    """
+
+    def __init__(self, max_bins: int = 32, bins: Optional[List[List[float]]] = None):
+        self.max_bins = max_bins
+        self.bins: List[List[float]] = bins or []
+
+    def add(self, value: float, count: int = 1):
+        for entry in self.bins:
+            if entry[0] == value:
+                entry[1] += count
+                return
+        insort(self.bins, [value, count])
+        if len(self.bins) > self.max_bins:
+            gaps = [self.bins[i + 1][0] - self.bins[i][0] for i in range(len(self.bins) - 1)]
+            i = gaps.index(min(gaps))
+            (left, left_count), (right, right_count) = self.bins[i], self.bins[i + 1]
+            merged_count = left_count + right_count
+            centroid = (left * left_count + right * right_count) / merged_count
+            self.bins[i:i + 2] = [[centroid, merged_count]]
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = sum(count for _, count in self.bins)
+        if not total:
+            return None
+        target = q * total
+        seen = 0
+        for value, count in self.bins:
+            seen += count
+            if seen >= target:
+                return value
+        return self.bins[-1][0]
+
+
+class RunningStats:
+    """Count, sum, min, max and approximate quantiles of a stream of numbers."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.histogram = StreamingHistogram()
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.histogram.add(value)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.histogram.quantile(q)
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "median": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "histogram": self.histogram.bins,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RunningStats":
+        stats = cls()
+        stats.count = data["count"]
+        stats.total = data["sum"]
+        stats.min = data["min"]
+        stats.max = data["max"]
+        stats.histogram = StreamingHistogram(bins=[list(entry) for entry in data["histogram"]])
+        return stats
+
+
+class GroupStats:
+    """Aggregates for the questions sharing one chapter, question type or year."""
+
+    def __init__(self):
+        self.count = 0
+        self.marks = RunningStats()
+        self.question_types = set()
+        self.frequency_patterns = set()
+
+    def add(self, metadata: Dict):
+        self.count += 1
+        try:
+            self.marks.add(int(metadata['marks']))
+        except (ValueError, KeyError):
+            # Skip marks that are 'N/A' or missing
+            pass
+        self.question_types.add(metadata['question_type'])
+        self.frequency_patterns.add(metadata['pattern_frequency'])
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "marks": self.marks.to_dict(),
+            "question_types": sorted(self.question_types),
+            "frequency_patterns": sorted(self.frequency_patterns),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "GroupStats":
+        stats = cls()
+        stats.count = data["count"]
+        stats.marks = RunningStats.from_dict(data["marks"])
+        stats.question_types = set(data["question_types"])
+        stats.frequency_patterns = set(data["frequency_patterns"])
+        return stats
+
+
+class PatternStats:
+    """Per-chapter, per-question-type and per-year aggregates of a question bank."""
+
+    def __init__(self, source: Optional[Dict] = None):
+        self.total_questions = 0
+        self.groups: Dict[str, Dict[str, GroupStats]] = {group: {} for group in GROUP_FIELDS}
+        self.source = source or {}
+        self._chapter_statistics: Dict[str, Dict] = {}
+
+    def add(self, metadata: Dict):
+        self.total_questions += 1
+        for group, field in GROUP_FIELDS.items():
+            key = metadata.get(field)
+            if key is None:
+                continue
+            # A merged 'previous_years' label ('2017, 2019') counts towards each year
+            for key in (split_years(key) if group == "year" else (key,)):
+                stats = self.groups[group].get(key)
+                if stats is None:
+                    stats = self.groups[group][key] = GroupStats()
+                stats.add(metadata)
+
+    def built_from(self, path: str, signature: Tuple[int, int]) -> bool:
+        """Whether these statistics were computed from ``path`` as of its (mtime_ns, size) ``signature``."""
+        return self.source.get("path") == os.path.abspath(path) and \
+            (self.source.get("mtime_ns"), self.source.get("size")) == tuple(signature)
+
+    def get(self, group: str, key: str) -> Optional[GroupStats]:
+        return self.groups[group].get(key)
+
+    def chapter_statistics(self, chapter: str) -> Dict:
+        """The ``chapter_statistics`` block of an enhanced question, computed once per chapter."""
+        summary = self._chapter_statistics.get(chapter)
+        if summary is None:
+            stats = self.groups["chapter"][chapter]
+            summary = {
+                "total_questions": stats.count,
+                "average_marks": stats.marks.mean if stats.marks.count else 'N/A',
+                "question_types": sorted(stats.question_types),
+                "frequency_patterns": sorted(stats.frequency_patterns),
+            }
+            self._chapter_statistics[chapter] = summary
+        return summary
+
+    def to_dict(self) -> Dict:
+        return {
+            "format_version": STATS_FORMAT_VERSION,
+            "source": self.source,
+            "total_questions": self.total_questions,
+            "groups": {
+                group: {key: stats.to_dict() for key, stats in sorted(groups.items())}
+                for group, groups in self.groups.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "PatternStats":
+        stats = cls(data.get("source"))
+        stats.total_questions = data["total_questions"]
+        for group in GROUP_FIELDS:
+            stats.groups[group] = {
+                key: GroupStats.from_dict(value) for key, value in data["groups"].get(group, {}).items()
+            }
+        return stats
+
+    def save(self, path: str):
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "PatternStats":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("format_version") != STATS_FORMAT_VERSION:
+            raise ValueError(f"Unsupported stats format in {path}")
+        return cls.from_dict(data)
+
+
+def collect_stats(records: Iterable, source: Optional[Dict] = None) -> PatternStats:
+    """Aggregate dict records or Question records in one pass; None entries
+    (records removed from a snapshot) are skipped."""
+    stats = PatternStats(source)
+    for record in records:
+        if record is None:
+            continue
+        stats.add(record['metadata'] if isinstance(record, dict) else record.metadata)
+    return stats
+
+
+def source_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def iter_jsonl(path: str) -> Iterable[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def build_stats(questions_path: str, stats_path: Optional[str] = None) -> PatternStats:
+    """Compute statistics for a JSONL file and optionally save the artifact."""
+    stats = collect_stats(iter_jsonl(questions_path), source_signature(questions_path))
+    if stats_path:
+        stats.save(stats_path)
+    return stats
+
+
+def load_or_build_stats(questions_path: str, stats_path: str = DEFAULT_STATS_PATH) -> Tuple[PatternStats, bool]:
+    """Load the artifact if it was built from the current file, else rebuild it.
+
+    Returns the statistics and whether they had to be rebuilt.
+    """
+    try:
+        stats = PatternStats.load(stats_path)
+        if stats.source == source_signature(questions_path):
+            return stats, False
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_stats(questions_path, stats_path), True
+
+
+_cached_artifacts: Dict[str, Tuple[Tuple[int, int], PatternStats]] = {}
+
+
+def load_cached(stats_path: str) -> Optional[PatternStats]:
+    """Load an artifact once per version of the file; None if it does not exist."""
+    try:
+        stat = os.stat(stats_path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _cached_artifacts.get(stats_path)
+    if cached is None or cached[0] != signature:
+        cached = (signature, PatternStats.load(stats_path))
+        _cached_artifacts[stats_path] = cached
+    return cached[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="question bank JSONL file")
+    parser.add_argument("output", nargs="?", default=DEFAULT_STATS_PATH, help="stats artifact to write")
+    args = parser.parse_args()
+
+    stats = build_stats(args.questions, args.output)
+    print(f"Summarized {stats.total_questions} questions "
+          f"({len(stats.groups['chapter'])} chapters) into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,415 @@
+"""Streaming build pipeline for the fine-tuning datasets.
+
+Chains the per-record transforms from convert_format.py, enhance_dataset.py
+and miscellaneous/update_prompts.py as stages over a JSONL file:
+
+    python pipeline.py miscellaneous/updated_instruction_dataset.jsonl \\
+        updated_fine_tuning_dataset.jsonl --stages convert,update-prompts
+
+    python pipeline.py questions.jsonl enhanced_questions.jsonl --stages enhance
+
+    python pipeline.py questions.jsonl questions_dedup.jsonl --stages dedup
+
+The input is read in chunks of lines that are transformed on a process
+pool; only a bounded number of chunks are in flight at a time, so memory
+stays constant however large the input is, and chunks are written back in
+input order.
+
+With --incremental, a manifest of per-record content hashes is kept next
+to the output (OUTPUT.manifest) and a rebuild only transforms records
+that are new or changed, copying the rest from the previous output.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from build_manifest import BuildManifest, manifest_path_for, read_range, record_key, state_digest
+from convert_format import convert_entry
+from dedup import DEFAULT_THRESHOLD, DedupPlan, NearDuplicateIndex, dedup_digest, dedup_record, signature_chunk
+from enhance_dataset import analyze_patterns, generate_interactive_prompt
+from miscellaneous.update_prompts import update_entry
+from pattern_stats import PatternStats, load_or_build_stats
+from trends import TrendModel, record_chapter
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class StageContext:
+    """Shared inputs for stages: corpus-wide statistics and trends, the dedup
+    plan, a random source, and the position of the record being transformed."""
+
+    def __init__(self, chapter_stats: Optional[PatternStats], rng: random.Random,
+                 dedup_plan: Optional[DedupPlan] = None, trends: Optional[TrendModel] = None):
+        self.chapter_stats = chapter_stats
+        self.rng = rng
+        self.dedup_plan = dedup_plan
+        self.trends = trends
+        self.record_index = 0
+        self._chapter_digests: Dict[str, str] = {}
+        self._trend_digests: Dict[Optional[str], str] = {}
+
+    def chapter_digest(self, chapter: str) -> str:
+        digest = self._chapter_digests.get(chapter)
+        if digest is None:
+            digest = self._chapter_digests[chapter] = state_digest(self.chapter_stats.chapter_statistics(chapter))
+        return digest
+
+    def trend_digest(self, chapter: Optional[str]) -> str:
+        digest = self._trend_digests.get(chapter)
+        if digest is None:
+            digest = self._trend_digests[chapter] = self.trends.digest(chapter) if self.trends else ""
+        return digest
+
+
+class Stage:
+    """A per-record transform from one record schema to another.
+
+    A transform may return None to drop the record. Stages that need a
+    pass over the whole input first (statistics, duplicate detection) must
+    be the first stage. Stages that need trends get them from the whole
+    input (or another question bank) and may come later. A stage's
+    ``digest(record, context)``, given the input record, summarizes the
+    shared state a record's output depends on, so incremental builds know
+    to redo the record when that state changes.
+    """
+
+    def __init__(self, name: str, consumes: str, produces: str, transform,
+                 needs_stats: bool = False, needs_dedup: bool = False, ensure_ascii: bool = True,
+                 digest: Optional[Callable] = None, needs_trends: bool = False):
+        self.name = name
+        self.consumes = consumes
+        self.produces = produces
+        self.transform = transform
+        self.digest = digest
+        self.needs_stats = needs_stats
+        self.needs_dedup = needs_dedup
+        self.needs_trends = needs_trends
+        self.ensure_ascii = ensure_ascii
+
+
+# Schemas: 'instruction' (updated_instruction_dataset.jsonl), 'question'
+# (questions.jsonl), 'conversation' ({"messages": [...]}) and 'enhanced'
+# (enhanced_questions.jsonl); 'any' stages keep whatever schema they get
+ANY_SCHEMA = "any"
+
+STAGES = {
+    "convert": Stage(
+        "convert", "instruction", "conversation",
+        lambda record, context: convert_entry(record),
+    ),
+    "enhance": Stage(
+        "enhance", "question", "enhanced",
+        lambda record, context: generate_interactive_prompt(record, context.chapter_stats, context.rng),
+        needs_stats=True, ensure_ascii=False,
+        # Records embed their chapter's statistics
+        digest=lambda record, context: context.chapter_digest(record['metadata']['chapter']),
+    ),
+    "update-prompts": Stage(
+        "update-prompts", "conversation", "conversation",
+        lambda record, context: update_entry(record, context.trends),
+        # The pattern analysis comes from the trends of the record's chapter
+        needs_trends=True, digest=lambda record, context: context.trend_digest(record_chapter(record)),
+    ),
+    "dedup": Stage(
+        "dedup", ANY_SCHEMA, ANY_SCHEMA, dedup_record,
+        needs_dedup=True, ensure_ascii=False, digest=dedup_digest,
+    ),
+}
+
+
+def resolve_stages(names: List[str]) -> List[Stage]:
+    """Look up stages by name and check that each one accepts the previous one's output."""
+    stages = []
+    for name in names:
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage '{name}'; choose from {', '.join(STAGES)}")
+        stage = STAGES[name]
+        if stages and ANY_SCHEMA not in (stages[-1].produces, stage.consumes) \
+                and stages[-1].produces != stage.consumes:
+            raise ValueError(f"Stage '{name}' expects {stage.consumes} records, "
+                             f"but '{stages[-1].name}' produces {stages[-1].produces} records")
+        if (stage.needs_stats or stage.needs_dedup) and stages:
+            raise ValueError(f"Stage '{name}' must be the first stage")
+        stages.append(stage)
+    if not stages:
+        raise ValueError("At least one stage is required")
+    return stages
+
+
+def iter_records(path: str) -> Iterator[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_chunks(path: str, chunk_size: int) -> Iterator[List[str]]:
+    chunk = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(line)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def chunk_rng(seed: Optional[int], chunk_index: int) -> random.Random:
+    # Seeding per chunk keeps seeded output identical for any number of workers
+    if seed is None:
+        return random.Random()
+    return random.Random(f"{seed}:{chunk_index}")
+
+
+def transform_chunk(stage_names: List[str], chapter_stats: Optional[PatternStats], seed: Optional[int],
+                    dedup_plan: Optional[DedupPlan], chunk_index: int, first_record: int,
+                    lines: List[str], known_keys: Optional[FrozenSet[str]] = None,
+                    trends: Optional[TrendModel] = None) -> Tuple[List, int]:
+    """Run every stage over a chunk of JSONL lines; returns (output lines, skipped count).
+
+    ``first_record`` is the position of the chunk's first line in the input.
+
+    With ``known_keys`` (an incremental build) the output is instead a
+    (key, line) entry per record: line is None when the key is known and
+    the previous output can be reused, and "" when the stages dropped the
+    record. Seeded randomness is then drawn per record from its key, so a
+    record's output does not depend on which other records were rebuilt.
+    """
+    stages = resolve_stages(stage_names)
+    context = StageContext(chapter_stats, chunk_rng(seed, chunk_index), dedup_plan, trends)
+    ensure_ascii = stages[-1].ensure_ascii
+    digest_stages = [stage for stage in stages if stage.digest is not None]
+    output = []
+    skipped = 0
+    for record_index, line in enumerate(lines, first_record):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            skipped += 1
+            continue
+        context.record_index = record_index
+        if known_keys is not None:
+            key = record_key(line, [stage.digest(record, context) for stage in digest_stages])
+            if key in known_keys:
+                output.append((key, None))
+                continue
+            if seed is not None:
+                context.rng.seed(f"{seed}:{key}")
+        for stage in stages:
+            record = stage.transform(record, context)
+            if record is None:
+                break
+        result = "" if record is None else json.dumps(record, ensure_ascii=ensure_ascii) + '\n'
+        if known_keys is not None:
+            output.append((key, result))
+        elif result:
+            output.append(result)
+    return output, skipped
+
+
+_worker_args: Tuple = ()
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _transform_in_worker(chunk_index: int, first_record: int, lines: List[str]) -> Tuple[List, int]:
+    stage_names, chapter_stats, seed, dedup_plan, known_keys, trends = _worker_args
+    return transform_chunk(stage_names, chapter_stats, seed, dedup_plan, chunk_index, first_record, lines,
+                           known_keys, trends)
+
+
+def map_chunks(func: Callable, chunks: Iterable[Tuple], workers: int,
+               initializer: Optional[Callable] = None, initargs: Tuple = ()) -> Iterator:
+    """Apply ``func(*chunk)`` to every chunk and yield the results in input order.
+
+    With more than one worker the chunks run on a process pool, with a
+    bounded window of chunks in flight so memory stays constant.
+    """
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for chunk in chunks:
+            yield func(*chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(func, *chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def find_near_duplicates(input_path: str, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         threshold: float = DEFAULT_THRESHOLD) -> NearDuplicateIndex:
+    """Cluster the near-duplicate records of a JSONL file.
+
+    Signatures are computed on the process pool; clustering runs as the
+    ordered results arrive, so records are numbered in input order.
+    """
+    index = NearDuplicateIndex(threshold)
+    chunks = ((lines,) for lines in iter_chunks(input_path, chunk_size))
+    for signatures in map_chunks(signature_chunk, chunks, workers):
+        for entry in signatures:
+            if entry is None:
+                index.add(None)
+            else:
+                index.add(*entry)
+    return index
+
+
+def run_pipeline(input_path: str, output_path: str, stage_names: List[str], workers: int = 1,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, seed: Optional[int] = None,
+                 stats_path: Optional[str] = None, dedup_threshold: float = DEFAULT_THRESHOLD,
+                 dedup_report_path: Optional[str] = None,
+                 manifest_path: Optional[str] = None,
+                 trends_source: Optional[str] = None) -> Tuple[int, int]:
+    """Stream ``input_path`` through the stages into ``output_path``.
+
+    Returns the number of records written and the number of invalid lines
+    skipped. The output is written to a temporary file and moved into
+    place once complete. Stages that need corpus statistics read them from
+    ``stats_path`` when it is up to date with the input. The dedup stage
+    clusters the input first, and writes its report to ``dedup_report_path``
+    if given. Stages that need trends compute them from ``trends_source``,
+    a question bank, or from the input by default.
+
+    With ``manifest_path`` the build is incremental: records whose key is
+    in the previous build's manifest are copied from the previous output,
+    and the manifest is rewritten for the new output along with a summary
+    of how many records were reused, transformed and removed. Changing the
+    stages or seed, or touching the output, forces a full rebuild.
+    """
+    stages = resolve_stages(stage_names)
+    chapter_stats = None
+    if any(stage.needs_stats for stage in stages):
+        if stats_path:
+            chapter_stats, _ = load_or_build_stats(input_path, stats_path)
+        else:
+            # A first streaming pass collects the corpus-wide statistics
+            chapter_stats = analyze_patterns(iter_records(input_path))
+
+    trends = None
+    if any(stage.needs_trends for stage in stages):
+        trends = TrendModel.from_records(iter_records(trends_source or input_path))
+
+    dedup_plan = None
+    if any(stage.needs_dedup for stage in stages):
+        duplicates = find_near_duplicates(input_path, workers, chunk_size, dedup_threshold)
+        dedup_plan = duplicates.plan()
+        if dedup_report_path:
+            with open(dedup_report_path, 'w', encoding='utf-8') as f:
+                json.dump(duplicates.report(), f, ensure_ascii=False, indent=2)
+
+    previous = manifest = known_keys = None
+    if manifest_path:
+        build = {"stages": stage_names, "seed": seed}
+        previous = BuildManifest.load(manifest_path)
+        if previous is not None and not previous.matches(build, output_path):
+            previous = None
+        known_keys = previous.keys() if previous is not None else frozenset()
+        manifest = BuildManifest(build)
+
+    written = 0
+    skipped = 0
+    reused = 0
+    temp_path = output_path + ".tmp"
+    old_output = open(output_path, 'rb') if previous is not None else None
+    try:
+        with open(temp_path, 'wb') as out:
+            chunks = ((chunk_index, chunk_index * chunk_size, lines)
+                      for chunk_index, lines in enumerate(iter_chunks(input_path, chunk_size)))
+            for lines, chunk_skipped in map_chunks(_transform_in_worker, chunks, workers, _init_worker,
+                                                   (stage_names, chapter_stats, seed, dedup_plan, known_keys,
+                                                    trends)):
+                skipped += chunk_skipped
+                if manifest is None:
+                    out.write("".join(lines).encode('utf-8'))
+                    written += len(lines)
+                    continue
+                for key, line in lines:
+                    if line is None:
+                        data = read_range(old_output, *previous.output_range(key))
+                        reused += 1
+                    else:
+                        data = line.encode('utf-8')
+                    manifest.add(key, out.tell(), len(data))
+                    if data:
+                        out.write(data)
+                        written += 1
+    finally:
+        if old_output is not None:
+            old_output.close()
+    os.replace(temp_path, output_path)
+    if manifest is not None:
+        manifest.output_size = os.path.getsize(output_path)
+        manifest.summary = {
+            "reused": reused,
+            "transformed": len(manifest.entries) - reused,
+            "removed": len(known_keys - manifest.keys()),
+        }
+        manifest.save(manifest_path)
+    return written, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="input JSONL file")
+    parser.add_argument("output", help="output JSONL file")
+    parser.add_argument("--stages", required=True,
+                        help=f"comma-separated stages to apply in order ({', '.join(STAGES)})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (1 runs in-process)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="records per chunk sent to a worker")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed for randomized prompts, for reproducible output")
+    parser.add_argument("--stats", default=None,
+                        help="pattern statistics artifact to reuse (rebuilt if stale)")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="estimated Jaccard similarity at which questions count as duplicates")
+    parser.add_argument("--dedup-report", default=None,
+                        help="where the dedup stage writes its cluster report (default: OUTPUT.dedup.json)")
+    parser.add_argument("--trend-source", default=None,
+                        help="question bank the update-prompts trends are computed from (default: the input)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only transform records added or changed since the last --incremental build")
+    args = parser.parse_args()
+
+    try:
+        stage_names = [name.strip() for name in args.stages.split(",") if name.strip()]
+        dedup_report = args.dedup_report
+        if dedup_report is None and "dedup" in stage_names:
+            dedup_report = os.path.splitext(args.output)[0] + ".dedup.json"
+        manifest_path = manifest_path_for(args.output) if args.incremental else None
+        written, skipped = run_pipeline(args.input, args.output, stage_names, args.workers,
+                                        args.chunk_size, args.seed, args.stats,
+                                        args.dedup_threshold, dedup_report, manifest_path, args.trend_source)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"Wrote {written} records to {args.output}")
+    if manifest_path:
+        summary = BuildManifest.load(manifest_path).summary
+        print(f"Reused {summary['reused']}, transformed {summary['transformed']} "
+              f"and removed {summary['removed']} records")
+    if dedup_report:
+        print(f"Wrote the duplicate report to {dedup_report}")
+    if skipped:
+        print(f"Skipped {skipped} invalid JSON lines", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Sequence
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL = 10 * 60  # seconds a cached result may be reused
+
+
+class QueryCache:
+    """Bounded LRU/TTL cache of filter-query results.
+
+    Entries hold record-ID sequences rather than rendered text, so answers
+    still pick randomly among the matches. Every entry is tagged with the
+    dataset version it was computed from; a lookup against any other
+    version is a miss, so reloading the dataset invalidates the cache
+    without any explicit hook.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: int) -> Optional[Sequence[int]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version or now - entry[1] >= self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, version: int, record_ids: Sequence[int]):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), record_ids)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, version: int,
+                       compute: Callable[[], Sequence[int]]) -> Sequence[int]:
+        record_ids = self.get(key, version)
+        if record_ids is None:
+            record_ids = compute()
+            self.put(key, version, record_ids)
+        return record_ids
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def create_query_cache() -> QueryCache:
+    """Build the query cache sized by the CHAT_QUERY_CACHE_* environment variables."""
+    return QueryCache(
+        max_entries=int(os.environ.get("CHAT_QUERY_CACHE_SIZE", DEFAULT_MAX_ENTRIES)),
+        ttl=float(os.environ.get("CHAT_QUERY_CACHE_TTL", DEFAULT_TTL)),
+    )
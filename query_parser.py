@@ -0,0 +1,192 @@
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fuzzy_index import FuzzyIndex
+
+MARKS_PATTERN = re.compile(r'(\d+)\s*marks?')
+YEAR_PATTERNS = [
+    re.compile(r'\b20[0-2]\d\b'),  # Matches years 2000-2029
+    re.compile(r"'?\b\d{2}\b"),    # Matches two-digit years with optional apostrophe
+]
+
+# Fuzzy chapter matching only looks at words at least this long
+MIN_FUZZY_WORD_LENGTH = 4
+FUZZY_CUTOFF = 0.8
+# Upper bound (in seconds) on fuzzy matching for a single message
+FUZZY_TIME_BUDGET = 0.005
+
+
+class AhoCorasick:
+    """Multi-pattern substring matcher.
+
+    All patterns are compiled into one automaton, so scanning a message
+    costs time proportional to the message length plus the number of
+    matches, however many patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[Tuple[str, object]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[int, object]]] = [[]]
+
+        for pattern, payload in patterns:
+            node = 0
+            for char in pattern:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = next_node
+            self._out[node].append((len(pattern), payload))
+
+        # Breadth-first pass to fill in failure links and inherited outputs
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child].extend(self._out[self._fail[child]])
+
+    def find_all(self, text: str) -> List[Tuple[int, object]]:
+        """Return (start offset, payload) for every pattern occurrence in ``text``."""
+        matches = []
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length, payload in out[node]:
+                matches.append((end - length, payload))
+        return matches
+
+
+class ParsedQuery:
+    """Every slot extracted from one user message."""
+
+    def __init__(self, text: str, lowered: str, words: List[str], chapter: Optional[str],
+                 difficulty: Optional[str], frequency: Optional[str], marks: Optional[int],
+                 year: Optional[str]):
+        self.text = text
+        self.lowered = lowered
+        self.words = words
+        self.chapter = chapter
+        self.difficulty = difficulty
+        self.frequency = frequency
+        self.marks = marks
+        self.year = year
+
+    def __repr__(self) -> str:
+        return (f"ParsedQuery(chapter={self.chapter!r}, difficulty={self.difficulty!r}, "
+                f"frequency={self.frequency!r}, marks={self.marks!r}, year={self.year!r})")
+
+
+class QueryParser:
+    """Extracts chapter, difficulty, frequency, marks and year from a message.
+
+    Chapter names, aliases and the difficulty/frequency vocabularies are
+    compiled into a single Aho-Corasick automaton, so a message is lowercased
+    and scanned once no matter how large the vocabulary grows. Where several
+    terms match, the same precedence as the original detect_* helpers
+    applies: full chapter names beat aliases, direct frequency terms beat
+    their synonyms, and aliases and synonyms are tried in the order they
+    were declared. Ties between equally ranked terms go to the one that
+    appears first in the message.
+    """
+
+    def __init__(self, chapters: Iterable[str], chapter_aliases: Dict[str, str],
+                 difficulties: Iterable[str], frequencies: Iterable[str],
+                 frequency_synonyms: Dict[str, str]):
+        self.chapters = list(chapters)
+        self.chapter_aliases = dict(chapter_aliases)
+
+        # Payloads are (slot, value, rank); within a slot the lowest
+        # (rank, position) wins
+        patterns = []
+        for chapter in self.chapters:
+            patterns.append((chapter.lower(), ("chapter", chapter, 0)))
+        for rank, (alias, chapter) in enumerate(self.chapter_aliases.items(), 1):
+            patterns.append((alias, ("chapter", chapter, rank)))
+        for difficulty in difficulties:
+            patterns.append((difficulty, ("difficulty", difficulty, 0)))
+        for frequency in frequencies:
+            patterns.append((frequency, ("frequency", frequency, 0)))
+        for rank, (synonym, frequency) in enumerate(frequency_synonyms.items(), 1):
+            patterns.append((synonym, ("frequency", frequency, rank)))
+        self._automaton = AhoCorasick(patterns)
+
+        self._fuzzy_index = FuzzyIndex(self.chapters + list(self.chapter_aliases), cutoff=FUZZY_CUTOFF)
+        self._chapters_by_lower = {chapter.lower(): chapter for chapter in self.chapters}
+
+    def _match_slots(self, lowered: str) -> Dict[str, str]:
+        best: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        for start, (slot, value, rank) in self._automaton.find_all(lowered):
+            key = (rank, start)
+            if slot not in best or key < best[slot][0]:
+                best[slot] = (key, value)
+        return {slot: value for slot, (_, value) in best.items()}
+
+    def fuzzy_chapter(self, words: List[str]) -> Optional[str]:
+        """Match misspelled chapter names or aliases, one word at a time."""
+        deadline = time.perf_counter() + FUZZY_TIME_BUDGET
+        for word in words:
+            if len(word) < MIN_FUZZY_WORD_LENGTH:  # Skip very short words
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            match = self._fuzzy_index.best_match(word, time_budget=remaining)
+            if match:
+                matched_term = match[0]
+                # If matched an alias, return its chapter
+                if matched_term in self.chapter_aliases:
+                    return self.chapter_aliases[matched_term]
+                return self._chapters_by_lower.get(matched_term.lower())
+        return None
+
+    def parse(self, user_input: str) -> ParsedQuery:
+        lowered = user_input.lower()
+        words = lowered.split()
+        slots = self._match_slots(lowered)
+
+        chapter = slots.get("chapter") or self.fuzzy_chapter(words)
+        return ParsedQuery(
+            text=user_input,
+            lowered=lowered,
+            words=words,
+            chapter=chapter,
+            difficulty=slots.get("difficulty"),
+            frequency=slots.get("frequency"),
+            marks=parse_marks(lowered),
+            year=parse_year(user_input),
+        )
+
+
+def parse_marks(lowered: str) -> Optional[int]:
+    """Extract marks such as '5 marks' from a lowercased message."""
+    match = MARKS_PATTERN.search(lowered)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def parse_year(user_input: str) -> Optional[str]:
+    """Extract a 4-digit or 2-digit ('23) exam year from a message."""
+    for pattern in YEAR_PATTERNS:
+        match = pattern.search(user_input)
+        if match:
+            year = match.group()
+            # Convert 2-digit year to 4-digit year
+            if len(year) == 2 or (len(year) == 3 and year[0] == "'"):  # Handle '23 format
+                year = year.strip("'")
+                return f"20{year}"
+            return year
+    return None
@@ -0,0 +1,116 @@
+import json
+import re
+from sys import intern
+from typing import Dict, Iterator, Optional, Tuple
+
+_YEAR_PATTERN = re.compile(r'\d{4}')
+
+# Distinct year tuples are few, so records share them
+_years_cache: Dict[str, Tuple[int, ...]] = {}
+
+
+def parse_marks(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_years(value) -> Tuple[int, ...]:
+    """Parse ``previous_years`` ('2017', or '2017, 2019') into a shared tuple of ints."""
+    value = str(value) if value is not None else ""
+    years = _years_cache.get(value)
+    if years is None:
+        years = _years_cache[value] = tuple(int(year) for year in _YEAR_PATTERN.findall(value))
+    return years
+
+
+def split_years(value) -> Tuple[str, ...]:
+    """The individual years of a ``previous_years`` label ('2017, 2019' -> ('2017', '2019')).
+
+    Labels without a 4-digit year are returned whole.
+    """
+    years = parse_years(value)
+    if years:
+        return tuple(str(year) for year in years)
+    value = str(value).strip() if value is not None else ""
+    return (value,) if value else ()
+
+
+class Question:
+    """Compact, read-only question record.
+
+    Repeated metadata strings are interned so every record shares one copy,
+    marks and years are also kept as integers, and ``__slots__`` avoids a
+    per-record ``__dict__``. The original labels (``marks_label``,
+    ``previous_years``) are kept for display and for ``to_dict``.
+    """
+
+    __slots__ = (
+        "id", "instruction", "input", "text", "chapter", "marks", "marks_label",
+        "question_type", "pattern_frequency", "complexity_level", "years", "previous_years",
+    )
+
+    def __init__(self, id: int, text: str, chapter: str, marks_label: str, question_type: str,
+                 pattern_frequency: str, complexity_level: str, previous_years: str,
+                 instruction: Optional[str] = None, input: str = ""):
+        self.id = id
+        self.instruction = instruction
+        self.input = input
+        self.text = text
+        self.chapter = intern(chapter)
+        self.marks_label = intern(marks_label)
+        self.marks = parse_marks(marks_label)
+        self.question_type = intern(question_type)
+        self.pattern_frequency = intern(pattern_frequency)
+        self.complexity_level = intern(complexity_level)
+        self.previous_years = intern(previous_years)
+        self.years = parse_years(previous_years)
+
+    @classmethod
+    def from_dict(cls, id: int, record: Dict) -> "Question":
+        """Build from an instruction-dataset record or a questions.jsonl record."""
+        metadata = record["metadata"]
+        return cls(
+            id=id,
+            text=record["output"] if "output" in record else record["question"],
+            chapter=str(metadata.get("chapter", "")),
+            marks_label=str(metadata.get("marks", "N/A")),
+            question_type=str(metadata.get("question_type", "")),
+            pattern_frequency=str(metadata.get("pattern_frequency", "")),
+            complexity_level=str(metadata.get("complexity_level", "")),
+            previous_years=str(metadata.get("previous_years", "")),
+            instruction=record.get("instruction"),
+            input=record.get("input", ""),
+        )
+
+    @property
+    def metadata(self) -> Dict:
+        """The metadata block in its original dict form."""
+        return {
+            "chapter": self.chapter,
+            "marks": self.marks_label,
+            "question_type": self.question_type,
+            "pattern_frequency": self.pattern_frequency,
+            "complexity_level": self.complexity_level,
+            "previous_years": self.previous_years,
+        }
+
+    def to_dict(self) -> Dict:
+        if self.instruction is None:
+            return {"question": self.text, "metadata": self.metadata}
+        return {"instruction": self.instruction, "input": self.input, "output": self.text,
+                "metadata": self.metadata}
+
+    def __repr__(self) -> str:
+        return f"Question(id={self.id}, chapter={self.chapter!r}, marks={self.marks_label!r})"
+
+
+def load_questions(file_path: str) -> Iterator[Question]:
+    """Stream a JSONL question bank as Question records, numbered from 0."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        record_id = 0
+        for line in f:
+            if line.strip():
+                yield Question.from_dict(record_id, json.loads(line))
+                record_id += 1
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from itertools import chain
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from columnar import CACHE_SUFFIX, ColumnarBank, ColumnarRecords, open_fresh_cache
+from facet_index import FacetIndex
+from question_record import Question
+from text_index import TextIndex
+
+logger = logging.getLogger(__name__)
+
+# How often (in seconds) readers are allowed to stat the dataset file
+DEFAULT_POLL_INTERVAL = 2.0
+
+# Share of a bank that may change between reloads, or be left as removed
+# slots, before a reload re-parses the whole file instead of a delta
+DELTA_RELOAD_LIMIT = 0.25
+
+
+def load_dataset(file_path: str) -> List[Dict]:
+    """Load and parse the JSONL dataset."""
+    dataset = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                dataset.append(json.loads(line.strip()))
+    return dataset
+
+
+def file_signature(file_path: str) -> Tuple[int, int]:
+    """Return the (mtime_ns, size) pair used to detect changes to a file."""
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def line_digest(line: bytes) -> int:
+    """64-bit content hash of a JSONL line; never 0, which marks a removed record."""
+    return int.from_bytes(hashlib.blake2b(line.strip(), digest_size=8).digest(), "little") or 1
+
+
+class DatasetSnapshot:
+    """An immutable, fully loaded and indexed copy of the question bank.
+
+    Readers hold on to a snapshot for the duration of a request, so a reload
+    that happens in the meantime never changes the data underneath them.
+
+    The text index is only needed for free-text searches, so it is built
+    on first use (the facet index of a columnar cache is mapped, not
+    built, and opening one stays cheap).
+
+    Snapshots parsed from JSONL keep a content hash per record
+    (``line_digests``) so the next reload can apply just the difference.
+    Records removed by such a reload leave a None in ``records`` and are
+    out of both indexes; ``live_count`` is the number still present.
+    """
+
+    def __init__(self, records: Sequence[Question], signature: Tuple[int, int], version: int,
+                 index: Optional[FacetIndex] = None, path: Optional[str] = None,
+                 text_index: Optional[TextIndex] = None, line_digests: Optional[array] = None,
+                 live_count: Optional[int] = None):
+        self.records = records
+        self.index = index if index is not None else FacetIndex.build(records)
+        self._text_index = text_index
+        self._text_index_lock = threading.Lock()
+        self.signature = signature
+        self.version = version
+        self.path = path
+        self.line_digests = line_digests
+        self.live_count = live_count if live_count is not None else len(records)
+        self.loaded_at = time.time()
+
+    @property
+    def text_index(self) -> TextIndex:
+        text_index = self._text_index
+        if text_index is None:
+            with self._text_index_lock:
+                if self._text_index is None:
+                    self._text_index = TextIndex.build(self.records)
+                text_index = self._text_index
+        return text_index
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+class QuestionStore:
+    """Process-wide cache of a JSONL question bank.
+
+    When a columnar cache (see columnar.py) built from the current version of
+    the file exists, or ``file_path`` is itself a ``.qbc`` file, the records
+    and facet index are memory-mapped from it instead of parsed. Otherwise
+    the file is parsed once; afterwards readers get the current snapshot and,
+    at most every ``poll_interval`` seconds, trigger a cheap stat of the file.
+    When the mtime or size changes the file is re-read on a background
+    thread and the new snapshot is swapped in with a single assignment.
+
+    A reload hashes every line and only parses the records whose content
+    is new: they get new IDs after the existing ones, records no longer in
+    the file are removed, and both indexes are updated copy-on-write.
+    Larger changes (see ``DELTA_RELOAD_LIMIT``) re-parse the whole file,
+    which also renumbers the records compactly.
+    """
+
+    def __init__(self, file_path: str, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.file_path = file_path
+        self.poll_interval = poll_interval
+        self.reload_count = 0
+        self._snapshot: Optional[DatasetSnapshot] = None
+        self._lock = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._last_check = 0.0
+
+    def _load(self) -> DatasetSnapshot:
+        signature = file_signature(self.file_path)
+        version = self._snapshot.version + 1 if self._snapshot else 1
+        if self.file_path.endswith(CACHE_SUFFIX):
+            bank = ColumnarBank(self.file_path)
+        else:
+            bank = open_fresh_cache(self.file_path)
+        if bank is not None:
+            return DatasetSnapshot(ColumnarRecords(bank), signature, version, bank.facet_index(),
+                                   path=self.file_path)
+        previous = self._snapshot
+        if previous is not None and previous.line_digests is not None:
+            snapshot = self._load_delta(previous, signature, version)
+            if snapshot is not None:
+                return snapshot
+        records = []
+        digests = array('Q')
+        with open(self.file_path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    digests.append(line_digest(line))
+                    records.append(Question.from_dict(len(records), json.loads(line)))
+        return DatasetSnapshot(records, signature, version, path=self.file_path, line_digests=digests)
+
+    def _load_delta(self, previous: DatasetSnapshot, signature: Tuple[int, int],
+                    version: int) -> Optional[DatasetSnapshot]:
+        """Apply the file's changes since ``previous``; None when a full load is due."""
+        unmatched: Dict[int, List[int]] = {}
+        for record_id, digest in enumerate(previous.line_digests):
+            if digest:
+                unmatched.setdefault(digest, []).append(record_id)
+        limit = DELTA_RELOAD_LIMIT * max(previous.live_count, 1)
+        added_lines = []
+        with open(self.file_path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                digest = line_digest(line)
+                ids = unmatched.get(digest)
+                if ids:
+                    ids.pop()
+                    if not ids:
+                        del unmatched[digest]
+                else:
+                    added_lines.append((digest, line))
+                    if len(added_lines) > limit:
+                        return None
+        removed_ids = sorted(chain.from_iterable(unmatched.values()))
+        free_slots = len(previous.records) - previous.live_count + len(removed_ids)
+        if len(added_lines) + len(removed_ids) > limit or \
+                free_slots > DELTA_RELOAD_LIMIT * (len(previous.records) + len(added_lines)):
+            return None
+        if not added_lines and not removed_ids:
+            # Touched but unchanged: same records and indexes under a new signature
+            return DatasetSnapshot(previous.records, signature, version, previous.index, self.file_path,
+                                   previous._text_index, previous.line_digests, previous.live_count)
+
+        records = list(previous.records)
+        digests = array('Q', previous.line_digests)
+        removed = {}
+        for record_id in removed_ids:
+            removed[record_id] = records[record_id]
+            records[record_id] = None
+            digests[record_id] = 0
+        added = {}
+        for digest, line in added_lines:
+            record = Question.from_dict(len(records), json.loads(line))
+            added[record.id] = record
+            records.append(record)
+            digests.append(digest)
+        index = previous.index.with_changes(removed, added)
+        # An index the previous snapshot never built is left to be built on first use
+        text_index = None
+        if previous._text_index is not None:
+            text_index = previous._text_index.with_changes(
+                [(record_id, record.text) for record_id, record in removed.items()],
+                [(record_id, record.text) for record_id, record in added.items()])
+        logger.info("Applied %d added and %d removed records to %s", len(added), len(removed), self.file_path)
+        return DatasetSnapshot(records, signature, version, index, self.file_path, text_index, digests,
+                               previous.live_count + len(added) - len(removed))
+
+    def _swap(self, snapshot: DatasetSnapshot):
+        self._snapshot = snapshot
+        self.reload_count += 1
+        self._last_check = time.monotonic()
+
+    def reload(self) -> DatasetSnapshot:
+        """Re-parse the file right away and swap in the new snapshot."""
+        with self._lock:
+            snapshot = self._load()
+            self._swap(snapshot)
+        return snapshot
+
+    def _reload_in_background(self):
+        try:
+            self.reload()
+        except Exception:
+            # Keep serving the previous snapshot if the new file is unreadable
+            logger.exception("Failed to reload %s", self.file_path)
+
+    def check_for_changes(self) -> bool:
+        """Start a background reload if the file changed since the last load."""
+        self._last_check = time.monotonic()
+        snapshot = self._snapshot
+        try:
+            changed = snapshot is None or file_signature(self.file_path) != snapshot.signature
+        except OSError:
+            return False
+        if not changed:
+            return False
+
+        with self._lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return True
+            self._reload_thread = threading.Thread(
+                target=self._reload_in_background, name="question-store-reload", daemon=True
+            )
+            self._reload_thread.start()
+        return True
+
+    def current(self) -> Optional[DatasetSnapshot]:
+        """The loaded snapshot, if any, without loading or checking the file."""
+        return self._snapshot
+
+    def snapshot(self) -> DatasetSnapshot:
+        """Return the current snapshot, loading the file on first use."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._swap(self._load())
+                return self._snapshot
+        if time.monotonic() - self._last_check >= self.poll_interval:
+            self.check_for_changes()
+        return snapshot
+
+
+_stores: Dict[str, QuestionStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(file_path: str) -> QuestionStore:
+    """Return the shared store for ``file_path``, creating it on first use."""
+    key = os.path.abspath(file_path)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = QuestionStore(file_path)
+                _stores[key] = store
+    return store
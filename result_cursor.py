@@ -0,0 +1,99 @@
+from typing import Dict, Sequence
+
+_MASK64 = (1 << 64) - 1
+_ROUNDS = 4
+
+
+def _mix(value: int) -> int:
+    # splitmix64 finalizer: a cheap, well-distributed 64-bit hash
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class RandomPermutation:
+    """Seeded pseudo-random permutation of ``range(size)`` evaluated in O(1).
+
+    A small Feistel network is a bijection on the smallest power-of-four
+    domain covering ``size``; outputs that fall outside ``range(size)`` are
+    fed back through it ("cycle walking") until they land inside. The
+    domain is less than four times ``size``, so that takes a few rounds at
+    most on average, and no list of ``size`` elements is ever built.
+    """
+
+    def __init__(self, size: int, seed: int):
+        self.size = size
+        self.seed = seed
+        half_bits = 1
+        while 1 << (2 * half_bits) < size:
+            half_bits += 1
+        self._half_bits = half_bits
+        self._half_mask = (1 << half_bits) - 1
+        self._keys = [_mix(seed * _ROUNDS + round_index) for round_index in range(_ROUNDS)]
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self._half_bits, value & self._half_mask
+        for key in self._keys:
+            left, right = right, left ^ (_mix(right ^ key) & self._half_mask)
+        return (left << self._half_bits) | right
+
+    def __getitem__(self, position: int) -> int:
+        if not 0 <= position < self.size:
+            raise IndexError(position)
+        value = self._encrypt(position)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class ResultCursor:
+    """Walks a sequence of record IDs in order (e.g. ranked search results).
+
+    Only ``offset`` is needed to resume, so the cursor can be stored in a
+    session and rebuilt over the same result list on the next request.
+    """
+
+    def __init__(self, record_ids: Sequence[int], offset: int = 0):
+        self.record_ids = record_ids
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return len(self.record_ids)
+
+    def has_next(self) -> bool:
+        return self.offset < len(self.record_ids)
+
+    def _position(self, offset: int) -> int:
+        return offset
+
+    def next(self) -> int:
+        """Return the next record ID and advance the cursor."""
+        record_id = self.record_ids[self._position(self.offset)]
+        self.offset += 1
+        return record_id
+
+    def state(self) -> Dict:
+        return {"offset": self.offset}
+
+
+class ShuffledCursor(ResultCursor):
+    """Walks a sequence of record IDs in a seeded random order.
+
+    Only ``seed`` and ``offset`` are needed to resume, without shuffling or
+    copying the list.
+    """
+
+    def __init__(self, record_ids: Sequence[int], seed: int, offset: int = 0):
+        super().__init__(record_ids, offset)
+        self.seed = seed
+        self._permutation = RandomPermutation(len(record_ids), seed)
+
+    def _position(self, offset: int) -> int:
+        return self._permutation[offset]
+
+    def state(self) -> Dict:
+        return {"seed": self.seed, "offset": self.offset}
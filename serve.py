@@ -0,0 +1,302 @@
+"""Prefork server: load the question bank once, then fork the API workers.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The parent process imports the app, loads every dataset shard and builds
+the indexes and statistics, then moves all of it into the garbage
+collector's permanent generation (``gc.freeze``) so that collections in
+the workers never write to, and so never copy, those pages. Workers are
+forked from it and accept connections on one shared listening socket, so
+N workers cost about one copy of the data and start serving at once.
+
+The parent watches the dataset files (and reloads on SIGHUP or a POST to
+/api/reload on any worker). It loads the new version once, then replaces
+the workers one at a time: each new worker is ready before an old one is
+told to stop, and old workers finish their in-flight requests. Workers do
+not reload on their own. SIGTERM or SIGINT stops every worker gracefully.
+
+Conversations must be visible to every worker, so with more than one
+worker the session store defaults to SQLite (CHAT_SESSION_BACKEND=sqlite).
+Each worker reports its own /metrics, with a ``worker`` label holding its
+PID so that scrapes landing on different workers stay separate series.
+"""
+import argparse
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional
+
+from question_store import DEFAULT_POLL_INTERVAL, file_signature
+
+logger = logging.getLogger("serve")
+
+# Seconds a new worker may take to start serving, and an old one to finish its requests
+DEFAULT_READY_TIMEOUT = 30.0
+DEFAULT_GRACEFUL_TIMEOUT = 30.0
+# Environment variable through which workers find the parent, to ask it for a reload
+MASTER_PID_ENV = "CHAT_PREFORK_MASTER"
+
+
+class Worker:
+    def __init__(self, pid: int, ready_fd: int, generation: int):
+        self.pid = pid
+        self.ready_fd = ready_fd
+        self.generation = generation
+
+
+class Arbiter:
+    """The parent process: owns the socket and the loaded data, and keeps
+    ``workers`` forked children serving."""
+
+    def __init__(self, host: str, port: int, workers: int, reload_interval: float = DEFAULT_POLL_INTERVAL,
+                 ready_timeout: float = DEFAULT_READY_TIMEOUT,
+                 graceful_timeout: float = DEFAULT_GRACEFUL_TIMEOUT, log_level: str = "info"):
+        self.host = host
+        self.port = port
+        self.worker_count = workers
+        self.reload_interval = reload_interval
+        self.ready_timeout = ready_timeout
+        self.graceful_timeout = graceful_timeout
+        self.log_level = log_level
+        self.workers: Dict[int, Worker] = {}
+        self.generation = 0
+        self.socket: Optional[socket.socket] = None
+        self._stopping = False
+        self._reload_requested = False
+
+    # Parent side
+
+    def preload(self):
+        """Import the app and load every shard, its indexes, statistics and trends."""
+        import api
+        from chat_response import get_catalog, get_pattern_stats, get_trends
+
+        catalog = get_catalog(api.DATASET_PATH)
+        for store in catalog.stores():
+            # The parent decides when data changes; workers keep what they were forked with
+            store.poll_interval = float("inf")
+        for key, snapshot in catalog.preload().items():
+            get_pattern_stats(snapshot, catalog.subjects[key].stats_path)
+            get_trends(snapshot)
+        for store in catalog.stores():
+            # Built once here and shared, rather than once per worker on first search
+            store.current().text_index
+        self.app = api.app
+        self.catalog = catalog
+
+    def dataset_changed(self) -> bool:
+        for store in self.catalog.stores():
+            snapshot = store.current()
+            try:
+                if snapshot is None or file_signature(store.file_path) != snapshot.signature:
+                    return True
+            except OSError:
+                continue
+        return False
+
+    def reload_dataset(self, force: bool = False) -> bool:
+        """Load the changed shards (every shard with ``force``) in the parent;
+        False, keeping the old data, on failure."""
+        try:
+            for store in self.catalog.stores():
+                snapshot = store.current()
+                if force or snapshot is None or file_signature(store.file_path) != snapshot.signature:
+                    store.reload()
+            self.preload()
+        except Exception:
+            logger.exception("Reloading the dataset failed; workers keep the current version")
+            return False
+        # The previous version is garbage now, frozen or not
+        gc.unfreeze()
+        gc.collect()
+        return True
+
+    def bind(self) -> socket.socket:
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def spawn_worker(self) -> Worker:
+        ready_read, ready_write = os.pipe()
+        # Everything allocated so far is shared with the child; keep collections off it
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            code = 0
+            try:
+                self.run_worker(ready_write)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(ready_write)
+        worker = Worker(pid, ready_read, self.generation)
+        self.workers[pid] = worker
+        return worker
+
+    def wait_ready(self, worker: Worker) -> bool:
+        """Wait until the worker has started serving; False if it died or timed out."""
+        try:
+            readable, _, _ = select.select([worker.ready_fd], [], [], self.ready_timeout)
+            return bool(readable) and os.read(worker.ready_fd, 1) == b"1"
+        finally:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
+
+    def stop_worker(self, worker: Worker):
+        """Ask a worker to finish its requests and exit; kill it after the graceful timeout."""
+        self.workers.pop(worker.pid, None)
+        if worker.ready_fd >= 0:
+            os.close(worker.ready_fd)
+            worker.ready_fd = -1
+        try:
+            os.kill(worker.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + self.graceful_timeout
+        while time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid:
+                return
+            time.sleep(0.05)
+        logger.warning("Worker %d did not stop in time; killing it", worker.pid)
+        os.kill(worker.pid, signal.SIGKILL)
+        os.waitpid(worker.pid, 0)
+
+    def rolling_reload(self, force: bool = False):
+        if not self.reload_dataset(force):
+            return
+        self.generation += 1
+        logger.info("Dataset reloaded; replacing %d workers", len(self.workers))
+        for old in [worker for worker in self.workers.values() if worker.generation < self.generation]:
+            new = self.spawn_worker()
+            if not self.wait_ready(new):
+                logger.error("A new worker failed to start; keeping the remaining old workers")
+                self.stop_worker(new)
+                return
+            self.stop_worker(old)
+
+    def reap(self) -> List[int]:
+        """Collect exited workers; returns the PIDs of workers that exited unexpectedly."""
+        exited = []
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if not pid:
+                break
+            if self.workers.pop(pid, None) is not None:
+                exited.append(pid)
+        return exited
+
+    def run(self):
+        # Objects freed in the parent leave holes in shared pages; collect
+        # only right before forking
+        gc.disable()
+        self.preload()
+        self.socket = self.bind()
+        os.environ[MASTER_PID_ENV] = str(os.getpid())
+
+        signal.signal(signal.SIGHUP, self._request_reload)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        for _ in range(self.worker_count):
+            self.wait_ready(self.spawn_worker())
+        logger.info("Serving on %s:%d with %d workers", self.host, self.port, len(self.workers))
+
+        next_check = time.monotonic() + self.reload_interval
+        while not self._stopping:
+            for pid in self.reap():
+                logger.warning("Worker %d exited unexpectedly; starting a new one", pid)
+            while len(self.workers) < self.worker_count and not self._stopping:
+                if not self.wait_ready(self.spawn_worker()):
+                    # Don't fork in a tight loop when workers can't start
+                    time.sleep(1.0)
+                    self.reap()
+            check_due = self.reload_interval > 0 and time.monotonic() >= next_check
+            if check_due:
+                next_check = time.monotonic() + self.reload_interval
+            if self._reload_requested:
+                self._reload_requested = False
+                self.rolling_reload(force=True)
+            elif check_due and self.dataset_changed():
+                self.rolling_reload()
+            time.sleep(0.2)
+
+        logger.info("Stopping %d workers", len(self.workers))
+        for worker in list(self.workers.values()):
+            self.stop_worker(worker)
+
+    def _request_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def _request_stop(self, signum, frame):
+        self._stopping = True
+
+    # Child side
+
+    def run_worker(self, ready_fd: int):
+        import uvicorn
+        from metrics import REGISTRY
+
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        gc.enable()
+        REGISTRY.set_constant_labels(worker=str(os.getpid()))
+
+        def notify_ready():
+            os.write(ready_fd, b"1")
+            os.close(ready_fd)
+
+        # Runs after the app's own startup handlers, which find the data already loaded
+        self.app.router.on_startup.append(notify_ready)
+        config = uvicorn.Config(self.app, log_level=self.log_level)
+        uvicorn.Server(config).run(sockets=[self.socket])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("CHAT_SERVE_WORKERS", os.cpu_count() or 1)),
+                        help="worker processes (default: CHAT_SERVE_WORKERS or the number of CPUs)")
+    parser.add_argument("--reload-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="seconds between checks of the dataset files (0 reloads only on SIGHUP)")
+    parser.add_argument("--graceful-timeout", type=float, default=DEFAULT_GRACEFUL_TIMEOUT,
+                        help="seconds a stopping worker may take to finish its requests")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        parser.error("Prefork mode needs os.fork; run uvicorn api:app on this platform")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s [serve %(process)d] %(message)s")
+    if args.workers > 1 and "CHAT_SESSION_BACKEND" not in os.environ:
+        # In-memory sessions would be split across workers
+        os.environ["CHAT_SESSION_BACKEND"] = "sqlite"
+
+    Arbiter(args.host, args.port, args.workers, args.reload_interval,
+            graceful_timeout=args.graceful_timeout, log_level=args.log_level).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
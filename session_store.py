@@ -0,0 +1,171 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DEFAULT_TTL = 30 * 60  # seconds of inactivity before a conversation is forgotten
+DEFAULT_MAX_SESSIONS = 10000
+
+
+class SessionStore:
+    """Keyed storage for per-conversation state.
+
+    State is a JSON-serializable dict; backends only need to implement
+    ``get``, ``set`` and ``delete``.
+    """
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def set(self, session_id: str, state: Dict):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store with TTL expiry and an LRU cap on the number of sessions."""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict_expired(self, now: float):
+        # Entries are kept in last-access order, so expired ones sit at the front
+        while self._sessions:
+            session_id, (touched, _) = next(iter(self._sessions.items()))
+            if now - touched < self.ttl:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def set(self, session_id: str, state: Dict):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[session_id] = (now, state)
+            self._sessions.move_to_end(session_id)
+            self._evict_expired(now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store backed by a SQLite file, shared by every worker process on the host."""
+
+    # Trim expired and least-recently-used sessions once every this many writes
+    PRUNE_EVERY = 100
+
+    def __init__(self, path: str, ttl: float = DEFAULT_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS):
+        self.path = path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._local = threading.local()
+        self._writes = 0
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, state TEXT NOT NULL, touched REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        now = time.time()
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT state, touched FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] >= self.ttl:
+            self.delete(session_id)
+            return None
+        connection.execute("UPDATE sessions SET touched = ? WHERE id = ?", (now, session_id))
+        return json.loads(row[0])
+
+    def set(self, session_id: str, state: Dict):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO sessions (id, state, touched) VALUES (?, ?, ?)",
+            (session_id, json.dumps(state), time.time()),
+        )
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, session_id: str):
+        self._connection().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def prune(self):
+        """Drop expired sessions, then the least recently used ones over the cap."""
+        connection = self._connection()
+        connection.execute("DELETE FROM sessions WHERE touched < ?", (time.time() - self.ttl,))
+        connection.execute(
+            "DELETE FROM sessions WHERE id IN ("
+            "SELECT id FROM sessions ORDER BY touched DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        )
+
+
+def create_session_store() -> SessionStore:
+    """Build the session store selected by the CHAT_SESSION_* environment variables."""
+    backend = os.environ.get("CHAT_SESSION_BACKEND", "memory")
+    ttl = float(os.environ.get("CHAT_SESSION_TTL", DEFAULT_TTL))
+    max_sessions = int(os.environ.get("CHAT_SESSION_MAX", DEFAULT_MAX_SESSIONS))
+    if backend == "memory":
+        return MemorySessionStore(ttl, max_sessions)
+    if backend == "sqlite":
+        path = os.environ.get("CHAT_SESSION_DB", "sessions.sqlite3")
+        return SQLiteSessionStore(path, ttl, max_sessions)
+    raise ValueError(f"Unknown session backend: {backend}")
+
+
+_session_store: Optional[SessionStore] = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStore:
+    """Return the process-wide session store, creating it on first use."""
+    global _session_store
+    if _session_store is None:
+        with _session_store_lock:
+            if _session_store is None:
+                _session_store = create_session_store()
+    return _session_store
+
+
+def set_session_store(store: SessionStore):
+    """Replace the process-wide session store (e.g. with a shared backend)."""
+    global _session_store
+    _session_store = store
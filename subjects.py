@@ -0,0 +1,349 @@
+"""Multi-subject question banks, split into shards.
+
+A catalog lists the subjects one deployment serves. Each subject has its
+own chapter vocabulary (and so its own QueryParser) and one or more shard
+files. Each shard is loaded by its own QuestionStore, with its own facet
+and text indexes, so a large bank can be split, for example one shard
+per exam year, and each shard reloads on its own:
+
+    python subjects.py split questions.jsonl shards/ --prefix digital-logic
+
+Messages go to the subject whose chapters or name they mention. Messages
+that name no subject, such as "any 10-mark question from 2022", are
+answered from every subject. A query that spans several shards runs on
+each of them on a small thread pool, and the results are merged.
+
+The catalog is read from the JSON file named by CHAT_SUBJECTS_PATH:
+
+    {"subjects": [{"key": "digital-logic", "name": "Digital Logic",
+                   "chapters": ["Binary System", ...], "aliases": {"binary": "Binary System"},
+                   "shards": ["shards/digital-logic_2021.jsonl", ...],
+                   "stats": "digital-logic_stats.json"}]}
+"""
+import argparse
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from query_parser import AhoCorasick, ParsedQuery, QueryParser
+from question_store import DatasetSnapshot, QuestionStore, get_store
+
+# Threads used to query shards in parallel
+FANOUT_WORKERS = int(os.environ.get("CHAT_FANOUT_WORKERS", 4))
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _forget_pool():
+    # A forked child has none of the parent's threads; it starts its own pool
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pool)
+
+
+def fan_out(func: Callable, items: Sequence) -> List:
+    """``[func(item) for item in items]``, run in parallel when there is more than one item."""
+    global _pool
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="shard-fanout")
+    return list(_pool.map(func, items))
+
+
+class ShardedRecords:
+    """Read-only sequence over the records of several snapshots, numbered consecutively."""
+
+    def __init__(self, shards: Sequence[DatasetSnapshot], offsets: Sequence[int]):
+        self._records = [shard.records for shard in shards]
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return self._offsets[-1]
+
+    def __getitem__(self, record_id: int):
+        if record_id < 0:
+            record_id += len(self)
+        shard = bisect_right(self._offsets, record_id) - 1
+        if shard < 0 or shard >= len(self._records):
+            raise IndexError(record_id)
+        return self._records[shard][record_id - self._offsets[shard]]
+
+    def __iter__(self) -> Iterator:
+        return chain.from_iterable(self._records)
+
+
+class ShardedIndex:
+    """Facet lookups over several shards, with shard-local IDs mapped to global ones."""
+
+    def __init__(self, shards: Sequence[DatasetSnapshot], offsets: Sequence[int]):
+        self._shards = shards
+        self._offsets = offsets
+        self.size = offsets[-1]
+
+    def values(self, facet: str) -> List[object]:
+        return list(dict.fromkeys(chain.from_iterable(shard.index.values(facet) for shard in self._shards)))
+
+    def lookup(self, **filters) -> Sequence[int]:
+        results = fan_out(lambda shard: shard.index.lookup(**filters), self._shards)
+        merged = array('I')
+        for offset, ids in zip(self._offsets, results):
+            if offset:
+                merged.extend(record_id + offset for record_id in ids)
+            else:
+                merged.extend(ids)
+        return merged
+
+
+class ShardedTextIndex:
+    """BM25 search over several shards.
+
+    Each shard scores with its own term statistics, which is close to
+    global BM25 when shards are large and alike.
+    """
+
+    def __init__(self, shards: Sequence[DatasetSnapshot], offsets: Sequence[int]):
+        self._shards = shards
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return sum(len(shard.text_index) for shard in self._shards)
+
+    def __contains__(self, term: str) -> bool:
+        return any(term in shard.text_index for shard in self._shards)
+
+    def known_terms(self, terms: Iterable[str]) -> List[str]:
+        return [term for term in dict.fromkeys(terms) if term in self]
+
+    def _shard_allowed(self, shard: int, allowed: Sequence[int]) -> array:
+        start, end = self._offsets[shard], self._offsets[shard + 1]
+        return array('I', (record_id - start for record_id in
+                           allowed[bisect_left(allowed, start):bisect_left(allowed, end)]))
+
+    def search(self, terms: Sequence[str], allowed: Optional[Sequence[int]] = None,
+               limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        def search_shard(shard: int):
+            local_allowed = self._shard_allowed(shard, allowed) if allowed is not None else None
+            if local_allowed is not None and not local_allowed:
+                return []
+            return self._shards[shard].text_index.search(terms, local_allowed, limit)
+
+        # The best ``limit`` overall are among the best ``limit`` of each shard
+        results = fan_out(search_shard, range(len(self._shards)))
+        merged = [(record_id + offset, score)
+                  for offset, shard_results in zip(self._offsets, results)
+                  for record_id, score in shard_results]
+        return sorted(merged, key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class ShardedSnapshot:
+    """Several shard snapshots presented as one DatasetSnapshot.
+
+    Record IDs run through the shards in order. The version is the sum of
+    the shard versions, so it goes up whenever any shard reloads.
+    """
+
+    def __init__(self, shards: Sequence[DatasetSnapshot], path: str):
+        self.shards = list(shards)
+        offsets = [0]
+        for shard in self.shards:
+            offsets.append(offsets[-1] + len(shard))
+        self.records = ShardedRecords(self.shards, offsets)
+        self.index = ShardedIndex(self.shards, offsets)
+        self.text_index = ShardedTextIndex(self.shards, offsets)
+        self.signature = tuple(shard.signature for shard in self.shards)
+        self.version = sum(shard.version for shard in self.shards)
+        self.live_count = sum(shard.live_count for shard in self.shards)
+        self.path = path
+        self.loaded_at = max(shard.loaded_at for shard in self.shards)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+
+class Subject:
+    """One course: its vocabulary, query parser and shard files."""
+
+    def __init__(self, key: str, name: str, chapters: Iterable[str], aliases: Dict[str, str],
+                 shards: Sequence[str], difficulties: Iterable[str], frequencies: Iterable[str],
+                 frequency_synonyms: Dict[str, str], stats_path: Optional[str] = None,
+                 parser: Optional[QueryParser] = None):
+        if not shards:
+            raise ValueError(f"Subject '{key}' has no shards")
+        self.key = key
+        self.name = name
+        self.chapters = list(chapters)
+        self.aliases = dict(aliases)
+        self.difficulties = list(difficulties)
+        self.frequencies = list(frequencies)
+        self.frequency_synonyms = dict(frequency_synonyms)
+        self.shards = list(shards)
+        self.stats_path = stats_path
+        self.parser = parser if parser is not None else QueryParser(
+            self.chapters, self.aliases, self.difficulties, self.frequencies, self.frequency_synonyms)
+
+    @property
+    def stores(self) -> List[QuestionStore]:
+        return [get_store(path) for path in self.shards]
+
+
+class Catalog:
+    """The subjects served by one deployment, and routing between them."""
+
+    def __init__(self, subjects: Sequence[Subject], parser: Optional[QueryParser] = None):
+        if not subjects:
+            raise ValueError("A catalog needs at least one subject")
+        self.subjects: Dict[str, Subject] = {}
+        for subject in subjects:
+            if subject.key in self.subjects:
+                raise ValueError(f"Duplicate subject '{subject.key}'")
+            self.subjects[subject.key] = subject
+
+        # Vocabulary of every subject, for messages not tied to one; on
+        # conflicting aliases the first subject wins
+        self.chapters = list(dict.fromkeys(chain.from_iterable(subject.chapters for subject in subjects)))
+        self.aliases: Dict[str, str] = {}
+        self._chapter_subjects: Dict[str, Subject] = {}
+        for subject in subjects:
+            for alias, chapter in subject.aliases.items():
+                self.aliases.setdefault(alias, chapter)
+            for chapter in subject.chapters:
+                self._chapter_subjects.setdefault(chapter, subject)
+        if parser is None:
+            first = subjects[0]
+            parser = subjects[0].parser if len(subjects) == 1 else QueryParser(
+                self.chapters, self.aliases, first.difficulties, first.frequencies, first.frequency_synonyms)
+        self.parser = parser
+        self._names = AhoCorasick((name.lower(), subject) for subject in subjects
+                                  for name in (subject.name, subject.key))
+        self._snapshots: Dict[Optional[str], ShardedSnapshot] = {}
+
+    def subject(self, key: Optional[str]) -> Optional[Subject]:
+        """The subject with ``key``; None for no key or a key no longer configured."""
+        return self.subjects.get(key) if key else None
+
+    def route(self, query: ParsedQuery) -> Optional[Subject]:
+        """The subject a message is about, or None when it could be any of them."""
+        if len(self.subjects) == 1:
+            return next(iter(self.subjects.values()))
+        if query.chapter:
+            return self._chapter_subjects.get(query.chapter)
+        matches = self._names.find_all(query.lowered)
+        return min(matches, key=lambda match: match[0])[1] if matches else None
+
+    def stores(self, subject: Optional[Subject] = None) -> List[QuestionStore]:
+        if subject is not None:
+            return subject.stores
+        return list({id(store): store for store in chain.from_iterable(
+            subject.stores for subject in self.subjects.values())}.values())
+
+    def _combine(self, key: Optional[str], shards: List[DatasetSnapshot]):
+        if len(shards) == 1:
+            return shards[0]
+        # Reuse the combined snapshot until one of its shards is swapped out
+        cached = self._snapshots.get(key)
+        if cached is not None and len(cached.shards) == len(shards) and \
+                all(old is new for old, new in zip(cached.shards, shards)):
+            return cached
+        combined = ShardedSnapshot(shards, path=f"subject:{key or '*'}")
+        self._snapshots[key] = combined
+        return combined
+
+    def snapshot(self, subject: Optional[Subject] = None):
+        """The current snapshot of a subject, or of every subject when ``subject`` is None."""
+        shards = fan_out(lambda store: store.snapshot(), self.stores(subject))
+        return self._combine(subject.key if subject else None, shards)
+
+    def preload(self) -> Dict[str, object]:
+        """Load every shard on the calling thread, without the fan-out pool (as
+        a process about to fork must), and return each subject's snapshot."""
+        return {key: self._combine(key, [store.snapshot() for store in subject.stores])
+                for key, subject in self.subjects.items()}
+
+    def reload(self, subject: Optional[Subject] = None):
+        """Re-read every shard right away, in parallel."""
+        shards = fan_out(lambda store: store.reload(), self.stores(subject))
+        return self._combine(subject.key if subject else None, shards)
+
+
+def load_catalog(path: str, difficulties: Iterable[str], frequencies: Iterable[str],
+                 frequency_synonyms: Dict[str, str]) -> Catalog:
+    """Read a catalog file; subjects may override the difficulty and frequency vocabularies."""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    subjects = []
+    for entry in config["subjects"]:
+        shards = entry.get("shards") or [entry["dataset"]]
+        stats_path = entry.get("stats")
+        subjects.append(Subject(
+            key=entry["key"],
+            name=entry.get("name", entry["key"]),
+            chapters=entry["chapters"],
+            aliases=entry.get("aliases", {}),
+            shards=[os.path.join(base, shard) for shard in shards],
+            difficulties=entry.get("difficulties", difficulties),
+            frequencies=entry.get("frequencies", frequencies),
+            frequency_synonyms=entry.get("frequency_synonyms", frequency_synonyms),
+            stats_path=os.path.join(base, stats_path) if stats_path else None,
+        ))
+    return Catalog(subjects)
+
+
+def split_by_year(input_path: str, output_dir: str, prefix: Optional[str] = None) -> Dict[str, int]:
+    """Write one shard per exam year (the first year of each record) and return their sizes."""
+    from dedup import record_years
+    from question_record import split_years
+
+    prefix = prefix or os.path.splitext(os.path.basename(input_path))[0]
+    os.makedirs(output_dir, exist_ok=True)
+    files = {}
+    counts: Dict[str, int] = {}
+    try:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                years = split_years(record_years(json.loads(line)))
+                year = years[0] if years else "unknown"
+                out = files.get(year)
+                if out is None:
+                    out = files[year] = open(os.path.join(output_dir, f"{prefix}_{year}.jsonl"), 'w',
+                                             encoding='utf-8')
+                out.write(line if line.endswith("\n") else line + "\n")
+                counts[year] = counts.get(year, 0) + 1
+    finally:
+        for out in files.values():
+            out.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    split = commands.add_parser("split", help="split a question bank into per-year shards")
+    split.add_argument("input", help="question bank JSONL file")
+    split.add_argument("output_dir", help="directory for the shard files")
+    split.add_argument("--prefix", default=None, help="shard file name prefix (default: input name)")
+    args = parser.parse_args()
+
+    counts = split_by_year(args.input, args.output_dir, args.prefix)
+    prefix = args.prefix or os.path.splitext(os.path.basename(args.input))[0]
+    for year in sorted(counts):
+        print(f"{os.path.join(args.output_dir, f'{prefix}_{year}.jsonl')}: {counts[year]} records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import math
+import re
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+
+def _stem(token: str) -> str:
+    # Light plural folding so "codes" finds "code" and "cares" finds "care"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+# Words that carry no topic in a chat request ("give me a question about ..."),
+# folded the same way as index terms
+STOPWORDS = frozenset(_stem(word) for word in """
+a about all also am an and any anything are as ask at be by can could define describe
+discuss do does explain for from get give good has have here i in is it its like list
+me mark marks more my need new next of on one or other please practice question
+questions related show some something that the their them there these thing this to
+topic try want what which will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into index terms.
+
+    Hyphenated words are indexed both whole (``k-map`` -> ``kmap``) and by
+    part, so "K-map", "kmap" and "k map" all find each other.
+    """
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if "-" in token:
+            parts = token.split("-")
+            terms.append(_stem("".join(parts)))
+            terms.extend(_stem(part) for part in parts if len(part) > 1)
+        elif len(token) > 1:
+            terms.append(_stem(token))
+    return terms
+
+
+class TextIndex:
+    """BM25-ranked inverted index over question text.
+
+    Each term maps to parallel arrays of record IDs (ascending) and term
+    frequencies, and to its document frequency. Records can be added and
+    removed after the build: new records are appended, and removed ones
+    are tombstoned, with the document frequencies and length statistics
+    adjusted right away.
+
+    Searches score a whole posting list at once with NumPy. The BM25
+    length norm of every record is computed on the first search, and so
+    is each searched term's per-posting weight (everything in its score
+    but the idf); both are kept until the index changes. Removed records
+    get an infinite norm, so they score 0.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._frequencies: Dict[str, int] = {}
+        self._lengths = array('I')
+        self._removed: Set[int] = set()
+        self.count = 0
+        self.total_length = 0
+        # Terms whose posting arrays this index may append to, when they
+        # are shared with the index it was copied from (None: all of them)
+        self._owned: Optional[Set[str]] = None
+        self._norms: Optional[np.ndarray] = None
+        self._weights: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def build(cls, records: Iterable) -> "TextIndex":
+        """Index the text of Question records (or plain dicts) in ID order;
+        None entries (removed records) are left out."""
+        index = cls()
+        for record_id, record in enumerate(records):
+            if record is None:
+                continue
+            if isinstance(record, dict):
+                text = record.get("output") or record.get("question") or ""
+            else:
+                text = record.text
+            index.add(record_id, text)
+        return index
+
+    def with_changes(self, removed: Iterable[Tuple[int, str]], added: Iterable[Tuple[int, str]]) -> "TextIndex":
+        """A copy with the ``removed`` and ``added`` (ID, text) pairs applied,
+        leaving this index unchanged.
+
+        Posting arrays are shared until the copy appends to them, so the
+        cost is proportional to the change rather than the corpus.
+        """
+        index = TextIndex()
+        index._postings = dict(self._postings)
+        index._frequencies = dict(self._frequencies)
+        index._lengths = array('I', self._lengths)
+        index._removed = set(self._removed)
+        index.count = self.count
+        index.total_length = self.total_length
+        index._owned = set()
+        for record_id, text in removed:
+            index.remove(record_id, text)
+        for record_id, text in added:
+            index.add(record_id, text)
+        return index
+
+    def add(self, record_id: int, text: str):
+        """Index ``text`` as record ``record_id``, which must be past every existing ID."""
+        if record_id < len(self._lengths):
+            raise ValueError(f"Record {record_id} is already indexed")
+        terms = tokenize(text)
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            posting = self._postings.get(term)
+            if posting is None:
+                posting = self._postings[term] = (array('I'), array('H'))
+                if self._owned is not None:
+                    self._owned.add(term)
+            elif self._owned is not None and term not in self._owned:
+                posting = self._postings[term] = (array('I', posting[0]), array('H', posting[1]))
+                self._owned.add(term)
+            posting[0].append(record_id)
+            posting[1].append(min(frequency, 0xFFFF))
+            self._frequencies[term] = self._frequencies.get(term, 0) + 1
+        # IDs skipped over count as empty, removed records
+        while len(self._lengths) < record_id:
+            self._removed.add(len(self._lengths))
+            self._lengths.append(0)
+        self._lengths.append(len(terms))
+        self.count += 1
+        self.total_length += len(terms)
+        self._norms = None
+        self._weights = {}
+
+    def remove(self, record_id: int, text: str):
+        """Drop a record, indexed with ``text``, from future results."""
+        if record_id >= len(self._lengths) or record_id in self._removed:
+            return
+        self._removed.add(record_id)
+        for term in set(tokenize(text)):
+            if term in self._frequencies:
+                self._frequencies[term] -= 1
+        self.count -= 1
+        self.total_length -= self._lengths[record_id]
+        self._norms = None
+        self._weights = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, term: str) -> bool:
+        return self._frequencies.get(term, 0) > 0
+
+    def known_terms(self, terms: Iterable[str]) -> List[str]:
+        """The distinct ``terms`` that occur in at least one record, in order."""
+        return [term for term in dict.fromkeys(terms) if term in self]
+
+    def _length_norms(self) -> np.ndarray:
+        norms = self._norms
+        if norms is None:
+            average_length = self.total_length / self.count or 1.0
+            lengths = np.array(self._lengths, dtype=np.float64)
+            norms = K1 * (1 - B + B * lengths / average_length)
+            if self._removed:
+                norms[np.fromiter(self._removed, dtype=np.int64, count=len(self._removed))] = np.inf
+            self._norms = norms
+        return norms
+
+    def _term_weights(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Record IDs containing ``term`` and their BM25 weight before the idf."""
+        weights = self._weights.get(term)
+        if weights is None:
+            norms = self._length_norms()
+            ids, frequencies = self._postings[term]
+            ids = np.array(ids, dtype=np.intp)
+            frequencies = np.array(frequencies, dtype=np.float64)
+            weights = self._weights[term] = (ids, frequencies * (K1 + 1) / (frequencies + norms[ids]))
+        return weights
+
+    def search(self, terms: Sequence[str], allowed: Optional[Sequence[int]] = None,
+               limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Score records containing any of ``terms``.
+
+        ``allowed`` optionally restricts the results to a sorted sequence of
+        record IDs (e.g. a facet-index lookup); postings outside it add
+        nothing to any score. Returns up to ``limit`` (record ID, score) pairs, best
+        first, with ties broken by record ID so the order is stable.
+        """
+        if not self.count:
+            return []
+        size = len(self._lengths)
+        mask = None
+        if allowed is not None:
+            mask = np.zeros(size, dtype=bool)
+            allowed_ids = np.asarray(allowed)
+            mask[allowed_ids[allowed_ids < size]] = True
+        scores = np.zeros(size)
+        for term in dict.fromkeys(terms):
+            document_frequency = self._frequencies.get(term, 0)
+            if document_frequency <= 0:
+                continue
+            idf = math.log(1 + (self.count - document_frequency + 0.5) / (document_frequency + 0.5))
+            ids, weights = self._term_weights(term)
+            if mask is not None:
+                # Zeroing is cheaper than compacting the arrays
+                weights = weights * mask[ids]
+            np.add.at(scores, ids, idf * weights)
+
+        matched = np.flatnonzero(scores > 0)
+        if limit is not None and len(matched) > limit:
+            # Everything scoring at least the limit-th best score, ties included
+            threshold = np.partition(scores[matched], len(matched) - limit)[len(matched) - limit]
+            matched = matched[scores[matched] >= threshold]
+        # Best first; lexsort is stable, so ties stay in ID order
+        matched = matched[np.lexsort((matched, -scores[matched]))][:limit]
+        return [(int(record_id), float(scores[record_id])) for record_id in matched]
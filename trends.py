@@ -0,0 +1,270 @@
+"""Exam trend statistics over a question bank, as NumPy tensors.
+
+Every question is counted in a chapter x year x question type x marks
+tensor, built from the facet index's posting lists without touching the
+records (a question asked in several years counts in each). Everything
+else is a vectorized reduction of that tensor:
+
+- each chapter's share of the questions per exam year, and its slope
+  (least squares, in share per year);
+- recency-weighted likelihoods, with each year weighing half as much as
+  one ``HALF_LIFE_YEARS`` later: the chance that a chapter appears in the
+  next exam, the questions it gets, and the question types and marks it
+  is asked with;
+- co-occurrence: how often (recency-weighted) a chapter was in the same
+  exam as another, and the lift over that chapter's own likelihood, so
+  chapters that appear in every exam are not related to everything.
+
+The API answers "predict" messages from this, and the ``update-prompts``
+stage of pipeline.py writes it into each conversation's pattern analysis:
+
+    python trends.py questions.jsonl --chapter "Sequential Logic"
+"""
+import argparse
+import hashlib
+import json
+import re
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from facet_index import FacetIndex
+from question_record import parse_years
+
+# Years after which a past exam counts half as much towards a prediction
+HALF_LIFE_YEARS = 3.0
+# Questions types, marks and related chapters listed per forecast
+TOP_ENTRIES = 3
+# Slopes smaller than this (in share of the questions per year) count as steady
+STEADY_SLOPE = 0.005
+# Chapters are related when they share exams this much more often than by chance
+MIN_LIFT = 1.05
+
+_CHAPTER_LINE = re.compile(r"^Chapter:\s*(.+?)\s*$", re.MULTILINE)
+
+
+def record_chapter(record: Dict) -> Optional[str]:
+    """The chapter of a question or instruction record, or of a conversation
+    whose assistant message has a 'Chapter:' line (as convert_format.py writes)."""
+    chapter = record.get("metadata", {}).get("chapter")
+    if chapter:
+        return str(chapter).strip()
+    for message in reversed(record.get("messages", ())):
+        match = _CHAPTER_LINE.search(message.get("content", ""))
+        if match:
+            return match.group(1)
+    return None
+
+
+def _axis(index, facet: str, size: int):
+    """Position of each record's value on the facet's axis (-1 without one), and the axis labels."""
+    labels = sorted(index.values(facet), key=lambda value: (isinstance(value, str), value))
+    codes = np.full(size, -1, dtype=np.int32)
+    for position, value in enumerate(labels):
+        ids = np.asarray(index.lookup(**{facet: value}), dtype=np.int64)
+        codes[ids] = position
+    return codes, labels
+
+
+class TrendModel:
+    """Counts and derived trends of one question bank (see the module docstring).
+
+    ``counts[c, y, t, m]`` is the number of questions from ``chapters[c]``
+    asked in ``years[y]`` with ``question_types[t]`` and ``marks[m]``;
+    questions without a type or numeric marks are counted under None.
+    """
+
+    def __init__(self, chapters: List[str], years: List[int], question_types: List[Optional[str]],
+                 marks: List[Optional[int]], counts: np.ndarray, half_life: float = HALF_LIFE_YEARS):
+        self.chapters = chapters
+        self.years = years
+        self.question_types = question_types
+        self.marks = marks
+        self.counts = counts
+        self.half_life = half_life
+        self._positions = {chapter.lower(): position for position, chapter in enumerate(chapters)}
+        self._derive()
+
+    @classmethod
+    def from_index(cls, index, half_life: float = HALF_LIFE_YEARS) -> "TrendModel":
+        """Build the tensor from a FacetIndex (or a sharded one) in one pass over its postings."""
+        size = index.size
+        chapter_codes, chapters = _axis(index, "chapter", size)
+        axes = []
+        for facet in ("question_type", "marks"):
+            codes, labels = _axis(index, facet, size)
+            missing = (codes < 0) & (chapter_codes >= 0)
+            if missing.any():
+                codes[missing] = len(labels)
+                labels.append(None)
+            axes.append((codes, labels))
+        (type_codes, question_types), (marks_codes, marks) = axes
+
+        # (record, year) pairs: merged labels ('2017, 2019') list a record under each year
+        year_ids: Dict[int, List[np.ndarray]] = {}
+        for value in index.values("previous_years"):
+            for year in parse_years(value):
+                year_ids.setdefault(year, []).append(
+                    np.asarray(index.lookup(previous_years=value), dtype=np.int64))
+        years = sorted(year_ids)
+        pair_ids = [np.concatenate(year_ids[year]) for year in years]
+        records = np.concatenate(pair_ids) if pair_ids else np.zeros(0, dtype=np.int64)
+        year_codes = np.repeat(np.arange(len(years)), [len(ids) for ids in pair_ids])
+
+        shape = (len(chapters), len(years), len(question_types), len(marks))
+        keep = chapter_codes[records] >= 0
+        records, year_codes = records[keep], year_codes[keep]
+        flat = np.ravel_multi_index((chapter_codes[records], year_codes, type_codes[records],
+                                     marks_codes[records]), shape) if records.size else records
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).reshape(shape)
+        return cls(chapters, years, question_types, marks, counts, half_life)
+
+    @classmethod
+    def from_records(cls, records: Iterable, half_life: float = HALF_LIFE_YEARS) -> "TrendModel":
+        """Build from Question records or dicts with a ``metadata`` field; others are skipped."""
+        return cls.from_index(FacetIndex.build(record for record in records if record is not None),
+                              half_life)
+
+    def _derive(self):
+        counts = self.counts.astype(np.float64)
+        self.chapter_year = counts.sum(axis=(2, 3))
+        year_totals = self.chapter_year.sum(axis=0)
+        self.share = np.divide(self.chapter_year, year_totals, out=np.zeros_like(self.chapter_year),
+                               where=year_totals > 0)
+
+        years = np.asarray(self.years, dtype=np.float64)
+        centered = years - years.mean() if years.size else years
+        spread = float(centered @ centered)
+        self.slope = self.share @ centered / spread if spread else np.zeros(len(self.chapters))
+
+        latest = years.max() if years.size else 0.0
+        weights = 0.5 ** ((latest - years) / self.half_life)
+        weights = weights / weights.sum() if weights.size else weights
+        appeared = (self.chapter_year > 0).astype(np.float64)
+        self.likelihood = appeared @ weights
+        self.expected_questions = self.chapter_year @ weights
+        self.type_share = self._normalize(np.einsum("cytm,y->ct", counts, weights))
+        self.marks_share = self._normalize(np.einsum("cytm,y->cm", counts, weights))
+
+        # Weighted number of exams each pair of chapters shared, over each chapter's own
+        together = (appeared * weights) @ appeared.T
+        own = np.diag(together).copy()
+        self.cooccurrence = np.divide(together, own[:, None], out=np.zeros_like(together),
+                                      where=own[:, None] > 0)
+        np.fill_diagonal(self.cooccurrence, 0.0)
+        self.lift = np.divide(self.cooccurrence, self.likelihood[None, :], out=np.zeros_like(together),
+                              where=self.likelihood[None, :] > 0)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        totals = matrix.sum(axis=1, keepdims=True)
+        return np.divide(matrix, totals, out=np.zeros_like(matrix), where=totals > 0)
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def position(self, chapter: Optional[str]) -> Optional[int]:
+        return self._positions.get(chapter.strip().lower()) if chapter else None
+
+    def _top(self, row: np.ndarray, labels: Sequence) -> List:
+        order = np.argsort(-row, kind="stable")[:TOP_ENTRIES]
+        return [(labels[i], float(row[i])) for i in order if row[i] > 0 and labels[i] is not None]
+
+    def forecast(self, chapter: str) -> Optional[Dict]:
+        """Summary of a chapter's trends, or None if it has never been asked."""
+        position = self.position(chapter)
+        if position is None or not self.chapter_year[position].any():
+            return None
+        appeared = np.flatnonzero(self.chapter_year[position])
+        related = self._top(np.where(self.lift[position] >= MIN_LIFT, self.cooccurrence[position], 0.0),
+                            self.chapters)
+        return {
+            "chapter": self.chapters[position],
+            "questions": int(self.chapter_year[position].sum()),
+            "exams": len(self.years),
+            "exams_with_chapter": int(appeared.size),
+            "first_year": self.years[appeared[0]],
+            "last_year": self.years[appeared[-1]],
+            "likelihood": float(self.likelihood[position]),
+            "expected_questions": float(self.expected_questions[position]),
+            "slope": float(self.slope[position]),
+            "question_types": self._top(self.type_share[position], self.question_types),
+            "marks": self._top(self.marks_share[position], self.marks),
+            "related_chapters": related,
+            "half_life": self.half_life,
+        }
+
+    def ranking(self) -> List[Dict]:
+        """Forecasts of every chapter asked so far, most likely first."""
+        order = np.lexsort((-self.expected_questions, -self.likelihood))
+        forecasts = (self.forecast(self.chapters[position]) for position in order)
+        return [forecast for forecast in forecasts if forecast is not None]
+
+    def digest(self, chapter: Optional[str]) -> str:
+        """Changes whenever the chapter's forecast does; for incremental builds."""
+        forecast = self.forecast(chapter) if chapter else None
+        data = json.dumps(forecast, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+    def analysis_for(self, record: Dict) -> Optional[str]:
+        """The pattern analysis appended to a conversation by the update-prompts stage."""
+        forecast = self.forecast(record_chapter(record) or "")
+        return format_analysis(forecast) if forecast is not None else None
+
+
+def describe_slope(slope: float) -> str:
+    if abs(slope) < STEADY_SLOPE:
+        return "steady"
+    direction = "rising" if slope > 0 else "falling"
+    return f"{direction} by about {abs(slope) * 100:.1f} percentage points a year"
+
+
+def format_analysis(forecast: Dict) -> str:
+    """The 'Pattern Analysis' section written into training conversations."""
+    span = str(forecast["first_year"])
+    if forecast["last_year"] != forecast["first_year"]:
+        span += f"-{forecast['last_year']}"
+    points = [
+        f"Likelihood: {forecast['chapter']} appeared in {forecast['exams_with_chapter']} of "
+        f"{forecast['exams']} past exams ({span}). Weighted towards recent exams, it has a "
+        f"{forecast['likelihood']:.0%} chance of appearing in the next one, with about "
+        f"{forecast['expected_questions']:.1f} questions.",
+        f"Trend: its share of the questions is {describe_slope(forecast['slope'])}.",
+    ]
+    if forecast["question_types"]:
+        points.append("Likely question types: " + ", ".join(
+            f"{label} ({share:.0%})" for label, share in forecast["question_types"]))
+    if forecast["marks"]:
+        points.append("Likely marks: " + ", ".join(
+            f"{label} marks ({share:.0%})" for label, share in forecast["marks"]))
+    if forecast["related_chapters"]:
+        points.append("Often asked alongside: " + ", ".join(
+            f"{chapter} ({share:.0%} of its exams)" for chapter, share in forecast["related_chapters"]))
+    questions = forecast["questions"]
+    lines = ["", "", "Pattern Analysis:"]
+    lines += [f"{number}. {point}" for number, point in enumerate(points, 1)]
+    lines += [
+        "",
+        "Justification:",
+        f"- Based on {questions} past question{'s' if questions != 1 else ''} from this chapter",
+        f"- Exams weighted by recency (half-life of {forecast['half_life']:g} years)",
+    ]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", help="question bank JSONL file")
+    parser.add_argument("--chapter", default=None, help="show one chapter's forecast (default: all)")
+    args = parser.parse_args()
+
+    from pattern_stats import iter_jsonl
+    model = TrendModel.from_records(iter_jsonl(args.questions))
+    forecasts = [model.forecast(args.chapter)] if args.chapter else model.ranking()
+    if not forecasts or forecasts[0] is None:
+        parser.error(f"No questions from '{args.chapter}'")
+    print(json.dumps(forecasts, indent=2, ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+
+class PoolSaturated(Exception):
+    """Raised when the wait queue is full and the request is rejected outright."""
+
+
+class PoolTimeout(Exception):
+    """Raised when a queued request did not get a worker within the queue timeout."""
+
+
+class BoundedExecutor:
+    """Run blocking work off the event loop with bounded concurrency.
+
+    At most ``max_workers`` calls run at once on a dedicated thread pool and
+    at most ``max_queue`` more may wait for a slot. Anything beyond that is
+    rejected immediately with PoolSaturated, and a waiter that does not get
+    a slot within ``queue_timeout`` seconds gets PoolTimeout, so a burst of
+    traffic turns into fast errors instead of an ever-growing backlog.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, queue_timeout: float):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chat-worker")
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of calls that are running or waiting for a worker."""
+        return self._pending
+
+    async def run(self, func: Callable, *args, **kwargs):
+        # Only ever touched from the event loop thread, so no lock is needed
+        if self._pending >= self.max_workers + self.max_queue:
+            raise PoolSaturated()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        self._pending += 1
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise PoolTimeout()
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            finally:
+                self._slots.release()
+        finally:
+            self._pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def create_executor() -> BoundedExecutor:
+    """Build the request executor configured by the CHAT_* environment variables."""
+    return BoundedExecutor(
+        max_workers=int(os.environ.get("CHAT_MAX_WORKERS", 8)),
+        max_queue=int(os.environ.get("CHAT_MAX_QUEUE", 64)),
+        queue_timeout=float(os.environ.get("CHAT_QUEUE_TIMEOUT", 5.0)),
+    )